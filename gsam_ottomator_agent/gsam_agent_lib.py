@@ -3,8 +3,14 @@ GSAM Agent library
 """
 from __future__ import annotations as _annotations
 
-from typing import List, Any
+from typing import List, Any, Callable, AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
 import os
+import json
+import asyncio
+import contextvars
+import functools
+import threading
 from dataclasses import dataclass
 from dotenv import load_dotenv
 
@@ -13,12 +19,20 @@ from pydantic_ai import (
 )
 import logfire
 from fastapi import HTTPException
-from supabase import Client
+from supabase import Client, AsyncClient, acreate_client
 from openai import AsyncOpenAI
 
 from lib.codegen_utilities import log_debug
+from lib.codegen_ai_cache import (
+    embedding_cache,
+    get_embedding_cache_key,
+    normalize_text,
+)
 from lib.codegen_general_lib import GeneralLib
-from lib.codegen_utilities import get_app_config
+from lib.codegen_utilities import (
+    get_app_config,
+    prune_closed_loops_entries,
+)
 from lib.codegen_generation_lib import CodeGenLib
 from lib.codegen_ideation_lib import IdeationLib
 from lib.codegen_app_ideation_lib import (
@@ -35,22 +49,36 @@ MOCK_VIDEOS = False
 
 SIMPLE_PAI_AGENT = os.environ.get("SIMPLE_PAI_AGENT", "false") == "true"
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Texts per embeddings API call
+EMBEDDING_BATCH_SIZE = 100
+
 
 class AppContext:
+    """
+    Request parameters for the agent tools. They're kept in a context
+    variable, so each concurrent agent run (and the tools called by it)
+    sees its own request.
+    """
     def __init__(self, params: dict = None):
-        self.params = params or {}
+        self.params_var = contextvars.ContextVar("app_context_params")
+        self.set_params(params or {})
 
     def set_param(self, param_name: str, param_value: Any):
-        self.params[param_name] = param_value
+        self.get_params()[param_name] = param_value
 
     def get_param(self, param_name: str) -> Any:
-        return self.params.get(param_name)
+        return self.get_params().get(param_name)
 
     def set_params(self, params: dict):
-        self.params = params
+        self.params_var.set(dict(params))
 
     def get_params(self) -> dict:
-        return self.params
+        params = self.params_var.get(None)
+        if params is None:
+            params = {}
+            self.params_var.set(params)
+        return params
 
 
 load_dotenv()
@@ -60,11 +88,83 @@ cgsl = GeneralLib(app_config)
 
 app_context = AppContext({})
 
+# Agent runs executed at the same time by the API. The others wait for a
+# free slot, so a burst of requests can't exhaust the LLM providers quotas
+AGENT_MAX_CONCURRENT_RUNS = int(cgsl.get_par_or_env(
+    "AGENT_MAX_CONCURRENT_RUNS", 8))
+# Worker threads for the tools that call the synchronous libraries
+# (e.g. image and video generation), so they don't block the event loop
+AGENT_TOOLS_MAX_WORKERS = int(cgsl.get_par_or_env(
+    "AGENT_TOOLS_MAX_WORKERS", 8))
+
+agent_tools_executor = ThreadPoolExecutor(
+    max_workers=AGENT_TOOLS_MAX_WORKERS,
+    thread_name_prefix="agent_tool")
+# Concurrent runs semaphores, by event loop. The entries of the closed
+# loops are pruned on each lookup.
+agent_semaphores = {}
+agent_semaphores_lock = threading.Lock()
+
+
+def get_agent_semaphore() -> asyncio.Semaphore:
+    """
+    Returns the agent runs semaphore of the current event loop
+    """
+    loop = asyncio.get_running_loop()
+    with agent_semaphores_lock:
+        prune_closed_loops_entries(agent_semaphores)
+        entry = agent_semaphores.get(id(loop))
+        if entry is None or entry["loop"] is not loop:
+            entry = {
+                "loop": loop,
+                "semaphore": asyncio.Semaphore(AGENT_MAX_CONCURRENT_RUNS),
+            }
+            agent_semaphores[id(loop)] = entry
+        return entry["semaphore"]
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """
+    Runs a synchronous function in the agent tools thread pool, with the
+    caller context (e.g. the app_context request parameters)
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        agent_tools_executor,
+        functools.partial(context.run, func, *args, **kwargs))
+
+
 supabase: Client = Client(
     os.getenv("SUPABASE_URL"),
     os.getenv("SUPABASE_SERVICE_KEY")
 )
 
+# Async Supabase clients, by event loop, because their HTTP connections
+# can't be shared between loops. The entries of the closed loops are
+# pruned on each lookup.
+async_supabase_clients = {}
+
+
+async def get_async_supabase() -> AsyncClient:
+    """
+    Returns the async Supabase client of the current event loop, used by
+    the agent tools and the Supabase agent so the queries don't block it
+    """
+    loop = asyncio.get_running_loop()
+    prune_closed_loops_entries(async_supabase_clients)
+    entry = async_supabase_clients.get(id(loop))
+    if entry is None or entry["loop"] is not loop:
+        client = await acreate_client(
+            os.getenv("SUPABASE_URL"),
+            os.getenv("SUPABASE_SERVICE_KEY")
+        )
+        entry = async_supabase_clients.get(id(loop))
+        # Another request could have created it during the await
+        if entry is None or entry["loop"] is not loop:
+            entry = {"loop": loop, "client": client}
+            async_supabase_clients[id(loop)] = entry
+    return entry["client"]
+
 logfire.configure(send_to_logfire="if-token-present")
 
 system_prompt = cgsl.get_par_value("AGENT_SYSTEM_PROMPT")
@@ -127,10 +227,36 @@ else:
     pydantic_ai_lib.set_pydantic_ai_deps(pydantic_ai_deps)
 
 
+def put_agent_event(event: str, data: dict):
+    """
+    Sends an event to the streaming client of the current agent run, if any
+    """
+    events_queue = app_context.get_param("events_queue")
+    if events_queue is not None:
+        events_queue.put_nowait({"event": event, "data": data})
+
+
+def agent_tool(func: Callable) -> Callable:
+    """
+    Registers an agent tool that reports its calls and returns to the
+    streaming client (see astream_agent())
+    """
+    @functools.wraps(func)
+    async def tool_wrapper(ctx: RunContext, *args, **kwargs):
+        put_agent_event("tool_call", {
+            "tool_name": func.__name__,
+            "args": kwargs or list(args),
+        })
+        result = await func(ctx, *args, **kwargs)
+        put_agent_event("tool_return", {"tool_name": func.__name__})
+        return result
+    return pydantic_ai_agent.tool(tool_wrapper)
+
+
 # GenericSuite tools
 
 
-@pydantic_ai_agent.tool
+@agent_tool
 async def generate_json_and_code(
     ctx: RunContext[PydanticAIDeps], user_query: str
 ) -> str:
@@ -146,7 +272,8 @@ async def generate_json_and_code(
         A JSON and code result
     """
     codegen_lib = CodeGenLib(app_config)
-    result = codegen_lib.process_json_and_code_generation(user_query)
+    result = await run_blocking(
+        codegen_lib.process_json_and_code_generation, user_query)
     return result
 
 
@@ -177,7 +304,7 @@ def get_ideation_result(user_query: str, button_index: int):
     return result
 
 
-@pydantic_ai_agent.tool
+@agent_tool
 async def generate_app_ideas(
     ctx: RunContext[PydanticAIDeps], user_query: str
 ) -> str:
@@ -191,10 +318,10 @@ async def generate_app_ideas(
     Returns:
         The app ideas
     """
-    return get_ideation_result(user_query, 0)
+    return await run_blocking(get_ideation_result, user_query, 0)
 
 
-@pydantic_ai_agent.tool
+@agent_tool
 async def generate_app_name(
     ctx: RunContext[PydanticAIDeps], user_query: str
 ) -> str:
@@ -208,10 +335,10 @@ async def generate_app_name(
     Returns:
         The name suggestions for the app
     """
-    return get_ideation_result(user_query, 1)
+    return await run_blocking(get_ideation_result, user_query, 1)
 
 
-@pydantic_ai_agent.tool
+@agent_tool
 async def generate_app_description(
     ctx: RunContext[PydanticAIDeps], user_query: str
 ) -> str:
@@ -226,10 +353,10 @@ async def generate_app_description(
     Returns:
         A description and database schema of the app
     """
-    return get_ideation_result(user_query, 2)
+    return await run_blocking(get_ideation_result, user_query, 2)
 
 
-@pydantic_ai_agent.tool
+@agent_tool
 async def generate_ppt_slides(
     ctx: RunContext[PydanticAIDeps], user_query: str
 ) -> str:
@@ -243,10 +370,10 @@ async def generate_ppt_slides(
     Returns:
         A URL to the generated PowerPoint presentation
     """
-    return get_ideation_result(user_query, 3)
+    return await run_blocking(get_ideation_result, user_query, 3)
 
 
-@pydantic_ai_agent.tool
+@agent_tool
 async def generate_images(
     ctx: RunContext[PydanticAIDeps],
     user_query: str
@@ -279,7 +406,8 @@ async def generate_images(
                       "hf_img_74d9a262-93cf-47c2-b745-9cd22faa4e29.jpg",
         }
     else:
-        img_gen_result = cgsl.image_generation(user_query)
+        img_gen_result = await run_blocking(cgsl.image_generation,
+                                            user_query)
     if img_gen_result.get("error"):
         raise HTTPException(
             status_code=400,
@@ -295,52 +423,89 @@ async def generate_images(
     return image_name
 
 
-@pydantic_ai_agent.tool
+@agent_tool
 async def generate_video(
     ctx: RunContext[PydanticAIDeps], user_query: str
 ) -> str:
     """
-    Generate a video based on the provided text.
+    Generate a video based on the provided text. The video generation takes
+    several minutes, so it returns right after the request with the URL
+    where the video generation status and video URL can be checked.
 
     Args:
         ctx: The context including the Supabase client and OpenAI client
         user_query: The text to base the video on
 
     Returns:
-        A URL to the generated video
+        A URL to the generated video, or to its generation status
     """
     if MOCK_VIDEOS:
-        video_gen_result = {
-            "error": False,
-            "answer": "https://apiplatform-rhymes-prod-va.s3.amazonaws.com/" +
-                      "20241103031651.mp4",
-        }
-    else:
-        video_gen_result = cgsl.video_generation(user_query)
+        return "https://apiplatform-rhymes-prod-va.s3.amazonaws.com/" + \
+               "20241103031651.mp4"
+    video_gen_result = await run_blocking(cgsl.video_generation,
+                                          user_query,
+                                          settings={"background": True})
     if video_gen_result.get("error"):
         raise HTTPException(
             status_code=400,
             detail=f"{video_gen_result.get('error_message')} [GSAL-GV-E010]"
         )
-    return video_gen_result.get("answer")
+    request = app_context.get_param("http_request")
+    host_name = headers_to_dict(request.get("headers")).get("host")
+    job_id = video_gen_result["job"]["id"]
+    return f"The video is being generated (job ID: {job_id}). Its status" \
+           " and URL will be available at" \
+           f" {request.get('scheme')}://{host_name}/api/video-jobs/{job_id}"
 
 
 # Documentation and embedding tools
 
 
-async def get_embedding(text: str, openai_client: AsyncOpenAI) -> List[float]:
-    """Get embedding vector from OpenAI."""
-    try:
+async def get_embeddings(
+    texts: List[str],
+    openai_client: AsyncOpenAI,
+    model: str = EMBEDDING_MODEL,
+) -> List[List[float]]:
+    """
+    Get the embedding vectors of the texts from OpenAI. The cached ones
+    (same normalized text and model) are not requested again, and the
+    others are requested in batches of EMBEDDING_BATCH_SIZE texts.
+    Errors are raised, so a failed call is never used as a real vector.
+    """
+    embeddings = [None] * len(texts)
+    # Normalized text -> positions in texts, for the ones not cached
+    missing = {}
+    for index, text in enumerate(texts):
+        cache_key = get_embedding_cache_key(text, model)
+        embedding = embedding_cache.get(cache_key) \
+            if embedding_cache.enabled else None
+        if embedding is None:
+            missing.setdefault(normalize_text(text), []).append(index)
+        else:
+            embeddings[index] = embedding
+    missing_texts = list(missing)
+    for start in range(0, len(missing_texts), EMBEDDING_BATCH_SIZE):
+        batch = missing_texts[start:start + EMBEDDING_BATCH_SIZE]
         response = await openai_client.embeddings.create(
-            model="text-embedding-3-small", input=text
+            model=model, input=batch
         )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Error getting embedding: {e}")
-        return [0] * 1536  # Return zero vector on error
+        for item in response.data:
+            text = batch[item.index]
+            if embedding_cache.enabled:
+                embedding_cache.set(get_embedding_cache_key(text, model),
+                                    item.embedding)
+            for index in missing[text]:
+                embeddings[index] = item.embedding
+    return embeddings
+
 
+async def get_embedding(text: str, openai_client: AsyncOpenAI,
+                        model: str = EMBEDDING_MODEL) -> List[float]:
+    """Get embedding vector from OpenAI (cached)."""
+    return (await get_embeddings([text], openai_client, model))[0]
 
-@pydantic_ai_agent.tool
+
+@agent_tool
 async def retrieve_relevant_documentation(
     ctx: RunContext[PydanticAIDeps], user_query: str
 ) -> str:
@@ -362,7 +527,8 @@ async def retrieve_relevant_documentation(
             ctx.deps.openai_client)
 
         # Query Supabase for relevant documents
-        result = ctx.deps.supabase.rpc(
+        async_supabase = await get_async_supabase()
+        result = await async_supabase.rpc(
             "match_site_pages",
             {
                 "query_embedding": query_embedding,
@@ -392,7 +558,7 @@ async def retrieve_relevant_documentation(
         return f"Error retrieving documentation: {str(e)}"
 
 
-@pydantic_ai_agent.tool
+@agent_tool
 async def list_documentation_pages(ctx: RunContext[PydanticAIDeps]
                                    ) -> List[str]:
     """
@@ -403,8 +569,9 @@ async def list_documentation_pages(ctx: RunContext[PydanticAIDeps]
     """
     try:
         # Query Supabase for unique URLs where source is pydantic_ai_docs
-        result = (
-            ctx.deps.supabase.from_("site_pages")
+        async_supabase = await get_async_supabase()
+        result = await (
+            async_supabase.from_("site_pages")
             .select("url")
             .eq("metadata->>source", "pydantic_ai_docs")
             .execute()
@@ -422,7 +589,7 @@ async def list_documentation_pages(ctx: RunContext[PydanticAIDeps]
         return []
 
 
-@pydantic_ai_agent.tool
+@agent_tool
 async def get_page_content(ctx: RunContext[PydanticAIDeps], url: str) -> str:
     """
     Retrieve the full content of a specific documentation page by combining
@@ -437,8 +604,9 @@ async def get_page_content(ctx: RunContext[PydanticAIDeps], url: str) -> str:
     """
     try:
         # Query Supabase for all chunks of this URL, ordered by chunk_number
-        result = (
-            ctx.deps.supabase.from_("site_pages")
+        async_supabase = await get_async_supabase()
+        result = await (
+            async_supabase.from_("site_pages")
             .select("title, content, chunk_number")
             .eq("url", url)
             .eq("metadata->>source", "pydantic_ai_docs")
@@ -472,37 +640,138 @@ async def get_page_content(ctx: RunContext[PydanticAIDeps], url: str) -> str:
 
 def run_agent(user_input: str, messages: list, http_request: dict):
     """
-    Run the agent with streaming text for the user_input prompt,
-    while maintaining the entire conversation in `st.session_state.messages`.
+    Run the agent synchronously for the user_input prompt and the
+    conversation messages. The API endpoints use arun_agent().
     """
+    if get_agent_error_message():
+        return get_agent_error_message()
     # Set app context
     app_context.set_params({
         "http_request": http_request
     })
+    result = pydantic_ai_agent.run_sync(
+        **get_agent_run_params(user_input, messages))
+    log_debug(f">>> run_agent: {result.data}", debug=DEBUG)
+    return result.data
+
 
+def convert_conversation_history(conversation_history: list) -> list:
+    """
+    Converts the messages table rows to the role/content messages
+    expected by run_agent()
+    """
+    messages = []
+    for msg in conversation_history:
+        msg_data = msg["message"]
+        messages.append({
+            "role": msg_data["type"],
+            "content": msg_data["content"],
+        })
+    return messages
+
+
+def get_agent_error_message() -> str:
+    """
+    Returns the agent initialization error message, if any
+    """
     if SIMPLE_PAI_AGENT:
-        # Prepare dependencies
-        deps = PydanticAIDeps(
-            supabase=supabase,
-            openai_client=openai_client
-        )
+        return None
+    return pydantic_ai_lib.get_error_message()
 
-        # Prepare messages
-        pydantic_ai_lib = PydanticAiLib({})
-        messages = pydantic_ai_lib.convert_messages(messages)
 
-        # Run the agent without a stream
-        result = pydantic_ai_agent.run_sync(
-            user_input,
-            deps=deps,
-            message_history=messages,
-        )
-        log_debug(f">>> run_agent: {result.data}")
-    else:
-        pydantic_ai_lib.set_pydantic_ai_agent(pydantic_ai_agent)
-        result = pydantic_ai_lib.run_agent(
-            user_input,
-            messages=messages,
-        )
+def get_agent_run_params(user_input: str, messages: list) -> dict:
+    """
+    Returns the PydanticAI agent run(), run_sync() and run_stream()
+    parameters
+    """
+    if SIMPLE_PAI_AGENT:
+        return {
+            "user_prompt": user_input,
+            "deps": PydanticAIDeps(
+                supabase=supabase,
+                openai_client=openai_client
+            ),
+            "message_history": PydanticAiLib({}).convert_messages(messages),
+        }
+    pydantic_ai_lib.set_pydantic_ai_agent(pydantic_ai_agent)
+    return pydantic_ai_lib.get_run_params(user_input, messages)
 
-    return result
+
+async def arun_agent(user_input: str, messages: list, http_request: dict
+                     ) -> str:
+    """
+    Run the agent in the caller event loop for the user_input prompt and
+    the conversation messages, waiting for a free slot if there are
+    AGENT_MAX_CONCURRENT_RUNS runs in progress. The model calls are
+    awaited and the synchronous tools run in worker threads, so a long
+    run (e.g. a video generation) doesn't stall the other sessions.
+    """
+    if get_agent_error_message():
+        return get_agent_error_message()
+    async with get_agent_semaphore():
+        # Set app context (only visible to this run and its tools)
+        app_context.set_params({
+            "http_request": http_request
+        })
+        result = await pydantic_ai_agent.run(
+            **get_agent_run_params(user_input, messages))
+        log_debug(f">>> arun_agent: {result.data}", debug=DEBUG)
+        return result.data
+
+
+async def astream_agent(user_input: str, messages: list, http_request: dict
+                        ) -> AsyncIterator[dict]:
+    """
+    Run the agent with PydanticAI run_stream(), yielding its events as they
+    happen: "tool_call" and "tool_return" (data: tool_name), "delta"
+    (data: text, the next piece of the answer), and finally "done"
+    (data: text, the complete answer) or "error" (data: error).
+
+    The run is executed in its own task, so the tool events are received
+    while the model is still working.
+    """
+    events_queue = asyncio.Queue()
+
+    async def run_stream():
+        try:
+            if get_agent_error_message():
+                raise ValueError(get_agent_error_message())
+            async with get_agent_semaphore():
+                app_context.set_params({
+                    "http_request": http_request,
+                    "events_queue": events_queue,
+                })
+                run_params = get_agent_run_params(user_input, messages)
+                async with pydantic_ai_agent.run_stream(**run_params) \
+                        as result:
+                    async for text in result.stream_text(delta=True):
+                        put_agent_event("delta", {"text": text})
+                    answer = await result.get_data()
+            put_agent_event("done", {"text": answer})
+        except Exception as e:
+            log_debug(f">>> astream_agent | ERROR: {e}", debug=DEBUG)
+            events_queue.put_nowait({
+                "event": "error",
+                "data": {"error": str(e)},
+            })
+        finally:
+            events_queue.put_nowait(None)
+
+    task = asyncio.create_task(run_stream())
+    try:
+        while True:
+            event = await events_queue.get()
+            if event is None:
+                break
+            yield event
+    finally:
+        # The client disconnected before the end of the run
+        if not task.done():
+            task.cancel()
+
+
+def get_sse_event(event: str, data: dict) -> str:
+    """
+    Returns a server-sent event message
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
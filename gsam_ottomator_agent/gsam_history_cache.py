@@ -0,0 +1,291 @@
+"""
+GSAM Agent conversation history cache
+
+Keeps the last messages of each session, so the next turn is served
+without reading the messages table, and inserts the new messages in
+batches in the background (write-behind). A failed insert is retried with
+exponential backoff, and the messages are kept until they're inserted.
+"""
+from typing import Callable, Awaitable, List, Dict, Optional
+from collections import OrderedDict
+from datetime import datetime, timezone
+import os
+import json
+import time
+import asyncio
+
+from lib.codegen_utilities import log_debug
+
+
+DEBUG = False
+
+DEFAULT_SESSION_HISTORY_LIMIT = 10
+DEFAULT_SESSION_HISTORY_CACHE_TTL = 3600
+DEFAULT_SESSION_HISTORY_CACHE_MAX_SESSIONS = 1000
+# Seconds between the pending messages inserts
+DEFAULT_SESSION_HISTORY_FLUSH_INTERVAL = 1.0
+# Pending messages that trigger an insert before the interval ends
+DEFAULT_SESSION_HISTORY_FLUSH_BATCH_SIZE = 50
+# Maximum seconds between the retries of a failed insert
+DEFAULT_SESSION_HISTORY_FLUSH_MAX_BACKOFF = 60.0
+# Insert attempts on shutdown before giving up the pending messages
+SESSION_HISTORY_CLOSE_MAX_ATTEMPTS = 5
+
+
+class InMemoryHistoryStore:
+    """
+    Session histories store in the process memory, with LRU eviction and
+    expiration
+    """
+    def __init__(self, max_sessions: int, ttl: int):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    async def get(self, session_id: str) -> Optional[List[Dict]]:
+        entry = self.entries.get(session_id)
+        if entry is None:
+            return None
+        if self.ttl and time.time() - entry["updated_at"] > self.ttl:
+            del self.entries[session_id]
+            return None
+        self.entries.move_to_end(session_id)
+        return list(entry["messages"])
+
+    async def set(self, session_id: str, messages: List[Dict]):
+        self.entries[session_id] = {
+            "messages": list(messages),
+            "updated_at": time.time(),
+        }
+        self.entries.move_to_end(session_id)
+        while len(self.entries) > self.max_sessions:
+            self.entries.popitem(last=False)
+
+    async def append(self, session_id: str, message: Dict, limit: int):
+        """
+        Appends the message to a cached history. A history that isn't
+        cached is left alone, so it's read complete from the database.
+        """
+        messages = await self.get(session_id)
+        if messages is None:
+            return
+        messages.append(message)
+        await self.set(session_id, messages[-limit:])
+
+
+class RedisHistoryStore:
+    """
+    Session histories store in Redis (or any Redis compatible server),
+    shared by all the agent processes. Each history is a JSON value with
+    expiration.
+    """
+    def __init__(self, client, ttl: int, key_prefix: str = "gsam_history:"):
+        self.client = client
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    async def get(self, session_id: str) -> Optional[List[Dict]]:
+        value = await self.client.get(f"{self.key_prefix}{session_id}")
+        if value is None:
+            return None
+        return json.loads(value)
+
+    async def set(self, session_id: str, messages: List[Dict]):
+        await self.client.set(
+            f"{self.key_prefix}{session_id}",
+            json.dumps(messages, default=str),
+            ex=self.ttl or None)
+
+    async def append(self, session_id: str, message: Dict, limit: int):
+        messages = await self.get(session_id)
+        if messages is None:
+            return
+        messages.append(message)
+        await self.set(session_id, messages[-limit:])
+
+
+def get_history_store(ttl: int, max_sessions: int):
+    """
+    Returns the Redis store if SESSION_HISTORY_REDIS_URL is set and the
+    redis package is installed, otherwise the in-memory store
+    """
+    redis_url = os.environ.get("SESSION_HISTORY_REDIS_URL")
+    if redis_url:
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            log_debug("get_history_store | redis not installed, using the "
+                      "in-memory store", debug=DEBUG)
+        else:
+            return RedisHistoryStore(redis.from_url(redis_url), ttl)
+    return InMemoryHistoryStore(max_sessions, ttl)
+
+
+class SessionHistoryCache:
+    """
+    Conversation history cache with write-behind of the new messages.
+
+    Args:
+        fetch_func: coroutine function (session_id, limit) returning the
+            session last messages rows, in chronological order.
+        insert_func: coroutine function (rows) inserting the message rows
+            ({"session_id", "message"}) in a single operation.
+    """
+    def __init__(
+        self,
+        fetch_func: Callable[[str, int], Awaitable[List[Dict]]],
+        insert_func: Callable[[List[Dict]], Awaitable[None]],
+    ):
+        self.fetch_func = fetch_func
+        self.insert_func = insert_func
+        self.enabled = os.environ.get(
+            "SESSION_HISTORY_CACHE_ENABLED", "1") == "1"
+        self.history_limit = int(os.environ.get(
+            "SESSION_HISTORY_LIMIT", DEFAULT_SESSION_HISTORY_LIMIT))
+        self.flush_interval = float(os.environ.get(
+            "SESSION_HISTORY_FLUSH_INTERVAL",
+            DEFAULT_SESSION_HISTORY_FLUSH_INTERVAL))
+        self.flush_batch_size = int(os.environ.get(
+            "SESSION_HISTORY_FLUSH_BATCH_SIZE",
+            DEFAULT_SESSION_HISTORY_FLUSH_BATCH_SIZE))
+        self.flush_max_backoff = float(os.environ.get(
+            "SESSION_HISTORY_FLUSH_MAX_BACKOFF",
+            DEFAULT_SESSION_HISTORY_FLUSH_MAX_BACKOFF))
+        self.store = get_history_store(
+            int(os.environ.get("SESSION_HISTORY_CACHE_TTL",
+                               DEFAULT_SESSION_HISTORY_CACHE_TTL)),
+            int(os.environ.get("SESSION_HISTORY_CACHE_MAX_SESSIONS",
+                               DEFAULT_SESSION_HISTORY_CACHE_MAX_SESSIONS)))
+        # Messages not inserted yet. They're removed only after the insert
+        # succeeds, so the histories read meanwhile include them.
+        self.pending = []
+        # Consecutive failed inserts
+        self.flush_failures = 0
+        # Serializes the inserts, and the histories reads with them
+        self.flush_lock = asyncio.Lock()
+        self.flush_event = None
+        self.flush_task = None
+
+    async def get_history(self, session_id: str, limit: int = None
+                          ) -> List[Dict]:
+        """
+        Returns the session last messages, reading the database only if
+        the session history isn't cached
+        """
+        limit = limit or self.history_limit
+        if not self.enabled:
+            return await self.fetch_func(session_id, limit)
+        messages = await self.store.get(session_id)
+        if messages is None:
+            # The lock keeps a batch from being inserted between the read
+            # and the merge, so its messages are in one of them
+            async with self.flush_lock:
+                messages = await self.fetch_func(session_id,
+                                                 self.history_limit)
+                # Messages stored but not inserted yet
+                messages += [row for row in self.pending
+                             if row["session_id"] == session_id]
+            messages = messages[-self.history_limit:]
+            await self.store.set(session_id, messages)
+        return messages[-limit:]
+
+    async def add_message(self, session_id: str, message: Dict):
+        """
+        Adds the message to the session cached history, and queues its
+        insert in the database
+        """
+        row = {
+            "session_id": session_id,
+            "message": message,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if not self.enabled:
+            await self.insert_func([row])
+            return
+        await self.store.append(session_id, row, self.history_limit)
+        self.pending.append(row)
+        self.start_flush_task()
+        if len(self.pending) >= self.flush_batch_size:
+            self.flush_event.set()
+
+    def start_flush_task(self):
+        """
+        Starts the background inserts task in the current event loop
+        """
+        if self.flush_task and not self.flush_task.done():
+            return
+        self.flush_event = asyncio.Event()
+        self.flush_task = asyncio.create_task(self.flush_loop())
+
+    def get_retry_delay(self, failures: int) -> float:
+        """
+        Returns the seconds to wait before retrying a failed insert:
+        flush_interval doubled on each consecutive failure, up to
+        flush_max_backoff
+        """
+        return min(self.flush_interval * 2 ** failures,
+                   self.flush_max_backoff)
+
+    async def flush_loop(self):
+        """
+        Inserts the pending messages every flush_interval seconds, or as
+        soon as there are flush_batch_size of them. After a failed insert,
+        the next one waits for the retry delay.
+        """
+        while self.pending:
+            if self.flush_failures:
+                await asyncio.sleep(self.get_retry_delay(
+                    self.flush_failures))
+            else:
+                try:
+                    await asyncio.wait_for(self.flush_event.wait(),
+                                           self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self.flush_event.clear()
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """
+        Inserts the pending messages in a single operation. The messages
+        are kept pending until the insert succeeds, so a failed batch is
+        retried on the next flush.
+
+        Returns:
+            bool: True if there's no message pending.
+        """
+        async with self.flush_lock:
+            if not self.pending:
+                return True
+            batch = list(self.pending)
+            try:
+                await self.insert_func(batch)
+            except Exception as e:
+                self.flush_failures += 1
+                # Logged unconditionally: the messages are only in memory
+                # until the database is back
+                log_debug(f"SessionHistoryCache.flush | ERROR: {e} | "
+                          f"{len(self.pending)} messages pending, attempt "
+                          f"{self.flush_failures}", debug=True)
+                return False
+            del self.pending[:len(batch)]
+            self.flush_failures = 0
+            log_debug(f"SessionHistoryCache.flush | {len(batch)} messages "
+                      "inserted", debug=DEBUG)
+            return not self.pending
+
+    async def close(self):
+        """
+        Inserts the pending messages on shutdown, retrying a failed insert
+        with backoff up to SESSION_HISTORY_CLOSE_MAX_ATTEMPTS times
+        """
+        for attempt in range(SESSION_HISTORY_CLOSE_MAX_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(self.get_retry_delay(attempt))
+            if await self.flush():
+                break
+        else:
+            log_debug(f"SessionHistoryCache.close | ERROR: {len(self.pending)}"
+                      " messages could not be inserted", debug=True)
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
@@ -1,15 +1,22 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator
 from fastapi import FastAPI, HTTPException, Security, Depends
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from datetime import datetime
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import asyncpg
 import json
 import os
 
-from gsam_ottomator_agent.gsam_agent_lib import run_agent
+from gsam_ottomator_agent.gsam_agent_lib import (
+    arun_agent,
+    astream_agent,
+    convert_conversation_history,
+    get_sse_event,
+)
+from gsam_ottomator_agent.gsam_history_cache import SessionHistoryCache
 
 
 # Load environment variables
@@ -25,7 +32,8 @@ async def lifespan(app: FastAPI):
     global db_pool
     db_pool = await asyncpg.create_pool(os.getenv("DATABASE_URL"))
     yield
-    # Shutdown
+    # Shutdown: insert the messages still pending
+    await history_cache.close()
     if db_pool:
         await db_pool.close()
 
@@ -75,29 +83,57 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)
     return True
 
 
+async def db_fetch_conversation_history(session_id: str, limit: int = 10
+                                        ) -> List[Dict[str, Any]]:
+    """Read the most recent messages of a session from the database."""
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT id, created_at, session_id, message
+            FROM messages
+            WHERE session_id = $1
+            ORDER BY created_at DESC, id DESC
+            LIMIT $2
+        """, session_id, limit)
+        # Convert to list and reverse to get chronological order
+        messages = [
+            {
+                "id": str(row["id"]),
+                "created_at": row["created_at"].isoformat(),
+                "session_id": row["session_id"],
+                "message": row["message"]
+            }
+            for row in rows
+        ]
+        return messages[::-1]
+
+
+async def db_insert_messages(rows: List[Dict[str, Any]]):
+    """
+    Insert several messages in the messages table. The batch is inserted
+    in a single transaction, so each message created_at is inserted
+    explicitly instead of the (same) transaction timestamp.
+    """
+    async with db_pool.acquire() as conn:
+        await conn.executemany("""
+            INSERT INTO messages (session_id, message, created_at)
+            VALUES ($1, $2, $3)
+        """, [
+            (row["session_id"], json.dumps(row["message"]),
+             datetime.fromisoformat(row["created_at"]))
+            for row in rows
+        ])
+
+
+# Sessions history cache, with write-behind of the new messages
+history_cache = SessionHistoryCache(db_fetch_conversation_history,
+                                    db_insert_messages)
+
+
 async def fetch_conversation_history(session_id: str, limit: int = 10
                                      ) -> List[Dict[str, Any]]:
     """Fetch the most recent conversation history for a session."""
     try:
-        async with db_pool.acquire() as conn:
-            rows = await conn.fetch("""
-                SELECT id, created_at, session_id, message
-                FROM messages
-                WHERE session_id = $1
-                ORDER BY created_at DESC
-                LIMIT $2
-            """, session_id, limit)
-            # Convert to list and reverse to get chronological order
-            messages = [
-                {
-                    "id": str(row["id"]),
-                    "created_at": row["created_at"].isoformat(),
-                    "session_id": row["session_id"],
-                    "message": row["message"]
-                }
-                for row in rows
-            ]
-            return messages[::-1]
+        return await history_cache.get_history(session_id, limit)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -106,7 +142,10 @@ async def fetch_conversation_history(session_id: str, limit: int = 10
 
 async def store_message(session_id: str, message_type: str, content: str,
                         data: Optional[Dict] = None):
-    """Store a message in the messages table."""
+    """
+    Store a message in the session history. It's inserted in the messages
+    table in the background.
+    """
     message_obj = {
         "type": message_type,
         "content": content
@@ -115,11 +154,7 @@ async def store_message(session_id: str, message_type: str, content: str,
         message_obj["data"] = data
 
     try:
-        async with db_pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO messages (session_id, message)
-                VALUES ($1, $2)
-            """, session_id, json.dumps(message_obj))
+        await history_cache.add_message(session_id, message_obj)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -137,13 +172,7 @@ async def gsam_postgres_agent(
             request.session_id)
 
         # Convert conversation history to format expected by agent
-        messages = []
-        for msg in conversation_history:
-            msg_data = msg["message"]
-            msg_type = msg_data["type"]
-            msg_content = msg_data["content"]
-            msg = {"role": msg_type, "content": msg_content}
-            messages.append(msg)
+        messages = convert_conversation_history(conversation_history)
 
         # Store user's query
         await store_message(
@@ -163,7 +192,8 @@ async def gsam_postgres_agent(
             - Use request.session_id if you need to insert more messages into
               the DB in the agent logic.
         """
-        agent_response = run_agent(request.query, messages, headers)
+        agent_response = await arun_agent(request.query, messages,
+                                          headers)
 
         # Store agent's response
         await store_message(
@@ -175,3 +205,40 @@ async def gsam_postgres_agent(
         return AgentResponse(success=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def gsam_postgres_agent_stream(
+    request: AgentRequest,
+    authenticated: bool = Depends(verify_token),
+    headers: dict = None,
+) -> AsyncIterator[str]:
+    """
+    Run the agent and yield its events as server-sent events (see
+    astream_agent()). The user query is stored before the run, and the
+    complete answer when the run ends.
+    """
+    conversation_history = await fetch_conversation_history(
+        request.session_id)
+    messages = convert_conversation_history(conversation_history)
+    await store_message(
+        session_id=request.session_id,
+        message_type="human",
+        content=request.query
+    )
+    async for event in astream_agent(request.query, messages, headers):
+        if event["event"] == "done":
+            await store_message(
+                session_id=request.session_id,
+                message_type="assistant",
+                content=event["data"]["text"]
+            )
+        elif event["event"] == "error":
+            await store_message(
+                session_id=request.session_id,
+                message_type="assistant",
+                content="I apologize, but I encountered an error processing"
+                        " your request.",
+                data={"error": event["data"]["error"],
+                      "request_id": request.request_id}
+            )
+        yield get_sse_event(event["event"], event["data"])
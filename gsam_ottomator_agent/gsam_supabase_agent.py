@@ -1,14 +1,22 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator
 import os
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, HTTPException, Security, Depends
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from fastapi.middleware.cors import CORSMiddleware
-from supabase import create_client, Client
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from gsam_ottomator_agent.gsam_agent_lib import run_agent
+from gsam_ottomator_agent.gsam_agent_lib import (
+    arun_agent,
+    astream_agent,
+    convert_conversation_history,
+    get_async_supabase,
+    get_sse_event,
+)
+from gsam_ottomator_agent.gsam_history_cache import SessionHistoryCache
 
 DEBUG = False
 
@@ -17,16 +25,20 @@ load_dotenv()
 
 security = HTTPBearer()
 
-# Supabase setup
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_KEY")
-)
+# The Supabase client is the async one shared with the agent tools
+# (get_async_supabase())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Shutdown: insert the messages still pending
+    await history_cache.close()
 
 
 def init_fastapi_app():
     # Initialize FastAPI app
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
@@ -70,19 +82,48 @@ def verify_token(
     return True
 
 
+async def db_fetch_conversation_history(session_id: str, limit: int = 10
+                                        ) -> List[Dict[str, Any]]:
+    """Read the most recent messages of a session from the database."""
+    async_supabase = await get_async_supabase()
+    response = await async_supabase.table("messages") \
+        .select("*") \
+        .eq("session_id", session_id) \
+        .order("created_at", desc=True) \
+        .order("id", desc=True) \
+        .limit(limit) \
+        .execute()
+    # Convert to list and reverse to get chronological order
+    return response.data[::-1]
+
+
+async def db_insert_messages(rows: List[Dict[str, Any]]):
+    """
+    Insert several messages in the Supabase messages table. The batch is
+    inserted in a single transaction, so each message created_at is
+    inserted explicitly instead of the (same) transaction timestamp.
+    """
+    async_supabase = await get_async_supabase()
+    await async_supabase.table("messages").insert([
+        {
+            "session_id": row["session_id"],
+            "message": row["message"],
+            "created_at": row["created_at"],
+        }
+        for row in rows
+    ]).execute()
+
+
+# Sessions history cache, with write-behind of the new messages
+history_cache = SessionHistoryCache(db_fetch_conversation_history,
+                                    db_insert_messages)
+
+
 async def fetch_conversation_history(session_id: str, limit: int = 10
                                      ) -> List[Dict[str, Any]]:
     """Fetch the most recent conversation history for a session."""
     try:
-        response = supabase.table("messages") \
-            .select("*") \
-            .eq("session_id", session_id) \
-            .order("created_at", desc=True) \
-            .limit(limit) \
-            .execute()
-        # Convert to list and reverse to get chronological order
-        messages = response.data[::-1]
-        return messages
+        return await history_cache.get_history(session_id, limit)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -91,7 +132,10 @@ async def fetch_conversation_history(session_id: str, limit: int = 10
 
 async def store_message(session_id: str, message_type: str, content: str,
                         data: Optional[Dict] = None):
-    """Store a message in the Supabase messages table."""
+    """
+    Store a message in the session history. It's inserted in the Supabase
+    messages table in the background.
+    """
     message_obj = {
         "type": message_type,
         "content": content
@@ -100,10 +144,7 @@ async def store_message(session_id: str, message_type: str, content: str,
         message_obj["data"] = data
 
     try:
-        supabase.table("messages").insert({
-            "session_id": session_id,
-            "message": message_obj
-        }).execute()
+        await history_cache.add_message(session_id, message_obj)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -121,15 +162,7 @@ async def gsam_supabase_agent(
             request.session_id)
 
         # Convert conversation history to format expected by agent
-        # This will be different depending on your framework (Pydantic AI,
-        # LangChain, etc.)
-        messages = []
-        for msg in conversation_history:
-            msg_data = msg["message"]
-            msg_type = msg_data["type"]
-            msg_content = msg_data["content"]
-            msg = {"role": msg_type, "content": msg_content}
-            messages.append(msg)
+        messages = convert_conversation_history(conversation_history)
 
         # Store user's query
         await store_message(
@@ -149,7 +182,8 @@ async def gsam_supabase_agent(
             - Use request.session_id if you need to insert more messages into
               the DB in the agent logic.
         """
-        agent_response = run_agent(request.query, messages, http_request)
+        agent_response = await arun_agent(request.query, messages,
+                                          http_request)
 
         # Store agent's response
         await store_message(
@@ -174,3 +208,41 @@ async def gsam_supabase_agent(
         if DEBUG:
             raise e
         return AgentResponse(success=False)
+
+
+async def gsam_supabase_agent_stream(
+    request: AgentRequest,
+    authenticated: bool = Depends(verify_token),
+    http_request: dict = None,
+) -> AsyncIterator[str]:
+    """
+    Run the agent and yield its events as server-sent events (see
+    astream_agent()). The user query is stored before the run, and the
+    complete answer when the run ends.
+    """
+    conversation_history = await fetch_conversation_history(
+        request.session_id)
+    messages = convert_conversation_history(conversation_history)
+    await store_message(
+        session_id=request.session_id,
+        message_type="human",
+        content=request.query
+    )
+    async for event in astream_agent(request.query, messages, http_request):
+        if event["event"] == "done":
+            await store_message(
+                session_id=request.session_id,
+                message_type="ai",
+                content=event["data"]["text"],
+                data={"request_id": request.request_id}
+            )
+        elif event["event"] == "error":
+            await store_message(
+                session_id=request.session_id,
+                message_type="ai",
+                content="I apologize, but I encountered an error processing"
+                        " your request.",
+                data={"error": event["data"]["error"],
+                      "request_id": request.request_id}
+            )
+        yield get_sse_event(event["event"], event["data"])
@@ -6,14 +6,21 @@ from dotenv import load_dotenv
 
 from pydantic import BaseModel
 from fastapi import Depends, HTTPException, Request
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
 # from lib.codegen_utilities import log_debug
+from lib.codegen_ai_cache import (
+    get_llm_cache_stats,
+    get_prompt_enhancement_cache_stats,
+    get_embedding_cache_stats,
+)
+from lib.codegen_video_jobs import video_job_manager
 
 from gsam_ottomator_agent.gsam_supabase_agent import (
     init_fastapi_app as init_fastapi_app_supabase,
     verify_token as verify_token_supabase,
     gsam_supabase_agent,
+    gsam_supabase_agent_stream,
     AgentRequest as SupaBaseAgentRequest,
     AgentResponse as SupaBaseAgentResponse
 )
@@ -21,6 +28,7 @@ from gsam_ottomator_agent.gsam_postgres_agent import (
     init_fastapi_app as init_fastapi_app_postgres,
     verify_token as verify_token_postgres,
     gsam_postgres_agent,
+    gsam_postgres_agent_stream,
     AgentRequest as PostgresAgentRequest,
     AgentResponse as PostgresAgentResponse
 )
@@ -84,6 +92,35 @@ async def gsam_postgres_agent_endpoint(
     return result
 
 
+@app.post("/api/gsam-agent/stream")
+async def gsam_agent_stream_endpoint(
+    agent_request: SupaBaseAgentRequest,
+    authenticated: bool = Depends(
+        verify_token_supabase if agent_db_type == "supabase"
+        else verify_token_postgres),
+    request: Request = None
+):
+    """
+    Run the agent and stream the answer text deltas and the tool calls as
+    server-sent events, storing the messages in the agent database
+    """
+    if agent_db_type == "supabase":
+        events = gsam_supabase_agent_stream(agent_request, authenticated,
+                                            dict(request))
+    else:
+        events = gsam_postgres_agent_stream(agent_request, authenticated,
+                                            dict(request))
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Disable the reverse proxies buffering (e.g. nginx)
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
 @app.get("/api/image/{image_name}")
 async def get_image(image_name: str):
     image_path = f"./images/{image_name}"
@@ -93,3 +130,35 @@ async def get_image(image_name: str):
             detail=f"Image {image_name} not found")
     # return FileResponse(image_path, media_type="image/jpg")
     return FileResponse(image_path)
+
+
+@app.get("/api/video-jobs/{job_id}")
+async def get_video_job(
+    job_id: str,
+    authenticated: bool = Depends(
+        verify_token_supabase if agent_db_type == "supabase"
+        else verify_token_postgres),
+):
+    """
+    Returns the state of a video generation job submitted by the agent,
+    with the video URL once it's completed
+    """
+    job = video_job_manager.get_job(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Video job {job_id} not found")
+    return job
+
+
+@app.get("/api/llm-cache-stats")
+async def llm_cache_stats(
+    authenticated: bool = Depends(
+        verify_token_supabase if agent_db_type == "supabase"
+        else verify_token_postgres),
+):
+    return {
+        "llm_responses": get_llm_cache_stats(),
+        "prompt_enhancements": get_prompt_enhancement_cache_stats(),
+        "embeddings": get_embedding_cache_stats(),
+    }
@@ -1,9 +1,19 @@
 """
 LLM provider abstract class
 """
+from typing import Iterator
+import asyncio
+
 from lib.codegen_utilities import get_default_resultset
 from lib.codegen_utilities import log_debug
 from lib.codegen_ai_abstracts_constants import DEFAULT_PROMPT_ENHANCEMENT_TEXT
+from lib.codegen_ai_cache import (
+    LLM_CACHE_SAMPLING_PARAMS,
+    llm_response_cache,
+    prompt_enhancement_cache,
+    get_llm_cache_key,
+    normalize_text,
+)
 
 
 DEBUG = False
@@ -130,6 +140,72 @@ class LlmProviderAbstract:
         """
         raise NotImplementedError
 
+    async def aquery(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Async version of query(). Providers without a native async client
+        run the synchronous query in a worker thread, so the event loop is
+        not blocked.
+        """
+        return await asyncio.to_thread(
+            self.query,
+            prompt,
+            question,
+            prompt_enhancement_text,
+            unified)
+
+    def query_stream(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Perform a LLM request streaming the response tokens.
+        Providers without streaming support return the complete response
+        as a single chunk.
+
+        Returns:
+            dict: a standard response with the "stream" attribute, a
+                generator of text chunks. Once it's consumed, the
+                "response" attribute has the complete text, and "error"
+                and "error_message" report any error raised while
+                streaming.
+        """
+        response = self.query(prompt, question, prompt_enhancement_text,
+                              unified)
+        if response['error']:
+            return response
+        full_response = response['response']
+        response['response'] = ""
+        response['stream'] = self.stream_chunks(response,
+                                                iter([full_response]))
+        return response
+
+    def stream_chunks(self, response: dict, chunks: Iterator[str]
+                      ) -> Iterator[str]:
+        """
+        Yields the text chunks, accumulating them in response['response'].
+        Errors are reported in the response instead of being raised, so
+        the caller can consume the stream and then check response['error'].
+        """
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                response['response'] += chunk
+                yield chunk
+        except Exception as e:
+            response['error'] = True
+            response['error_message'] = str(e)
+            log_debug(f"STREAM_CHUNKS | ERROR: {e}", debug=DEBUG)
+
     def video_gen(
         self,
         question: str,
@@ -161,6 +237,55 @@ class LlmProviderAbstract:
         """
         raise NotImplementedError
 
+    def video_gen_check(self, request_response: dict) -> dict:
+        """
+        Perform a single video generation request check, without waiting.
+        response['finished'] is False while the video is being generated.
+        """
+        raise NotImplementedError
+
+    async def avideo_gen(
+        self,
+        question: str,
+        prompt_enhancement_text: str = None
+    ) -> dict:
+        """
+        Async version of video_gen()
+        """
+        return await asyncio.to_thread(
+            self.video_gen, question, prompt_enhancement_text)
+
+    async def aimage_gen(
+        self,
+        question: str,
+        prompt_enhancement_text: str = None,
+        image_extension: str = 'jpg',
+    ) -> dict:
+        """
+        Async version of image_gen()
+        """
+        return await asyncio.to_thread(
+            self.image_gen, question, prompt_enhancement_text,
+            image_extension)
+
+    async def avideo_gen_followup(
+        self,
+        request_response: dict,
+        wait_time: int = 60
+    ):
+        """
+        Async version of video_gen_followup()
+        """
+        return await asyncio.to_thread(
+            self.video_gen_followup, request_response, wait_time)
+
+    async def avideo_gen_check(self, request_response: dict) -> dict:
+        """
+        Async version of video_gen_check()
+        """
+        return await asyncio.to_thread(self.video_gen_check,
+                                       request_response)
+
     def query_from_text_model(
         self,
         prompt: str,
@@ -179,6 +304,144 @@ class LlmProviderAbstract:
             prompt_enhancement_text,
             unified)
 
+    async def aquery_from_text_model(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Async version of query_from_text_model()
+        """
+        result = get_default_resultset()
+        if not self.params.get("text_model_class"):
+            result["error"] = True
+            result["error_message"] = "Text model class not provided"
+            return result
+        return await self.params["text_model_class"].aquery(
+            prompt,
+            question,
+            prompt_enhancement_text,
+            unified)
+
+    def get_query_model_name(self) -> str:
+        """
+        Returns the model name sent in the query parameters, which the
+        providers resolve from their params or environment variables
+        (e.g. OPENAI_MODEL) when model_name is not set
+        """
+        get_query_model_params = getattr(
+            self, "get_query_model_params", None)
+        if not get_query_model_params:
+            return self.model_name
+        model_params = get_query_model_params({"messages": []})
+        return model_params.get("model") or self.model_name
+
+    def get_query_cache_key(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Returns the LLM responses cache key and the sampling parameters
+        for a query: a hash of the provider, model, normalized messages,
+        prompt enhancement text and sampling parameters
+        """
+        sampling_params = {
+            key: self.params.get(key)
+            for key in LLM_CACHE_SAMPLING_PARAMS
+            if self.params.get(key) is not None
+        }
+        messages = [
+            {
+                "role": message["role"],
+                "content": normalize_text(message["content"]),
+            }
+            for message in self.get_messages_array(
+                system_prompt=prompt,
+                user_input=question or "",
+                unified=unified,
+            )
+        ]
+        return {
+            "cache_key": get_llm_cache_key({
+                "provider": self.provider,
+                "model": self.get_query_model_name(),
+                "messages": messages,
+                "prompt_enhancement_text":
+                    normalize_text(prompt_enhancement_text),
+                "sampling_params": sampling_params,
+            }),
+            "sampling_params": sampling_params,
+        }
+
+    def query_with_cache(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+        cache_ttl: int = None,
+    ) -> dict:
+        """
+        Perform a LLM query, returning the cached response if the same
+        request was done before.
+
+        Args:
+            cache_ttl (int): seconds the response is kept in the cache.
+                None means the LLM_CACHE_TTL default, 0 means no cache.
+                Defaults to None.
+        """
+        cache_data = self.get_query_cache_key(
+            prompt, question, prompt_enhancement_text, unified)
+        if llm_response_cache.must_bypass(cache_data["sampling_params"],
+                                          cache_ttl):
+            llm_response_cache.count_bypass()
+            return self.query(prompt, question, prompt_enhancement_text,
+                              unified)
+        cached_response = llm_response_cache.get(cache_data["cache_key"])
+        if cached_response is not None:
+            log_debug("QUERY_WITH_CACHE | cache hit: "
+                      f"{cache_data['cache_key']}", debug=DEBUG)
+            return dict(cached_response)
+        response = self.query(prompt, question, prompt_enhancement_text,
+                              unified)
+        if not response.get("error"):
+            llm_response_cache.set(cache_data["cache_key"], response,
+                                   cache_ttl)
+        return response
+
+    async def aquery_with_cache(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+        cache_ttl: int = None,
+    ) -> dict:
+        """
+        Async version of query_with_cache()
+        """
+        cache_data = self.get_query_cache_key(
+            prompt, question, prompt_enhancement_text, unified)
+        if llm_response_cache.must_bypass(cache_data["sampling_params"],
+                                          cache_ttl):
+            llm_response_cache.count_bypass()
+            return await self.aquery(prompt, question,
+                                     prompt_enhancement_text, unified)
+        cached_response = llm_response_cache.get(cache_data["cache_key"])
+        if cached_response is not None:
+            return dict(cached_response)
+        response = await self.aquery(prompt, question,
+                                     prompt_enhancement_text, unified)
+        if not response.get("error"):
+            llm_response_cache.set(cache_data["cache_key"], response,
+                                   cache_ttl)
+        return response
+
     def prompt_enhancer(
         self,
         question: str,
@@ -187,7 +450,6 @@ class LlmProviderAbstract:
         """
         Perform a prompt enhancement request
         """
-        response = get_default_resultset()
         if not prompt_enhancement_text:
             prompt_enhancement_text = DEFAULT_PROMPT_ENHANCEMENT_TEXT
         log_debug("PROMPT_ENHANCER"
@@ -196,7 +458,63 @@ class LlmProviderAbstract:
                   "\n | question:"
                   f"\n{question}",
                   debug=DEBUG)
+        cache_key = self.get_prompt_enhancement_cache_key(
+            question, prompt_enhancement_text)
+        cached_response = prompt_enhancement_cache.get(cache_key)
+        if cached_response is not None:
+            log_debug(f"PROMPT_ENHANCER | cache hit: {cache_key}",
+                      debug=DEBUG)
+            return dict(cached_response)
         llm_response = self.query(prompt_enhancement_text, question)
+        response = self.get_enhanced_prompt_response(llm_response)
+        if not response['error']:
+            prompt_enhancement_cache.set(cache_key, response)
+        return response
+
+    async def aprompt_enhancer(
+        self,
+        question: str,
+        prompt_enhancement_text: str = None
+    ) -> dict:
+        """
+        Async version of prompt_enhancer()
+        """
+        if not prompt_enhancement_text:
+            prompt_enhancement_text = DEFAULT_PROMPT_ENHANCEMENT_TEXT
+        cache_key = self.get_prompt_enhancement_cache_key(
+            question, prompt_enhancement_text)
+        cached_response = prompt_enhancement_cache.get(cache_key)
+        if cached_response is not None:
+            return dict(cached_response)
+        llm_response = await self.aquery(prompt_enhancement_text, question)
+        response = self.get_enhanced_prompt_response(llm_response)
+        if not response['error']:
+            prompt_enhancement_cache.set(cache_key, response)
+        return response
+
+    def get_prompt_enhancement_cache_key(
+        self,
+        question: str,
+        prompt_enhancement_text: str,
+    ) -> str:
+        """
+        Returns the refined prompts cache key: a hash of the enhancement
+        text, the original prompt and the model
+        """
+        return get_llm_cache_key({
+            "prompt_enhancement_text": normalize_text(
+                prompt_enhancement_text),
+            "prompt": normalize_text(question),
+            "provider": self.provider,
+            "model": self.get_query_model_name(),
+        })
+
+    def get_enhanced_prompt_response(self, llm_response: dict) -> dict:
+        """
+        Returns the standard response with the cleaned refined prompt
+        from a prompt enhancement LLM response
+        """
+        response = get_default_resultset()
         log_debug("PROMPT_ENHANCER | llm_response: " + f"{llm_response}",
                   debug=DEBUG)
         if llm_response['error']:
@@ -314,6 +632,57 @@ class LlmProviderAbstract:
                     "refined_prompt": str,
                 }
         """
+        response = self.init_prompts_and_messages(system_prompt, user_input)
+        enhancement_target = self.get_enhancement_target(response)
+        if prompt_enhancement_text and enhancement_target:
+            llm_response = self.prompt_enhancer(
+                response[enhancement_target], prompt_enhancement_text)
+            if llm_response['error']:
+                return llm_response
+            self.apply_enhancement(response, enhancement_target,
+                                   llm_response)
+        response["messages"] = self.get_messages_array(
+            system_prompt=response["system_prompt"],
+            user_input=response["user_input"],
+            unified=unified,
+        )
+        return response
+
+    async def aget_prompts_and_messages(
+        self,
+        system_prompt: str,
+        user_input: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Async version of get_prompts_and_messages()
+        """
+        response = self.init_prompts_and_messages(system_prompt, user_input)
+        enhancement_target = self.get_enhancement_target(response)
+        if prompt_enhancement_text and enhancement_target:
+            llm_response = await self.aprompt_enhancer(
+                response[enhancement_target], prompt_enhancement_text)
+            if llm_response['error']:
+                return llm_response
+            self.apply_enhancement(response, enhancement_target,
+                                   llm_response)
+        response["messages"] = self.get_messages_array(
+            system_prompt=response["system_prompt"],
+            user_input=response["user_input"],
+            unified=unified,
+        )
+        return response
+
+    def init_prompts_and_messages(
+        self,
+        system_prompt: str,
+        user_input: str,
+    ) -> dict:
+        """
+        Returns the initial get_prompts_and_messages() response, before the
+        prompt enhancement and the messages array generation
+        """
         response = get_default_resultset()
         # "system_prompt" attributte in the response will be empty if
         # not system_prompt provided or equals to "{question}",
@@ -323,45 +692,37 @@ class LlmProviderAbstract:
             or system_prompt != "{question}" else ""
         response["user_input"] = user_input
         response["refined_prompt"] = None
+        return response
 
-        if not prompt_enhancement_text:
-            response["messages"] = self.get_messages_array(
-                system_prompt=response["system_prompt"],
-                user_input=response["user_input"],
-                unified=unified,
-            )
-            return response
-
+    def get_enhancement_target(self, response: dict) -> str:
+        """
+        Returns the response attribute to be refined by the prompt
+        enhancement: "system_prompt", "user_input" or None if there's
+        nothing to refine
+        """
         if response["system_prompt"] and \
            response["system_prompt"] != "{question}":
             # Refine only the system prompt...
-            llm_response = self.prompt_enhancer(
-                response["system_prompt"], prompt_enhancement_text)
-            if llm_response['error']:
-                return llm_response
-            response["refined_prompt"] = llm_response['response'] if \
-                llm_response['response'] != response["system_prompt"] \
-                else None
-            response["system_prompt"] = llm_response['response']
-        else:
-            # There's no system prompt, so the user input has or is the
-            # prompt... lets refine it
-            if response["user_input"]:
-                llm_response = self.prompt_enhancer(
-                    response["user_input"], prompt_enhancement_text)
-                if llm_response['error']:
-                    return llm_response
-                response["refined_prompt"] = llm_response['response'] if \
-                    llm_response['response'] != response["user_input"] \
-                    else None
-                response["user_input"] = llm_response['response']
-
-        response["messages"] = self.get_messages_array(
-            system_prompt=response["system_prompt"],
-            user_input=response["user_input"],
-            unified=unified,
-        )
-        return response
+            return "system_prompt"
+        # There's no system prompt, so the user input has or is the
+        # prompt... lets refine it
+        if response["user_input"]:
+            return "user_input"
+        return None
+
+    def apply_enhancement(
+        self,
+        response: dict,
+        enhancement_target: str,
+        llm_response: dict,
+    ) -> None:
+        """
+        Assigns the refined prompt to the response enhancement target
+        """
+        response["refined_prompt"] = llm_response['response'] if \
+            llm_response['response'] != response[enhancement_target] \
+            else None
+        response[enhancement_target] = llm_response['response']
 
     def get_model_args(
         self,
@@ -0,0 +1,308 @@
+"""
+LLM responses cache
+
+Content-addressed cache for the LLM responses, keyed on a hash of the
+provider, model, normalized messages and sampling parameters, so identical
+requests (conversation titles, default suggestions) don't hit the provider
+each time.
+
+It has an in-memory LRU tier and an optional on-disk SQLite tier
+(LLM_CACHE_DB_PATH), so cached responses survive restarts.
+
+The refined prompts from the prompt enhancement have their own persistent
+cache (prompt_enhancement_cache), keyed on the enhancement text, original
+prompt and model, and so do the text embeddings (embedding_cache), keyed on
+the normalized text and model.
+"""
+from typing import Any
+from collections import OrderedDict
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+from lib.codegen_utilities import (
+    log_debug,
+    create_dirs,
+)
+
+
+DEBUG = False
+
+# Maximum number of responses in the in-memory tier
+DEFAULT_LLM_CACHE_MAX_ENTRIES = 500
+# Default time-to-live in seconds. 0 means the responses are not cached
+# unless the call site specifies its own TTL
+DEFAULT_LLM_CACHE_TTL = 0
+
+# Refined prompts are kept 30 days by default. A new prompt version (e.g. an
+# edited system prompt file) gets a new key, so it's refined again anyway
+DEFAULT_PROMPT_ENHANCEMENT_CACHE_TTL = 30 * 86400
+DEFAULT_PROMPT_ENHANCEMENT_CACHE_DB_PATH = "./db/prompt_enhancements.sqlite"
+
+# Embeddings don't change for the same text and model
+DEFAULT_EMBEDDING_CACHE_TTL = 30 * 86400
+DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES = 2000
+DEFAULT_EMBEDDING_CACHE_DB_PATH = "./db/embeddings_cache.sqlite"
+
+# Model parameters that change the LLM response
+LLM_CACHE_SAMPLING_PARAMS = [
+    "temperature", "top_p", "top_k", "max_tokens", "frequency_penalty",
+    "presence_penalty", "repetition_penalty", "stop", "seed",
+]
+
+
+def normalize_text(text: str) -> str:
+    """
+    Returns the text with its whitespaces collapsed, so prompts that only
+    differ in spacing or line breaks share the same cache key
+    """
+    return " ".join(str(text or "").split())
+
+
+def get_llm_cache_key(key_data: dict) -> str:
+    """
+    Returns the SHA-256 hash of the cache key elements
+    """
+    return hashlib.sha256(
+        json.dumps(key_data, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def get_embedding_cache_key(text: str, model: str) -> str:
+    """
+    Returns the embeddings cache key for a text and embedding model
+    """
+    return get_llm_cache_key({
+        "text": normalize_text(text),
+        "model": model,
+    })
+
+
+class LlmResponseCache:
+    """
+    LLM responses cache with an in-memory LRU tier and an optional SQLite
+    tier, TTL per entry and hit/miss counters
+    """
+    def __init__(self, params: dict = None):
+        self.params = params or {}
+        self.enabled = str(self.params.get(
+            "enabled", os.environ.get("LLM_CACHE_ENABLED", "1"))) == "1"
+        self.max_entries = int(self.params.get(
+            "max_entries", os.environ.get("LLM_CACHE_MAX_ENTRIES",
+                                          DEFAULT_LLM_CACHE_MAX_ENTRIES)))
+        self.default_ttl = int(self.params.get(
+            "default_ttl", os.environ.get("LLM_CACHE_TTL",
+                                          DEFAULT_LLM_CACHE_TTL)))
+        self.skip_non_zero_temperature = str(self.params.get(
+            "skip_non_zero_temperature",
+            os.environ.get("LLM_CACHE_SKIP_NON_ZERO_TEMPERATURE", "0"))) \
+            == "1"
+        self.db_path = self.params.get(
+            "db_path", os.environ.get("LLM_CACHE_DB_PATH"))
+        self.table_name = self.params.get("table_name", "llm_cache")
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        self.stats = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+    def get_db(self) -> sqlite3.Connection:
+        """
+        Returns the SQLite tier connection, or None if it's not configured
+        """
+        if not self.db_path:
+            return None
+        if self.db is None:
+            create_dirs(os.path.dirname(self.db_path) or ".")
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table_name} ("
+                " cache_key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)")
+            self.db.commit()
+        return self.db
+
+    def get_ttl(self, cache_ttl: int = None) -> int:
+        """
+        Returns the TTL for a call: the call site TTL if specified, or the
+        default TTL
+        """
+        return self.default_ttl if cache_ttl is None else int(cache_ttl)
+
+    def must_bypass(self, model_params: dict, cache_ttl: int = None
+                    ) -> bool:
+        """
+        Returns True if the call must not use the cache: cache disabled,
+        zero TTL, or non-zero temperature when the bypass is requested
+        """
+        if not self.enabled or self.get_ttl(cache_ttl) <= 0:
+            return True
+        if self.skip_non_zero_temperature and \
+           float(model_params.get("temperature") or 0) != 0:
+            return True
+        return False
+
+    def get(self, cache_key: str) -> Any:
+        """
+        Returns the cached response, or None if it's not cached, expired,
+        or the cache is disabled
+        """
+        if not self.enabled:
+            self.count_bypass()
+            return None
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry:
+                if entry["expires_at"] > now:
+                    self.entries.move_to_end(cache_key)
+                    self.stats["hits"] += 1
+                    self.stats["memory_hits"] += 1
+                    return entry["response"]
+                del self.entries[cache_key]
+            db = self.get_db()
+            if db is not None:
+                row = db.execute(
+                    f"SELECT response, expires_at FROM {self.table_name}"
+                    " WHERE cache_key = ?", (cache_key,)).fetchone()
+                if row and row[1] > now:
+                    response = json.loads(row[0])
+                    self.set_memory_entry(cache_key, response, row[1])
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                    return response
+                if row:
+                    db.execute(f"DELETE FROM {self.table_name}"
+                               " WHERE cache_key = ?", (cache_key,))
+                    db.commit()
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, cache_key: str, response: Any, cache_ttl: int = None):
+        """
+        Stores a response in the cache tiers, unless the cache is disabled
+        """
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.get_ttl(cache_ttl)
+        with self.lock:
+            self.set_memory_entry(cache_key, response, expires_at)
+            self.stats["stores"] += 1
+            db = self.get_db()
+            if db is not None:
+                try:
+                    db.execute(
+                        f"INSERT OR REPLACE INTO {self.table_name}"
+                        " (cache_key, response, expires_at)"
+                        " VALUES (?, ?, ?)",
+                        (cache_key, json.dumps(response, default=str),
+                         expires_at))
+                    db.commit()
+                except sqlite3.Error as e:
+                    log_debug(f"LlmResponseCache.set | ERROR: {e}",
+                              debug=DEBUG)
+
+    def set_memory_entry(self, cache_key: str, response: Any,
+                         expires_at: float):
+        """
+        Stores a response in the in-memory tier, evicting the least
+        recently used entries. The caller must hold the cache lock.
+        """
+        self.entries[cache_key] = {
+            "response": response,
+            "expires_at": expires_at,
+        }
+        self.entries.move_to_end(cache_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def count_bypass(self):
+        """
+        Counts a call that didn't use the cache
+        """
+        with self.lock:
+            self.stats["bypassed"] += 1
+
+    def get_stats(self) -> dict:
+        """
+        Returns the cache hit/miss counters and the current size
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) \
+            if lookups else 0.0
+        return stats
+
+    def clear(self):
+        """
+        Removes all the cached responses from both tiers
+        """
+        with self.lock:
+            self.entries = OrderedDict()
+            db = self.get_db()
+            if db is not None:
+                db.execute(f"DELETE FROM {self.table_name}")
+                db.commit()
+
+
+llm_response_cache = LlmResponseCache()
+
+# Refined prompts memoization, persisted across restarts, so each prompt
+# version is enhanced once instead of on every request
+prompt_enhancement_cache = LlmResponseCache({
+    "enabled": os.environ.get("PROMPT_ENHANCEMENT_CACHE_ENABLED", "1"),
+    "default_ttl": os.environ.get("PROMPT_ENHANCEMENT_CACHE_TTL",
+                                  DEFAULT_PROMPT_ENHANCEMENT_CACHE_TTL),
+    "db_path": os.environ.get("PROMPT_ENHANCEMENT_CACHE_DB_PATH",
+                              DEFAULT_PROMPT_ENHANCEMENT_CACHE_DB_PATH),
+    "table_name": "prompt_enhancements",
+    "skip_non_zero_temperature": "0",
+})
+
+# Text embeddings (e.g. the RAG queries), persisted across restarts
+embedding_cache = LlmResponseCache({
+    "enabled": os.environ.get("EMBEDDING_CACHE_ENABLED", "1"),
+    "max_entries": os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES",
+                                  DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES),
+    "default_ttl": os.environ.get("EMBEDDING_CACHE_TTL",
+                                  DEFAULT_EMBEDDING_CACHE_TTL),
+    "db_path": os.environ.get("EMBEDDING_CACHE_DB_PATH",
+                              DEFAULT_EMBEDDING_CACHE_DB_PATH),
+    "table_name": "embeddings",
+    "skip_non_zero_temperature": "0",
+})
+
+
+def get_llm_cache_stats() -> dict:
+    """
+    Returns the LLM responses cache hit/miss counters
+    """
+    return llm_response_cache.get_stats()
+
+
+def get_prompt_enhancement_cache_stats() -> dict:
+    """
+    Returns the prompt enhancement cache hit/miss counters
+    """
+    return prompt_enhancement_cache.get_stats()
+
+
+def get_embedding_cache_stats() -> dict:
+    """
+    Returns the embeddings cache hit/miss counters
+    """
+    return embedding_cache.get_stats()
@@ -0,0 +1,312 @@
+"""
+LLM clients registry
+
+Process-wide registry of LLM SDK clients (OpenAI, Groq, Together AI, etc.)
+so each (client class, base_url, api_key, timeout settings) combination
+reuses the same client and its warm keep-alive connection pool, instead of
+building a new one (with its DNS lookup and TLS handshake) on every query.
+"""
+from typing import Any, Callable
+import os
+import time
+import asyncio
+import threading
+
+import httpx
+
+from lib.codegen_utilities import log_debug
+
+
+DEBUG = False
+
+# Maximum number of simultaneous connections per client
+DEFAULT_MAX_CONNECTIONS = 20
+# Maximum number of idle keep-alive connections per client
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 10
+# Seconds an idle keep-alive connection is kept open
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+# Seconds a client can stay unused before being closed and evicted
+DEFAULT_CLIENT_IDLE_TIMEOUT = 600.0
+
+
+def get_env_number(var_name: str, default_value: float) -> float:
+    """
+    Returns the environment variable value as a number, or the default
+    value if it's not set or invalid
+    """
+    try:
+        return float(os.environ.get(var_name, default_value))
+    except (TypeError, ValueError):
+        return default_value
+
+
+class LlmClientRegistry:
+    """
+    Registry of reusable LLM clients, keyed by the client class and its
+    connection settings
+    """
+    def __init__(self, params: dict = None):
+        self.params = params or {}
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.max_connections = int(self.params.get(
+            "max_connections",
+            get_env_number("LLM_CLIENT_MAX_CONNECTIONS",
+                           DEFAULT_MAX_CONNECTIONS)))
+        self.max_keepalive_connections = int(self.params.get(
+            "max_keepalive_connections",
+            get_env_number("LLM_CLIENT_MAX_KEEPALIVE_CONNECTIONS",
+                           DEFAULT_MAX_KEEPALIVE_CONNECTIONS)))
+        self.keepalive_expiry = float(self.params.get(
+            "keepalive_expiry",
+            get_env_number("LLM_CLIENT_KEEPALIVE_EXPIRY",
+                           DEFAULT_KEEPALIVE_EXPIRY)))
+        self.idle_timeout = float(self.params.get(
+            "idle_timeout",
+            get_env_number("LLM_CLIENT_IDLE_TIMEOUT",
+                           DEFAULT_CLIENT_IDLE_TIMEOUT)))
+
+    def get_limits(self) -> httpx.Limits:
+        """
+        Returns the connection pool limits for the httpx clients
+        """
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def get_client_key(
+        self,
+        client_class: Any,
+        client_config: dict,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> tuple:
+        """
+        Returns the registry key for a client class and its configuration
+        (e.g. base_url, api_key, timeout settings). Async clients are also
+        keyed by their event loop, because their connections can't be
+        shared between loops.
+        """
+        return (
+            f"{client_class.__module__}.{client_class.__name__}",
+            tuple(sorted(
+                (key, str(value)) for key, value in client_config.items()
+            )),
+            id(loop) if loop else None,
+        )
+
+    def get_client(
+        self,
+        client_class: Any,
+        client_config: dict,
+        http_client_factory: Callable = None,
+        is_async: bool = False,
+    ) -> Any:
+        """
+        Returns a pooled client for the given class and configuration,
+        creating it if it doesn't exist yet.
+
+        Args:
+            client_class (Any): the SDK client class (e.g. openai.OpenAI).
+            client_config (dict): the client constructor parameters
+                (e.g. base_url, api_key, timeout).
+            http_client_factory (Callable): function that receives the
+                client_config and returns the httpx client to be passed as
+                the "http_client" parameter, or None if the client class
+                doesn't accept it. Defaults to None.
+            is_async (bool): True for async clients (e.g. openai.AsyncOpenAI).
+                It must be called from a running event loop.
+                Defaults to False.
+
+        Returns:
+            Any: the client instance.
+        """
+        loop = asyncio.get_running_loop() if is_async else None
+        key = self.get_client_key(client_class, client_config, loop)
+        with self.lock:
+            self.evict_idle_clients()
+            entry = self.clients.get(key)
+            # The loop check guards against a new loop getting the id of a
+            # garbage-collected one
+            if entry and entry["loop"] is loop:
+                entry["last_used"] = time.time()
+                return entry["client"]
+            client_params = dict(client_config)
+            http_client = None
+            if http_client_factory:
+                http_client = http_client_factory(client_config)
+                client_params["http_client"] = http_client
+            client = client_class(**client_params)
+            self.clients[key] = {
+                "client": client,
+                "http_client": http_client,
+                "loop": loop,
+                "last_used": time.time(),
+            }
+            log_debug("LlmClientRegistry.get_client | NEW client"
+                      f"\n | class: {key[0]}"
+                      f"\n | base_url: {client_config.get('base_url')}"
+                      f"\n | total clients: {len(self.clients)}",
+                      debug=DEBUG)
+            return client
+
+    def get_sync_http_client(self, client_config: dict) -> httpx.Client:
+        """
+        Returns a new httpx client with the registry pool limits
+        """
+        params = {
+            "limits": self.get_limits(),
+            "follow_redirects": True,
+        }
+        if client_config.get("timeout"):
+            params["timeout"] = client_config["timeout"]
+        return httpx.Client(**params)
+
+    def get_async_http_client(self, client_config: dict
+                              ) -> httpx.AsyncClient:
+        """
+        Returns a new async httpx client with the registry pool limits
+        """
+        params = {
+            "limits": self.get_limits(),
+            "follow_redirects": True,
+        }
+        if client_config.get("timeout"):
+            params["timeout"] = client_config["timeout"]
+        return httpx.AsyncClient(**params)
+
+    def evict_idle_clients(self):
+        """
+        Close and remove the clients not used in the last idle_timeout
+        seconds, and the async clients of the closed event loops (e.g. the
+        asyncio.run() calls already finished), so they don't pile up.
+        The caller must hold the registry lock.
+        """
+        now = time.time()
+        for key in list(self.clients.keys()):
+            entry = self.clients[key]
+            loop = entry.get("loop")
+            if (loop is not None and loop.is_closed()) or \
+               (self.idle_timeout > 0 and
+                    now - entry["last_used"] > self.idle_timeout):
+                self.close_entry(entry)
+                del self.clients[key]
+                log_debug("LlmClientRegistry.evict_idle_clients | "
+                          f"Evicted: {key[0]}", debug=DEBUG)
+
+    def close_entry(self, entry: dict):
+        """
+        Close a registry entry client, ignoring errors. Async clients are
+        closed in their own event loop if it's still running. Otherwise
+        they can't be closed through it, and their connections sockets are
+        closed when the dropped transports are garbage-collected.
+        """
+        for obj in [entry.get("client"), entry.get("http_client")]:
+            close_method = getattr(obj, "aclose", None) or \
+                getattr(obj, "close", None)
+            if not close_method:
+                continue
+            try:
+                result = close_method()
+                if asyncio.iscoroutine(result):
+                    loop = entry.get("loop")
+                    if loop and loop.is_running():
+                        asyncio.run_coroutine_threadsafe(result, loop)
+                    else:
+                        result.close()
+            except Exception as e:
+                log_debug(f"LlmClientRegistry.close_entry | ERROR: {e}",
+                          debug=DEBUG)
+
+    def close_all(self):
+        """
+        Close and remove all the registered clients
+        """
+        with self.lock:
+            for entry in self.clients.values():
+                self.close_entry(entry)
+            self.clients = {}
+
+
+llm_client_registry = LlmClientRegistry()
+
+
+def get_pooled_client(
+    client_class: Any,
+    client_config: dict,
+    use_http_client: bool = True,
+) -> Any:
+    """
+    Returns a pooled client from the process-wide registry.
+
+    Args:
+        client_class (Any): the SDK client class (e.g. openai.OpenAI).
+        client_config (dict): the client constructor parameters.
+        use_http_client (bool): True if the client class accepts a custom
+            httpx "http_client" parameter (OpenAI-compatible SDKs).
+            Defaults to True.
+
+    Returns:
+        Any: the client instance.
+    """
+    return llm_client_registry.get_client(
+        client_class,
+        client_config,
+        (llm_client_registry.get_sync_http_client if use_http_client
+         else None),
+    )
+
+
+def get_pooled_async_client(
+    client_class: Any,
+    client_config: dict,
+    use_http_client: bool = True,
+) -> Any:
+    """
+    Returns a pooled async client (e.g. openai.AsyncOpenAI) for the current
+    event loop from the process-wide registry.
+
+    Args:
+        client_class (Any): the async SDK client class.
+        client_config (dict): the client constructor parameters.
+        use_http_client (bool): True if the client class accepts a custom
+            httpx "http_client" parameter. Defaults to True.
+
+    Returns:
+        Any: the async client instance.
+    """
+    return llm_client_registry.get_client(
+        client_class,
+        client_config,
+        (llm_client_registry.get_async_http_client if use_http_client
+         else None),
+        is_async=True,
+    )
+
+
+def get_pooled_async_http_client(timeout: float = None
+                                 ) -> httpx.AsyncClient:
+    """
+    Returns a pooled httpx.AsyncClient for the current event loop, used by
+    the raw HTTP providers (e.g. HuggingFace, Rhymes Allegro).
+
+    Args:
+        timeout (float): the requests timeout in seconds. Defaults to None
+            (httpx default timeout).
+
+    Returns:
+        httpx.AsyncClient: the async HTTP client.
+    """
+    client_config = {}
+    if timeout:
+        client_config["timeout"] = timeout
+    return llm_client_registry.get_client(
+        httpx.AsyncClient,
+        {
+            "limits": llm_client_registry.get_limits(),
+            "follow_redirects": True,
+            **client_config,
+        },
+        is_async=True,
+    )
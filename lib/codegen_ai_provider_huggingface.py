@@ -3,8 +3,8 @@ HugginFace platform utilities
 """
 from typing import Any
 import os
+import json
 import requests
-import uuid
 
 from lib.codegen_utilities import (
     log_debug,
@@ -12,6 +12,12 @@ from lib.codegen_utilities import (
     error_resultset,
 )
 from lib.codegen_ai_abstracts import LlmProviderAbstract
+from lib.codegen_ai_clients import get_pooled_async_http_client
+from lib.codegen_images_store import (
+    save_image_stream,
+    asave_image_stream,
+    IMAGE_STREAM_CHUNK_SIZE,
+)
 
 
 DEBUG = False
@@ -45,7 +51,6 @@ class HuggingFaceLlm(LlmProviderAbstract):
         """
         Perform a HuggingFace request
         """
-        response = get_default_resultset()
         # Always a single message
         unified = True
         pam_response = self.get_prompts_and_messages(
@@ -56,8 +61,56 @@ class HuggingFaceLlm(LlmProviderAbstract):
         )
         if pam_response['error']:
             return pam_response
+        response_raw = self.hf_query(
+            repo_id=self.get_query_model_name(),
+            payload=self.get_query_model_params(pam_response),
+        )
+        return self.process_query_response(response_raw, pam_response)
+
+    async def aquery(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Perform a HuggingFace request with the pooled httpx.AsyncClient
+        """
+        # Always a single message
+        unified = True
+        pam_response = await self.aget_prompts_and_messages(
+            user_input=question,
+            system_prompt=prompt,
+            prompt_enhancement_text=prompt_enhancement_text,
+            unified=unified,
+        )
+        if pam_response['error']:
+            return pam_response
+        try:
+            response_raw = await self.ahf_query(
+                repo_id=self.get_query_model_name(),
+                payload=self.get_query_model_params(pam_response),
+            )
+        except Exception as e:
+            return error_resultset(
+                error_message=f"ERROR {e}",
+                message_code='HF-E030',
+            )
+        return self.process_query_response(response_raw, pam_response)
 
-        model_params = {
+    def get_query_model_name(self) -> str:
+        """
+        Returns the HuggingFace model name (repo_id) for the query
+        """
+        return self.model_name or \
+            os.environ.get("HUGGINGFACE_MODEL_NAME")
+
+    def get_query_model_params(self, pam_response: dict) -> dict:
+        """
+        Returns the HuggingFace API payload for the query
+        """
+        return {
             "inputs": pam_response["messages"][0]["content"],
             "parameters": {
                 # "do_sample": True,
@@ -73,12 +126,14 @@ class HuggingFaceLlm(LlmProviderAbstract):
                 "use_cache": True,
             },
         }
-        model_name = self.model_name or \
-            os.environ.get("HUGGINGFACE_MODEL_NAME")
-        response_raw = self.hf_query(
-            repo_id=model_name,
-            payload=model_params,
-        )
+
+    def process_query_response(self, response_raw: Any, pam_response: dict
+                               ) -> dict:
+        """
+        Returns the standard response from the HuggingFace API response.
+        response_raw can be a requests or httpx response.
+        """
+        response = get_default_resultset()
         log_debug(
             "huggingface_query | " +
             f"response_raw BEFORE CONVERSION: {response_raw}",
@@ -95,7 +150,7 @@ class HuggingFaceLlm(LlmProviderAbstract):
                     message_code='HF-E010',
                 )
             response['response'] = response_raw['message']['content']
-        except requests.exceptions.JSONDecodeError:
+        except (requests.exceptions.JSONDecodeError, json.JSONDecodeError):
             response['response'] = response_raw.text
         except Exception as e:
             return error_resultset(
@@ -105,16 +160,9 @@ class HuggingFaceLlm(LlmProviderAbstract):
         response['refined_prompt'] = pam_response['refined_prompt']
         return response
 
-    def hf_query(self, repo_id: str, payload: dict) -> Any:
+    def get_hf_request(self, repo_id: str) -> dict:
         """
-        Perform a HuggingFace query
-
-        Args:
-            api_url (str): HuggingFace API URL
-            payload (dict): HuggingFace payload
-
-        Returns:
-            Any: HuggingFace response
+        Returns the HuggingFace API URL and headers for a model
         """
         # https://huggingface.co/docs/api-inference/detailed_parameters
         api_key = self.api_key or \
@@ -125,8 +173,42 @@ class HuggingFaceLlm(LlmProviderAbstract):
         base_url = os.environ.get(
             "HUGGINGFACE_API_URL",
             "https://api-inference.huggingface.co/models")
-        api_url = f'{base_url}/{repo_id}'
-        return requests.post(api_url, headers=headers, json=payload)
+        return {
+            "api_url": f'{base_url}/{repo_id}',
+            "headers": headers,
+        }
+
+    def hf_query(self, repo_id: str, payload: dict) -> Any:
+        """
+        Perform a HuggingFace query
+
+        Args:
+            repo_id (str): HuggingFace model repo ID
+            payload (dict): HuggingFace payload
+
+        Returns:
+            Any: HuggingFace response
+        """
+        request = self.get_hf_request(repo_id)
+        return requests.post(request["api_url"], headers=request["headers"],
+                             json=payload)
+
+    async def ahf_query(self, repo_id: str, payload: dict) -> Any:
+        """
+        Perform a HuggingFace query with the pooled httpx.AsyncClient
+
+        Args:
+            repo_id (str): HuggingFace model repo ID
+            payload (dict): HuggingFace payload
+
+        Returns:
+            Any: HuggingFace httpx response
+        """
+        request = self.get_hf_request(repo_id)
+        client = get_pooled_async_http_client(
+            timeout=float(os.environ.get("HUGGINGFACE_API_TIMEOUT", 120)))
+        return await client.post(request["api_url"],
+                                 headers=request["headers"], json=payload)
 
 
 class HuggingFaceImageGen(HuggingFaceLlm):
@@ -146,6 +228,19 @@ class HuggingFaceImageGen(HuggingFaceLlm):
             prompt_enhancement_text,
             unified)
 
+    async def aquery(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        return await self.aquery_from_text_model(
+            prompt,
+            question,
+            prompt_enhancement_text,
+            unified)
+
     def image_gen(
         self,
         question: str,
@@ -155,7 +250,6 @@ class HuggingFaceImageGen(HuggingFaceLlm):
         """
         HuggingFace image generation
         """
-        ig_response = get_default_resultset()
         if not question:
             return error_resultset(
                 error_message='No question supplied',
@@ -171,10 +265,7 @@ class HuggingFaceImageGen(HuggingFaceLlm):
         if pam_response['error']:
             return pam_response
 
-        if self.params.get("model_name"):
-            img_model_name = self.params.get("model_name")
-        else:
-            img_model_name = os.environ.get("HUGGINGFACE_IMAGE_MODEL_NAME")
+        img_model_name = self.get_image_model_name()
         if not img_model_name:
             return error_resultset(
                 error_message='No model name supplied',
@@ -185,21 +276,153 @@ class HuggingFaceImageGen(HuggingFaceLlm):
             f'\n| question: {question}' +
             f'\n| api_url: {img_model_name}')
 
-        image_bytes = self.hf_query(
-            repo_id=img_model_name,
-            payload={
-                "inputs": pam_response["user_input"],
-            }
-        ).content
-
-        # Generate a unique filename
-        image_filename = f'hf_img_{uuid.uuid4()}.{image_extension}'
-        target_path = os.environ.get("IMAGES_DIRECTORY", "./images")
-        image_path = f'{target_path}/{image_filename}'
-
-        # Create the temporary local file
-        with open(image_path, 'wb') as f:
-            f.write(image_bytes)
+        try:
+            hf_response = self.hf_query_to_file(
+                repo_id=img_model_name,
+                payload={
+                    "inputs": pam_response["user_input"],
+                },
+                image_extension=image_extension,
+            )
+        except Exception as e:
+            return error_resultset(
+                error_message=f"ERROR {e}",
+                message_code='HFIG-E040',
+            )
+        if hf_response['error']:
+            return hf_response
+        return self.get_image_gen_response(hf_response['response'],
+                                           pam_response)
+
+    async def aimage_gen(
+        self,
+        question: str,
+        prompt_enhancement_text: str = None,
+        image_extension: str = 'jpg',
+    ) -> dict:
+        """
+        HuggingFace image generation with the pooled httpx.AsyncClient
+        """
+        if not question:
+            return error_resultset(
+                error_message='No question supplied',
+                message_code='HFIG-E010',
+            )
+
+        pam_response = await self.aget_prompts_and_messages(
+            user_input=question,
+            system_prompt="",
+            prompt_enhancement_text=prompt_enhancement_text,
+            unified=True,
+        )
+        if pam_response['error']:
+            return pam_response
+
+        img_model_name = self.get_image_model_name()
+        if not img_model_name:
+            return error_resultset(
+                error_message='No model name supplied',
+                message_code='HFIG-E020',
+            )
+        _ = DEBUG and log_debug(
+            '1) huggingface_aimg_gen' +
+            f'\n| question: {question}' +
+            f'\n| api_url: {img_model_name}')
+
+        try:
+            hf_response = await self.ahf_query_to_file(
+                repo_id=img_model_name,
+                payload={
+                    "inputs": pam_response["user_input"],
+                },
+                image_extension=image_extension,
+            )
+        except Exception as e:
+            return error_resultset(
+                error_message=f"ERROR {e}",
+                message_code='HFIG-E040',
+            )
+        if hf_response['error']:
+            return hf_response
+        return self.get_image_gen_response(hf_response['response'],
+                                           pam_response)
+
+    def get_image_model_name(self) -> str:
+        """
+        Returns the HuggingFace image generation model name
+        """
+        if self.params.get("model_name"):
+            return self.params.get("model_name")
+        return os.environ.get("HUGGINGFACE_IMAGE_MODEL_NAME")
+
+    def hf_query_to_file(self, repo_id: str, payload: dict,
+                         image_extension: str) -> dict:
+        """
+        Perform a HuggingFace image query, streaming the image to a
+        content-addressed file (see save_image_stream())
+
+        Returns:
+            dict: standard response with the image path in
+                response['response']
+        """
+        response = get_default_resultset()
+        request = self.get_hf_request(repo_id)
+        with requests.post(
+            request["api_url"], headers=request["headers"], json=payload,
+            stream=True,
+            timeout=float(os.environ.get("HUGGINGFACE_API_TIMEOUT", 120)),
+        ) as hf_response:
+            if hf_response.status_code != 200:
+                return self.get_image_query_error(hf_response.status_code,
+                                                  hf_response.text)
+            response['response'] = save_image_stream(
+                hf_response.iter_content(IMAGE_STREAM_CHUNK_SIZE),
+                image_extension, "hf_img_")
+        return response
+
+    async def ahf_query_to_file(self, repo_id: str, payload: dict,
+                                image_extension: str) -> dict:
+        """
+        Perform a HuggingFace image query with the pooled httpx.AsyncClient,
+        streaming the image to a content-addressed file
+        """
+        response = get_default_resultset()
+        request = self.get_hf_request(repo_id)
+        client = get_pooled_async_http_client(
+            timeout=float(os.environ.get("HUGGINGFACE_API_TIMEOUT", 120)))
+        async with client.stream(
+            "POST", request["api_url"], headers=request["headers"],
+            json=payload,
+        ) as hf_response:
+            if hf_response.status_code != 200:
+                await hf_response.aread()
+                return self.get_image_query_error(hf_response.status_code,
+                                                  hf_response.text)
+            response['response'] = await asave_image_stream(
+                hf_response.aiter_bytes(IMAGE_STREAM_CHUNK_SIZE),
+                image_extension, "hf_img_")
+        return response
+
+    def get_image_query_error(self, status_code: int, text: str) -> dict:
+        """
+        Returns the error response of a failed image query. The body is
+        the API error (e.g. the model is loading), not an image.
+        """
+        return error_resultset(
+            error_message=f"Image generation failed with status code"
+                          f" {status_code}: {text[:500]}",
+            message_code='HFIG-E050',
+        )
+
+    def get_image_gen_response(
+        self,
+        image_path: str,
+        pam_response: dict,
+    ) -> dict:
+        """
+        Returns the standard image generation response for the stored image
+        """
+        ig_response = get_default_resultset()
 
         # Store the image bytes in AWS
         # upload_result = upload_nodup_file_to_s3(
@@ -1,10 +1,11 @@
 """
 Ollama API
 """
+from typing import Iterator
 import os
 
 import ollama
-from ollama import Client
+from ollama import Client, AsyncClient
 
 from lib.codegen_utilities import (
     log_debug,
@@ -12,6 +13,7 @@ from lib.codegen_utilities import (
     fix_ollama_url,
 )
 from lib.codegen_ai_abstracts import LlmProviderAbstract
+from lib.codegen_ai_clients import get_pooled_async_client
 
 
 DEBUG = False
@@ -40,33 +42,125 @@ class OllamaLlm(LlmProviderAbstract):
         )
         if pam_response['error']:
             return pam_response
-        model_params = self.get_model_args(
+        model_params = self.get_query_model_params(pam_response)
+        log_debug("ollama_query | " +
+                  f"model_params: {model_params}", debug=DEBUG)
+        base_url = self.get_base_url()
+        if base_url:
+            client = Client(host=base_url)
+            response_raw = client.chat(**model_params)
+        else:
+            response_raw = ollama.chat(**model_params)
+        response['response'] = response_raw['message']['content']
+        response['refined_prompt'] = pam_response['refined_prompt']
+        log_debug("ollama_query | " +
+                  f"response: {response}", debug=DEBUG)
+        return response
+
+    def query_stream(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Perform a Ollama request streaming the response tokens
+        """
+        pam_response = self.get_prompts_and_messages(
+            user_input=question,
+            system_prompt=prompt,
+            prompt_enhancement_text=prompt_enhancement_text,
+            unified=unified,
+        )
+        if pam_response['error']:
+            return pam_response
+        model_params = self.get_query_model_params(pam_response)
+        model_params["stream"] = True
+        log_debug("ollama_query_stream | " +
+                  f"model_params: {model_params}", debug=DEBUG)
+        response = get_default_resultset()
+        response['response'] = ""
+        response['refined_prompt'] = pam_response['refined_prompt']
+        response['stream'] = self.stream_chunks(
+            response, self.get_chat_stream(model_params))
+        return response
+
+    def get_chat_stream(self, model_params: dict) -> Iterator[str]:
+        """
+        Yields the Ollama chat response text chunks
+        """
+        base_url = self.get_base_url()
+        if base_url:
+            chat_method = Client(host=base_url).chat
+        else:
+            chat_method = ollama.chat
+        for chunk in chat_method(**model_params):
+            yield chunk['message']['content']
+
+    async def aquery(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Perform a Ollama request with the ollama AsyncClient
+        """
+        response = get_default_resultset()
+        pam_response = await self.aget_prompts_and_messages(
+            user_input=question,
+            system_prompt=prompt,
+            prompt_enhancement_text=prompt_enhancement_text,
+            unified=unified,
+        )
+        if pam_response['error']:
+            return pam_response
+        model_params = self.get_query_model_params(pam_response)
+        log_debug("ollama_aquery | " +
+                  f"model_params: {model_params}", debug=DEBUG)
+        client_config = {}
+        base_url = self.get_base_url()
+        if base_url:
+            client_config["host"] = base_url
+        # Ollama client builds its own httpx client
+        client = get_pooled_async_client(AsyncClient, client_config,
+                                         use_http_client=False)
+        response_raw = await client.chat(**model_params)
+        response['response'] = response_raw['message']['content']
+        response['refined_prompt'] = pam_response['refined_prompt']
+        log_debug("ollama_aquery | " +
+                  f"response: {response}", debug=DEBUG)
+        return response
+
+    def get_query_model_params(self, pam_response: dict) -> dict:
+        """
+        Returns the Ollama chat parameters for the query
+        """
+        return self.get_model_args(
             additional_params={
                 "messages": pam_response['messages'],
             },
         )
+
+    def get_base_url(self) -> str:
+        """
+        Returns the Ollama server base URL, or None to use the default one
+        """
         client_params = self.get_client_args(
             additional_params={
                 "model": self.model_name or os.environ.get("OLLAMA_MODEL"),
             },
         )
-        log_debug("ollama_query | " +
-                  f"model_params: {model_params}", debug=DEBUG)
         if self.params.get("ollama_base_url"):
             client_params["base_url"] = self.params["ollama_base_url"]
         elif os.environ.get("OLLAMA_BASE_URL"):
             client_params["base_url"] = os.environ.get("OLLAMA_BASE_URL")
-        if client_params.get("base_url"):
-            base_url = fix_ollama_url(client_params.get("base_url"), None)
-            log_debug(
-                ">> Using ollama client with base_url:" +
-                f' {base_url}', debug=DEBUG)
-            client = Client(host=base_url)
-            response_raw = client.chat(**model_params)
-        else:
-            response_raw = ollama.chat(**model_params)
-        response['response'] = response_raw['message']['content']
-        response['refined_prompt'] = pam_response['refined_prompt']
-        log_debug("ollama_query | " +
-                  f"response: {response}", debug=DEBUG)
-        return response
+        if not client_params.get("base_url"):
+            return None
+        base_url = fix_ollama_url(client_params.get("base_url"), None)
+        log_debug(
+            ">> Using ollama client with base_url:" +
+            f' {base_url}', debug=DEBUG)
+        return base_url
@@ -1,9 +1,10 @@
 """
 OpenAI API
 """
+from typing import Any, Iterator
 import os
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from openai.resources.images import ImagesResponse
 
 from lib.codegen_utilities import (
@@ -14,6 +15,10 @@ from lib.codegen_ai_abstracts import (
     LlmProviderAbstract,
     prepare_model_params,
 )
+from lib.codegen_ai_clients import (
+    get_pooled_client,
+    get_pooled_async_client,
+)
 
 
 DEBUG = False
@@ -25,9 +30,9 @@ def get_openai_api_response(model_params: dict, naming: dict = None) -> dict:
     """
     response = get_default_resultset()
     configs = prepare_model_params(model_params, naming)
-    # Initialize the OpenAI client
+    # Get the pooled OpenAI client
     try:
-        client = OpenAI(**configs["client_config"])
+        client = get_pooled_client(OpenAI, configs["client_config"])
     except Exception as e:
         response['error'] = True
         response['error_message'] = str(e)
@@ -49,7 +54,6 @@ def get_openai_api_response(model_params: dict, naming: dict = None) -> dict:
                 response['response'] = ""
                 for chunk in llm_response:
                     if chunk.choices[0].delta.content is not None:
-                        print(chunk.choices[0].delta.content, end="")
                         response['response'] += chunk.choices[0].delta.content
             else:
                 response['response'] = llm_response.choices[0].message.content
@@ -60,10 +64,77 @@ def get_openai_api_response(model_params: dict, naming: dict = None) -> dict:
     return response
 
 
+def get_openai_api_stream(model_params: dict, naming: dict = None
+                          ) -> Iterator[str]:
+    """
+    Yields the OpenAI API response text chunks for a LLM request, as they
+    are generated
+    """
+    configs = prepare_model_params(model_params, naming)
+    configs["model_config"]["stream"] = True
+    client = get_pooled_client(OpenAI, configs["client_config"])
+    llm_response = client.chat.completions.create(**configs["model_config"])
+    for chunk in llm_response:
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            yield chunk.choices[0].delta.content
+
+
+async def get_openai_api_aresponse(model_params: dict, naming: dict = None
+                                   ) -> dict:
+    """
+    Returns the OpenAI API response for a LLM request, using the
+    AsyncOpenAI client
+    """
+    response = get_default_resultset()
+    configs = prepare_model_params(model_params, naming)
+    # Get the pooled AsyncOpenAI client
+    try:
+        client = get_pooled_async_client(AsyncOpenAI,
+                                         configs["client_config"])
+    except Exception as e:
+        response['error'] = True
+        response['error_message'] = str(e)
+        return response
+    # Process the question and text
+    try:
+        llm_response = await client.chat.completions.create(
+            **configs["model_config"])
+        log_debug("get_openai_api_aresponse | " +
+                  f"{model_params.get('provider', 'Provider N/A')} " +
+                  f" LLM response: {llm_response}", debug=DEBUG)
+        if configs["model_config"].get('stream', False):
+            response['response'] = ""
+            async for chunk in llm_response:
+                if chunk.choices and \
+                   chunk.choices[0].delta.content is not None:
+                    response['response'] += chunk.choices[0].delta.content
+        else:
+            response['response'] = llm_response.choices[0].message.content
+    except Exception as e:
+        response['error'] = True
+        response['error_message'] = str(e)
+    return response
+
+
 class OpenaiLlm(LlmProviderAbstract):
     """
-    OpenAI LLM class
+    OpenAI LLM class. It's also the base class for the OpenAI API
+    compatible providers, which only need to override
+    get_query_model_params()
     """
+    def get_query_model_params(self, pam_response: dict) -> dict:
+        """
+        Returns the OpenAI API parameters for the query
+        """
+        return self.get_model_args(
+            additional_params={
+                "api_key": self.api_key or os.environ.get("OPENAI_API_KEY"),
+                "model": self.model_name or os.environ.get("OPENAI_MODEL"),
+                "messages": pam_response['messages'],
+            },
+            for_openai_api=True,
+        )
+
     def query(
         self,
         prompt: str,
@@ -83,20 +154,69 @@ class OpenaiLlm(LlmProviderAbstract):
         )
         if pam_response['error']:
             return pam_response
-        model_params = self.get_model_args(
-            additional_params={
-                "api_key": self.api_key or os.environ.get("OPENAI_API_KEY"),
-                "model": self.model_name or os.environ.get("OPENAI_MODEL"),
-                "messages": pam_response['messages'],
-            },
-            for_openai_api=True,
-        )
+        model_params = self.get_query_model_params(pam_response)
         # Get the LLM response
-        log_debug("openai_query | " +
+        log_debug(f"{self.__class__.__name__}.query | " +
                   f"model_params: {model_params}", debug=DEBUG)
         response = get_openai_api_response(model_params)
         response['refined_prompt'] = pam_response['refined_prompt']
-        log_debug("openai_query | " +
+        log_debug(f"{self.__class__.__name__}.query | " +
+                  f"response: {response}", debug=DEBUG)
+        return response
+
+    def query_stream(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Perform a OpenAI request streaming the response tokens
+        """
+        pam_response = self.get_prompts_and_messages(
+            user_input=question,
+            system_prompt=prompt,
+            prompt_enhancement_text=prompt_enhancement_text,
+            unified=unified,
+        )
+        if pam_response['error']:
+            return pam_response
+        model_params = self.get_query_model_params(pam_response)
+        log_debug(f"{self.__class__.__name__}.query_stream | " +
+                  f"model_params: {model_params}", debug=DEBUG)
+        response = get_default_resultset()
+        response['response'] = ""
+        response['refined_prompt'] = pam_response['refined_prompt']
+        response['stream'] = self.stream_chunks(
+            response, get_openai_api_stream(model_params))
+        return response
+
+    async def aquery(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Perform a OpenAI request with the AsyncOpenAI client
+        """
+        response = get_default_resultset()
+        pam_response = await self.aget_prompts_and_messages(
+            user_input=question,
+            system_prompt=prompt,
+            prompt_enhancement_text=prompt_enhancement_text,
+            unified=unified,
+        )
+        if pam_response['error']:
+            return pam_response
+        model_params = self.get_query_model_params(pam_response)
+        log_debug(f"{self.__class__.__name__}.aquery | " +
+                  f"model_params: {model_params}", debug=DEBUG)
+        response = await get_openai_api_aresponse(model_params)
+        response['refined_prompt'] = pam_response['refined_prompt']
+        log_debug(f"{self.__class__.__name__}.aquery | " +
                   f"response: {response}", debug=DEBUG)
         return response
 
@@ -114,7 +234,6 @@ class OpenaiImageGen(OpenaiLlm):
         """
         Perform an OpenAI image generation request
         """
-        response = get_default_resultset()
         pam_response = self.get_prompts_and_messages(
             user_input=question,
             system_prompt="",
@@ -124,6 +243,49 @@ class OpenaiImageGen(OpenaiLlm):
         if pam_response['error']:
             return pam_response
 
+        model_params = self.get_image_gen_params(pam_response)
+
+        # Get the LLM response
+        client = get_pooled_client(OpenAI, {
+            "api_key": self.api_key or os.environ.get("OPENAI_API_KEY")
+        })
+        # Process the question and image
+        ig_response = client.images.generate(**model_params)
+
+        return self.process_image_gen_response(ig_response, pam_response)
+
+    async def aimage_gen(
+        self,
+        question: str,
+        prompt_enhancement_text: str = None,
+        image_extension: str = 'jpg',
+    ) -> dict:
+        """
+        Perform an OpenAI image generation request with the AsyncOpenAI
+        client
+        """
+        pam_response = await self.aget_prompts_and_messages(
+            user_input=question,
+            system_prompt="",
+            prompt_enhancement_text=prompt_enhancement_text,
+            unified=True,
+        )
+        if pam_response['error']:
+            return pam_response
+
+        model_params = self.get_image_gen_params(pam_response)
+
+        client = get_pooled_async_client(AsyncOpenAI, {
+            "api_key": self.api_key or os.environ.get("OPENAI_API_KEY")
+        })
+        ig_response = await client.images.generate(**model_params)
+
+        return self.process_image_gen_response(ig_response, pam_response)
+
+    def get_image_gen_params(self, pam_response: dict) -> dict:
+        """
+        Returns the OpenAI image generation API parameters
+        """
         ig_model_name = os.environ.get("OPENAI_IMAGE_GEN_MODEL")
         model_params = {
             # "model": "dall-e-3",
@@ -133,18 +295,21 @@ class OpenaiImageGen(OpenaiLlm):
             "quality": self.params.get("quality", "standard"),
             "n": 1,
         }
-
         log_debug("openai_image_gen | " +
                   f"model_params: {model_params}", debug=DEBUG)
+        return model_params
 
-        # Get the LLM response
-        client = OpenAI(
-            api_key=self.api_key or os.environ.get("OPENAI_API_KEY")
-        )
-        # Process the question and image
-        ig_response = client.images.generate(**model_params)
-
-        log_debug(f"openai_image_gen | {ig_model_name}"
+    def process_image_gen_response(
+        self,
+        ig_response: Any,
+        pam_response: dict,
+    ) -> dict:
+        """
+        Returns the standard response from the OpenAI image generation
+        API response
+        """
+        response = get_default_resultset()
+        log_debug("openai_image_gen | "
                   f" | ig_response: {ig_response}",
                   debug=DEBUG)
 
@@ -2,8 +2,10 @@
 """
 Rhymes APIs
 """
+from typing import Any
 import os
 import time
+import asyncio
 
 import requests
 import json
@@ -12,38 +14,24 @@ from lib.codegen_utilities import (
     log_debug,
     get_default_resultset,
 )
-from lib.codegen_ai_provider_openai import get_openai_api_response
+from lib.codegen_ai_provider_openai import OpenaiLlm
 from lib.codegen_ai_abstracts import LlmProviderAbstract
+from lib.codegen_ai_clients import get_pooled_async_http_client
 
 DEBUG = False
 
 RHYMES_SUCCESS_RESPONSES = ["success", "Success", '成功']
 
 
-class AriaLlm(LlmProviderAbstract):
+class AriaLlm(OpenaiLlm):
     """
     Aria LLM class
     """
-    def query(
-        self,
-        prompt: str,
-        question: str,
-        prompt_enhancement_text: str = None,
-        unified: bool = False,
-    ) -> dict:
+    def get_query_model_params(self, pam_response: dict) -> dict:
         """
-        Perform a Aria request
+        Returns the Aria API parameters for the query
         """
-        response = get_default_resultset()
-        pam_response = self.get_prompts_and_messages(
-            user_input=question,
-            system_prompt=prompt,
-            prompt_enhancement_text=prompt_enhancement_text,
-            unified=unified,
-        )
-        if pam_response['error']:
-            return pam_response
-        model_params = self.get_model_args(
+        return self.get_model_args(
             additional_params={
                 "model": (self.model_name or
                           os.environ.get("RHYMES_MODEL_NAME")),
@@ -55,14 +43,6 @@ class AriaLlm(LlmProviderAbstract):
             },
             for_openai_api=True,
         )
-        # Get the OpenAI API response
-        log_debug("aria_query | " +
-                  f"model_params: {model_params}", debug=DEBUG)
-        response = get_openai_api_response(model_params)
-        response['refined_prompt'] = pam_response['refined_prompt']
-        log_debug("aria_query | " +
-                  f"response: {response}", debug=DEBUG)
-        return response
 
 
 class AllegroLlm(LlmProviderAbstract):
@@ -89,6 +69,43 @@ class AllegroLlm(LlmProviderAbstract):
         """
         return self.allegro_check_video_generation(request_response, wait_time)
 
+    async def avideo_gen(
+        self,
+        question: str,
+        prompt_enhancement_text: str = None
+    ) -> dict:
+        """
+        Perform a Allegro video generation request, without blocking the
+        event loop
+        """
+        return await self.allegro_arequest_video(
+            question, prompt_enhancement_text)
+
+    async def avideo_gen_followup(
+        self,
+        request_response: dict,
+        wait_time: int = 60
+    ):
+        """
+        Perform a Allegro video generation request check, without blocking
+        the event loop
+        """
+        return await self.allegro_acheck_video_generation(
+            request_response, wait_time)
+
+    def video_gen_check(self, request_response: dict) -> dict:
+        """
+        Perform a single Allegro video generation request check
+        """
+        return self.allegro_check_video_status(request_response)
+
+    async def avideo_gen_check(self, request_response: dict) -> dict:
+        """
+        Perform a single Allegro video generation request check, without
+        blocking the event loop
+        """
+        return await self.allegro_acheck_video_status(request_response)
+
     def query(
         self,
         prompt: str,
@@ -102,18 +119,30 @@ class AllegroLlm(LlmProviderAbstract):
             prompt_enhancement_text,
             unified)
 
-    def allegro_query(self, model_params: dict) -> dict:
+    async def aquery(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        return await self.aquery_from_text_model(
+            prompt,
+            question,
+            prompt_enhancement_text,
+            unified)
+
+    def get_allegro_request(self, model_params: dict) -> dict:
         """
-        Perform a Allegro video generation request
+        Returns the Allegro API request elements: api_url, headers,
+        payload and method
         """
-        response = get_default_resultset()
         headers = {
             "Authorization": f"{model_params.get('api_key')}",
             "User-Agent": "Apifox/1.0.0 (https://apifox.com)",
         }
         headers.update(model_params.get("headers", {}))
         query = model_params.get("query", {})
-        payload = model_params.get("payload", {})
         rhymes_endpoint = model_params.get(
             "base_url", "https://api.rhymes.ai/v1/generateVideoSyn")
 
@@ -124,24 +153,26 @@ class AllegroLlm(LlmProviderAbstract):
         else:
             api_url = rhymes_endpoint
 
+        request = {
+            "api_url": api_url,
+            "headers": headers,
+            "payload": model_params.get("payload", {}),
+            "method": model_params.get("method", "POST"),
+        }
         log_debug("allegro_query | " +
-                  f"\nAPI URL: {api_url}" +
-                  f"\nAPI headers: {headers}" +
-                  f"\nAPI payload: {payload}"
-                  f"\nAPI method: {model_params.get('method', 'POST')}",
+                  f"\nAPI URL: {request['api_url']}" +
+                  f"\nAPI headers: {request['headers']}" +
+                  f"\nAPI payload: {request['payload']}"
+                  f"\nAPI method: {request['method']}",
                   debug=DEBUG)
-        try:
-            if model_params.get("method", "POST") == "POST":
-                model_response = requests.post(
-                    api_url, headers=headers,
-                    json=payload)
-            else:
-                model_response = requests.get(api_url, headers=headers)
-        except Exception as e:
-            response['error'] = True
-            response['error_message'] = str(e)
-            return response
+        return request
 
+    def process_allegro_response(self, model_response: Any) -> dict:
+        """
+        Returns the standard response from the Allegro API response.
+        model_response can be a requests or httpx response.
+        """
+        response = get_default_resultset()
         if model_response.status_code != 200:
             response['error'] = True
             response['error_message'] = \
@@ -154,12 +185,54 @@ class AllegroLlm(LlmProviderAbstract):
         response['response'] = model_response.json()
         return response
 
+    def allegro_query(self, model_params: dict) -> dict:
+        """
+        Perform a Allegro video generation request
+        """
+        response = get_default_resultset()
+        request = self.get_allegro_request(model_params)
+        try:
+            if request["method"] == "POST":
+                model_response = requests.post(
+                    request["api_url"], headers=request["headers"],
+                    json=request["payload"])
+            else:
+                model_response = requests.get(
+                    request["api_url"], headers=request["headers"])
+        except Exception as e:
+            response['error'] = True
+            response['error_message'] = str(e)
+            return response
+        return self.process_allegro_response(model_response)
+
+    async def allegro_aquery(self, model_params: dict) -> dict:
+        """
+        Perform a Allegro video generation request with the pooled
+        httpx.AsyncClient
+        """
+        response = get_default_resultset()
+        request = self.get_allegro_request(model_params)
+        try:
+            client = get_pooled_async_http_client(
+                timeout=float(os.environ.get("RHYMES_API_TIMEOUT", 60)))
+            if request["method"] == "POST":
+                model_response = await client.post(
+                    request["api_url"], headers=request["headers"],
+                    json=request["payload"])
+            else:
+                model_response = await client.get(
+                    request["api_url"], headers=request["headers"])
+        except Exception as e:
+            response['error'] = True
+            response['error_message'] = str(e)
+            return response
+        return self.process_allegro_response(model_response)
+
     def allegro_request_video(self, question: str,
                               prompt_enhancement_text: str):
         """
         Perform a Allegro video generation request
         """
-        response = get_default_resultset()
         pam_response = self.get_prompts_and_messages(
             user_input=question,
             system_prompt=None,
@@ -167,7 +240,32 @@ class AllegroLlm(LlmProviderAbstract):
         )
         if pam_response['error']:
             return pam_response
+        model_params = self.get_video_request_params(question, pam_response)
+        response = self.allegro_query(model_params)
+        return self.process_video_request_response(response, pam_response)
+
+    async def allegro_arequest_video(self, question: str,
+                                     prompt_enhancement_text: str):
+        """
+        Perform a Allegro video generation request, without blocking the
+        event loop
+        """
+        pam_response = await self.aget_prompts_and_messages(
+            user_input=question,
+            system_prompt=None,
+            prompt_enhancement_text=prompt_enhancement_text,
+        )
+        if pam_response['error']:
+            return pam_response
+        model_params = self.get_video_request_params(question, pam_response)
+        response = await self.allegro_aquery(model_params)
+        return self.process_video_request_response(response, pam_response)
 
+    def get_video_request_params(self, question: str, pam_response: dict
+                                 ) -> dict:
+        """
+        Returns the Allegro video generation request parameters
+        """
         rand_seed = int(time.time())
         model_params = {
             "api_key": os.environ.get("RHYMES_ALLEGRO_API_KEY"),
@@ -183,11 +281,15 @@ class AllegroLlm(LlmProviderAbstract):
                 "cfg_scale": 7.5,
             }
         }
-
         log_debug("allegro_request_video | GENERATE VIDEO | " +
                   f"model_params: {model_params}", debug=DEBUG)
+        return model_params
 
-        response = self.allegro_query(model_params)
+    def process_video_request_response(self, response: dict,
+                                       pam_response: dict) -> dict:
+        """
+        Validates the Allegro video generation request response
+        """
         response['refined_prompt'] = pam_response['refined_prompt']
 
         log_debug("allegro_request_video | GENERATION RESULT | " +
@@ -215,9 +317,78 @@ class AllegroLlm(LlmProviderAbstract):
         Perform a Allegro video generation request check
         """
         request_id = allegro_response["response"]["data"]
+        model_params = self.get_video_check_params(request_id)
+        response = None
+        for i in range(10):
+            log_debug(f"allegro_check_video_generation | VERIFICATION TRY {i}",
+                      debug=DEBUG)
+            # Send the follow-up request to the Allegro API
+            response = self.allegro_query(model_params)
+            if self.process_video_check_response(response, request_id):
+                break
+            time.sleep(wait_time)
+        return self.get_video_check_result(response, request_id)
+
+    async def allegro_acheck_video_generation(
+        self,
+        allegro_response: dict,
+        wait_time: int = 60
+    ):
+        """
+        Perform a Allegro video generation request check, waiting between
+        verifications without blocking the event loop
+        """
+        request_id = allegro_response["response"]["data"]
+        model_params = self.get_video_check_params(request_id)
+        response = None
+        for i in range(10):
+            log_debug("allegro_acheck_video_generation | VERIFICATION TRY"
+                      f" {i}", debug=DEBUG)
+            response = await self.allegro_aquery(model_params)
+            if self.process_video_check_response(response, request_id):
+                break
+            await asyncio.sleep(wait_time)
+        return self.get_video_check_result(response, request_id)
+
+    def allegro_check_video_status(self, allegro_response: dict) -> dict:
+        """
+        Perform a single Allegro video generation request check.
+        response['finished'] is False while the video is being generated.
+        """
+        request_id = allegro_response["response"]["data"]
+        response = self.allegro_query(
+            self.get_video_check_params(request_id))
+        return self.get_video_status_result(response, request_id)
+
+    async def allegro_acheck_video_status(self, allegro_response: dict
+                                          ) -> dict:
+        """
+        Perform a single Allegro video generation request check, without
+        blocking the event loop
+        """
+        request_id = allegro_response["response"]["data"]
+        response = await self.allegro_aquery(
+            self.get_video_check_params(request_id))
+        return self.get_video_status_result(response, request_id)
+
+    def get_video_status_result(self, response: dict, request_id: str
+                                ) -> dict:
+        """
+        Returns the single check response, with the final result if the
+        check is finished
+        """
+        finished = self.process_video_check_response(response, request_id)
+        if finished:
+            response = self.get_video_check_result(response, request_id)
+        response['finished'] = finished
+        return response
+
+    def get_video_check_params(self, request_id: str) -> dict:
+        """
+        Returns the Allegro video generation check request parameters
+        """
         log_debug("allegro_check_video_generation | " +
                   f"request_id: {request_id}", debug=DEBUG)
-
         model_params = {
             "api_key": os.environ.get("RHYMES_ALLEGRO_API_KEY"),
             "base_url": 'https://api.rhymes.ai/v1/videoQuery',
@@ -228,52 +399,67 @@ class AllegroLlm(LlmProviderAbstract):
         }
         log_debug("allegro_check_video_generation | WAIT FOR VIDEO | " +
                   f"model_params: {model_params}", debug=DEBUG)
+        return model_params
 
-        video_url = None
-        for i in range(10):
-            log_debug(f"allegro_check_video_generation | VERIFICATION TRY {i}",
-                      debug=DEBUG)
-            # Send the follow-up request to the Allegro API
-            response = self.allegro_query(model_params)
-            log_debug(f"allegro_check_video_generation | VERIFICATION {i} | " +
-                      f"response: {response}", debug=DEBUG)
-            if response['error']:
-                response["ttv_followup_response"] = response["error_message"]
-                return response
-            if response["response"]['message'] in RHYMES_SUCCESS_RESPONSES \
-               and response["response"].get('data'):
-                if isinstance(response["response"]["data"], str):
-                    # Verify if the string has a json content
-                    if "{" in response["response"]["data"] and \
-                       response["response"]["data"].endswith("}"):
-                        # Get the response["response"]["data"] string from the
-                        # first "{"
-                        first_bracket = response["response"]["data"].find("{")
-                        response["response"]["data"] = \
-                            json.loads(
-                                response["response"]["data"][first_bracket:]
-                            )
-                if isinstance(response["response"]["data"], str):
-                    video_url = response["response"]["data"]
-                else:
-                    # The response is a dictionary with an error message
-                    # E.g. { "code": 503, "type": "InternalServerException",
-                    #        "message": "Prediction failed" }
-                    response["ttv_followup_response"] = \
-                        response["response"]["data"]
-                    response["error"] = True
-                    response["error_message"] = \
-                        f"[E-RH-ALL-100] Video generation failed" \
-                        f" (request_id: {request_id}," \
-                        f' response: {response["ttv_followup_response"]})'
-                break
-            time.sleep(wait_time)
+    def process_video_check_response(self, response: dict, request_id: str
+                                     ) -> bool:
+        """
+        Process a video generation check response. When the check is
+        finished, the video URL is assigned to response['video_url'] or
+        the error is reported in the response.
 
+        Returns:
+            bool: True if the check is finished (success or error), False if
+                the video is still being generated.
+        """
+        log_debug("allegro_check_video_generation | VERIFICATION | " +
+                  f"response: {response}", debug=DEBUG)
+        if response['error']:
+            response["ttv_followup_response"] = response["error_message"]
+            return True
+        if response["response"]['message'] in RHYMES_SUCCESS_RESPONSES \
+           and response["response"].get('data'):
+            if isinstance(response["response"]["data"], str):
+                # Verify if the string has a json content
+                if "{" in response["response"]["data"] and \
+                   response["response"]["data"].endswith("}"):
+                    # Get the response["response"]["data"] string from the
+                    # first "{"
+                    first_bracket = response["response"]["data"].find("{")
+                    response["response"]["data"] = \
+                        json.loads(
+                            response["response"]["data"][first_bracket:]
+                        )
+            if isinstance(response["response"]["data"], str):
+                response['video_url'] = response["response"]["data"]
+            else:
+                # The response is a dictionary with an error message
+                # E.g. { "code": 503, "type": "InternalServerException",
+                #        "message": "Prediction failed" }
+                response["ttv_followup_response"] = \
+                    response["response"]["data"]
+                response["error"] = True
+                response["error_message"] = \
+                    f"[E-RH-ALL-100] Video generation failed" \
+                    f" (request_id: {request_id}," \
+                    f' response: {response["ttv_followup_response"]})'
+            return True
+        return False
+
+    def get_video_check_result(self, response: dict, request_id: str
+                               ) -> dict:
+        """
+        Returns the final video generation check response
+        """
+        if response['error'] and response.get("ttv_followup_response") \
+           and not response.get("response"):
+            # Request error: returned as is
+            return response
+        video_url = response.get('video_url')
         if not video_url:
             response["error"] = True
             response["error_message"] = response.get("error_message") or \
                 f"[E-RH-ALL-200] Video generation failed" \
                 f" (request_id: {request_id}, response: {response})"
-
         response['video_url'] = video_url
         return response
@@ -1,15 +1,20 @@
 """
 Together AI API
 """
+from typing import Iterator
 import os
 
-from together import Together
+from together import Together, AsyncTogether
 
 from lib.codegen_utilities import (
     log_debug,
     get_default_resultset,
 )
 from lib.codegen_ai_abstracts import LlmProviderAbstract
+from lib.codegen_ai_clients import (
+    get_pooled_client,
+    get_pooled_async_client,
+)
 
 
 DEBUG = False
@@ -39,6 +44,94 @@ class TogetherAiLlm(LlmProviderAbstract):
         if pam_response['error']:
             return pam_response
 
+        model_params = self.get_query_model_params(pam_response)
+        log_debug("together_ai_query | " +
+                  f"model_params: {model_params}", debug=DEBUG)
+        # Together AI client doesn't accept a custom httpx client
+        client = get_pooled_client(Together, self.get_query_client_params(),
+                                   use_http_client=False)
+        response_raw = client.chat.completions.create(**model_params)
+        response['response'] = response_raw.choices[0].message.content
+        response['refined_prompt'] = pam_response['refined_prompt']
+        log_debug("together_ai_query | " +
+                  f"response: {response}", debug=DEBUG)
+        return response
+
+    def query_stream(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Perform a Together AI request streaming the response tokens
+        """
+        pam_response = self.get_prompts_and_messages(
+            user_input=question,
+            system_prompt=prompt,
+            prompt_enhancement_text=prompt_enhancement_text,
+            unified=unified,
+        )
+        if pam_response['error']:
+            return pam_response
+        model_params = self.get_query_model_params(pam_response)
+        model_params["stream"] = True
+        log_debug("together_ai_query_stream | " +
+                  f"model_params: {model_params}", debug=DEBUG)
+        response = get_default_resultset()
+        response['response'] = ""
+        response['refined_prompt'] = pam_response['refined_prompt']
+        response['stream'] = self.stream_chunks(
+            response, self.get_chat_stream(model_params))
+        return response
+
+    def get_chat_stream(self, model_params: dict) -> Iterator[str]:
+        """
+        Yields the Together AI response text chunks
+        """
+        client = get_pooled_client(Together, self.get_query_client_params(),
+                                   use_http_client=False)
+        for chunk in client.chat.completions.create(**model_params):
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                yield chunk.choices[0].delta.content
+
+    async def aquery(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Perform a Together AI request with the AsyncTogether client
+        """
+        response = get_default_resultset()
+        pam_response = await self.aget_prompts_and_messages(
+            user_input=question,
+            system_prompt=prompt,
+            prompt_enhancement_text=prompt_enhancement_text,
+            unified=unified,
+        )
+        if pam_response['error']:
+            return pam_response
+        model_params = self.get_query_model_params(pam_response)
+        log_debug("together_ai_aquery | " +
+                  f"model_params: {model_params}", debug=DEBUG)
+        client = get_pooled_async_client(AsyncTogether,
+                                         self.get_query_client_params(),
+                                         use_http_client=False)
+        response_raw = await client.chat.completions.create(**model_params)
+        response['response'] = response_raw.choices[0].message.content
+        response['refined_prompt'] = pam_response['refined_prompt']
+        log_debug("together_ai_aquery | " +
+                  f"response: {response}", debug=DEBUG)
+        return response
+
+    def get_query_model_params(self, pam_response: dict) -> dict:
+        """
+        Returns the Together AI API parameters for the query
+        """
         model_additional_params = {
             "model": self.model_name or os.environ.get(
                 "TOGETHER_AI_MODEL_NAME"),
@@ -54,22 +147,17 @@ class TogetherAiLlm(LlmProviderAbstract):
         if os.environ.get("TOGETHER_AI_SAFETY_MODEL"):
             model_additional_params["safety_model"] = os.environ.get(
                 "TOGETHER_AI_SAFETY_MODEL")
-        model_params = self.get_model_args(
+        return self.get_model_args(
             additional_params=model_additional_params,
         )
 
-        client_params = self.get_client_args(
+    def get_query_client_params(self) -> dict:
+        """
+        Returns the Together AI client parameters
+        """
+        return self.get_client_args(
             additional_params={
                 "api_key": self.api_key or os.environ.get(
                     "TOGETHER_AI_API_KEY"),
             },
         )
-        log_debug("together_ai_query | " +
-                  f"model_params: {model_params}", debug=DEBUG)
-        client = Together(**client_params)
-        response_raw = client.chat.completions.create(**model_params)
-        response['response'] = response_raw.choices[0].message.content
-        response['refined_prompt'] = pam_response['refined_prompt']
-        log_debug("together_ai_query | " +
-                  f"response: {response}", debug=DEBUG)
-        return response
@@ -3,41 +3,21 @@ X AI (Grok) API
 """
 import os
 
-from lib.codegen_utilities import (
-    log_debug,
-    get_default_resultset,
-)
-from lib.codegen_ai_abstracts import LlmProviderAbstract
-from lib.codegen_ai_provider_openai import get_openai_api_response
+from lib.codegen_ai_provider_openai import OpenaiLlm
 
 
 DEBUG = False
 
 
-class XaiLlm(LlmProviderAbstract):
+class XaiLlm(OpenaiLlm):
     """
     X AI (Grok) LLM class
     """
-    def query(
-        self,
-        prompt: str,
-        question: str,
-        prompt_enhancement_text: str = None,
-        unified: bool = False,
-    ) -> dict:
+    def get_query_model_params(self, pam_response: dict) -> dict:
         """
-        Perform a X AI (Grok) request
+        Returns the X AI (Grok) API parameters for the query
         """
-        response = get_default_resultset()
-        pam_response = self.get_prompts_and_messages(
-            user_input=question,
-            system_prompt=prompt,
-            prompt_enhancement_text=prompt_enhancement_text,
-            unified=unified,
-        )
-        if pam_response['error']:
-            return pam_response
-        model_params = self.get_model_args(
+        return self.get_model_args(
             additional_params={
                 "model": (self.model_name or
                           os.environ.get("XAI_MODEL_NAME")),
@@ -48,14 +28,6 @@ class XaiLlm(LlmProviderAbstract):
             },
             for_openai_api=True,
         )
-        # Get the LLM response
-        log_debug("x_grok | " +
-                  f"model_params: {model_params}", debug=DEBUG)
-        response = get_openai_api_response(model_params)
-        response['refined_prompt'] = pam_response['refined_prompt']
-        log_debug("x_grok | " +
-                  f"response: {response}", debug=DEBUG)
-        return response
 
 # -------------
 
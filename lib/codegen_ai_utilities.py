@@ -1,16 +1,127 @@
 """
 AI utilities
 """
+from typing import Callable, Iterator, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import asyncio
+import threading
+
 from lib.codegen_ai_abstracts import LlmProviderAbstract
 from lib.codegen_ai_provider_openai import (
     OpenaiLlm,
     OpenaiImageGen,
 )
-from lib.codegen_utilities import log_debug
+from lib.codegen_ai_cache import get_llm_cache_stats
+from lib.codegen_utilities import (
+    log_debug,
+    get_default_resultset,
+    error_resultset,
+    prune_closed_loops_entries,
+)
 
 
 DEBUG = False
 
+# Concurrent image generation requests by provider, shared by the process.
+# Overridden with IMAGE_GEN_MAX_CONCURRENCY_<PROVIDER> (e.g.
+# IMAGE_GEN_MAX_CONCURRENCY_OPENAI) or IMAGE_GEN_MAX_CONCURRENCY
+DEFAULT_IMAGE_GEN_MAX_CONCURRENCY = 4
+IMAGE_GEN_PROVIDERS_MAX_CONCURRENCY = {
+    # The HuggingFace serverless inference API is rate limited
+    "huggingface": 2,
+}
+
+image_gen_semaphores = {}
+image_gen_semaphores_lock = threading.Lock()
+# The async semaphores, by event loop and provider. The entries of the
+# closed loops are pruned on each lookup.
+image_gen_async_semaphores = {}
+
+
+def get_image_gen_max_concurrency(provider: str) -> int:
+    """
+    Returns the maximum concurrent image generation requests for the
+    provider
+    """
+    return int(os.environ.get(
+        f"IMAGE_GEN_MAX_CONCURRENCY_{str(provider).upper()}",
+        os.environ.get(
+            "IMAGE_GEN_MAX_CONCURRENCY",
+            IMAGE_GEN_PROVIDERS_MAX_CONCURRENCY.get(
+                provider, DEFAULT_IMAGE_GEN_MAX_CONCURRENCY))))
+
+
+def get_image_gen_semaphore(provider: str) -> threading.BoundedSemaphore:
+    """
+    Returns the provider image generation requests semaphore, shared by the
+    threads of the process
+    """
+    with image_gen_semaphores_lock:
+        if provider not in image_gen_semaphores:
+            image_gen_semaphores[provider] = threading.BoundedSemaphore(
+                get_image_gen_max_concurrency(provider))
+        return image_gen_semaphores[provider]
+
+
+def get_image_gen_async_semaphore(provider: str) -> asyncio.Semaphore:
+    """
+    Returns the provider image generation requests semaphore for the
+    current event loop
+    """
+    loop = asyncio.get_running_loop()
+    key = (id(loop), provider)
+    with image_gen_semaphores_lock:
+        prune_closed_loops_entries(image_gen_async_semaphores)
+        entry = image_gen_async_semaphores.get(key)
+        if entry is None or entry["loop"] is not loop:
+            entry = {
+                "loop": loop,
+                "semaphore": asyncio.Semaphore(
+                    get_image_gen_max_concurrency(provider)),
+            }
+            image_gen_async_semaphores[key] = entry
+        return entry["semaphore"]
+
+
+def get_image_gen_batch_prompts(question: Union[str, List[str]], n: int
+                                ) -> List[str]:
+    """
+    Returns the prompt of each image in a batch: the question prompts if
+    it's a list, or n times the question
+    """
+    if isinstance(question, (list, tuple)):
+        return list(question)
+    return [question] * max(1, int(n or 1))
+
+
+def get_image_gen_batch_result(responses: List[dict]) -> dict:
+    """
+    Returns the image generation batch response: response['response'] has
+    the list of all the generated images, and response['responses'] each
+    request response. It's an error only if no image was generated.
+    """
+    result = get_default_resultset()
+    images = []
+    errors = []
+    refined_prompts = []
+    for response in responses:
+        if response['error']:
+            errors.append(response['error_message'])
+            continue
+        answer = response.get('response')
+        images.extend(answer if isinstance(answer, list) else [answer])
+        if response.get('refined_prompt') and \
+           response['refined_prompt'] not in refined_prompts:
+            refined_prompts.append(response['refined_prompt'])
+    result['response'] = images
+    result['responses'] = responses
+    result['refined_prompt'] = "\n\n".join(refined_prompts) or None
+    if errors:
+        result['error'] = not images
+        result['error_message'] = " | ".join(errors)
+    return result
+
 
 class LlmProvider(LlmProviderAbstract):
     """
@@ -56,9 +167,12 @@ class LlmProvider(LlmProviderAbstract):
         question: str,
         prompt_enhancement_text: str = None,
         unified: bool = False,
+        cache_ttl: int = None,
     ) -> dict:
         """
-        Abstract method for querying the LLM
+        Abstract method for querying the LLM.
+        Identical requests are served from the LLM responses cache for
+        cache_ttl seconds (None: LLM_CACHE_TTL default, 0: no cache).
         """
         unified = unified or self.get_unified_flag()
         log_debug(
@@ -72,14 +186,75 @@ class LlmProvider(LlmProviderAbstract):
             f"{self.llm.params.get('no_system_prompt_allowed_models')}",
             DEBUG
         )
-        llm_response = self.llm.query(
+        llm_response = self.llm.query_with_cache(
             prompt=prompt,
             question=question,
             prompt_enhancement_text=prompt_enhancement_text,
             unified=unified,
+            cache_ttl=cache_ttl,
         )
         return llm_response
 
+    def query_stream(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+    ) -> dict:
+        """
+        Abstract method for querying the LLM streaming the response tokens.
+        The response "stream" attribute is a generator of text chunks.
+        """
+        unified = unified or self.get_unified_flag()
+        log_debug(
+            "LLmProvider.query_stream" +
+            f"\n| provider: {self.llm.params.get('provider')}" +
+            f"\n| model: {self.llm.params.get('model_name')}" +
+            f"\n| unified: {unified}",
+            DEBUG
+        )
+        return self.llm.query_stream(
+            prompt=prompt,
+            question=question,
+            prompt_enhancement_text=prompt_enhancement_text,
+            unified=unified,
+        )
+
+    async def aquery(
+        self,
+        prompt: str,
+        question: str,
+        prompt_enhancement_text: str = None,
+        unified: bool = False,
+        cache_ttl: int = None,
+    ) -> dict:
+        """
+        Abstract method for querying the LLM without blocking the event loop
+        """
+        unified = unified or self.get_unified_flag()
+        log_debug(
+            "LLmProvider.aquery" +
+            f"\n| provider: {self.llm.params.get('provider')}" +
+            f"\n| model: {self.llm.params.get('model_name')}" +
+            f"\n| unified: {unified}",
+            DEBUG
+        )
+        llm_response = await self.llm.aquery_with_cache(
+            prompt=prompt,
+            question=question,
+            prompt_enhancement_text=prompt_enhancement_text,
+            unified=unified,
+            cache_ttl=cache_ttl,
+        )
+        return llm_response
+
+    def get_cache_stats(self) -> dict:
+        """
+        Returns the LLM responses cache hit/miss counters
+        """
+        return get_llm_cache_stats()
+
 
 class ImageGenProvider(LlmProviderAbstract):
     """
@@ -107,6 +282,15 @@ class ImageGenProvider(LlmProviderAbstract):
             prompt, question,
             prompt_enhancement_text)
 
+    async def aquery(self, prompt: str, question: str,
+                     prompt_enhancement_text: str = None) -> dict:
+        """
+        Perform a LLM query request without blocking the event loop
+        """
+        return await self.llm.aquery(
+            prompt, question,
+            prompt_enhancement_text)
+
     def image_gen(
         self,
         question: str,
@@ -121,6 +305,118 @@ class ImageGenProvider(LlmProviderAbstract):
             prompt_enhancement_text=prompt_enhancement_text,
             image_extension=image_extension)
 
+    async def aimage_gen(
+        self,
+        question: str,
+        prompt_enhancement_text: str = None,
+        image_extension: str = 'jpg',
+    ) -> dict:
+        """
+        Perform a image generation request without blocking the event loop
+        """
+        return await self.llm.aimage_gen(
+            question=question,
+            prompt_enhancement_text=prompt_enhancement_text,
+            image_extension=image_extension)
+
+    def iter_image_gen_batch(
+        self,
+        question: Union[str, List[str]],
+        n: int = 1,
+        prompt_enhancement_text: str = None,
+        image_extension: str = 'jpg',
+    ) -> Iterator[Tuple[int, dict]]:
+        """
+        Perform several image generation requests concurrently, up to the
+        provider concurrency limit, and yields the (index, response) of each
+        one as soon as it finishes.
+
+        Args:
+            question (str | list): the prompt of each image, or a single
+                prompt for n images.
+            n (int): number of images if question is a single prompt.
+        """
+        prompts = get_image_gen_batch_prompts(question, n)
+        semaphore = get_image_gen_semaphore(self.params.get("provider"))
+
+        def generate(prompt: str) -> dict:
+            with semaphore:
+                try:
+                    return self.image_gen(
+                        question=prompt,
+                        prompt_enhancement_text=prompt_enhancement_text,
+                        image_extension=image_extension)
+                except Exception as e:
+                    return error_resultset(str(e), "IGP-IGB-E010")
+
+        max_workers = min(len(prompts), get_image_gen_max_concurrency(
+            self.params.get("provider")))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(generate, prompt): index
+                       for index, prompt in enumerate(prompts)}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def image_gen_batch(
+        self,
+        question: Union[str, List[str]],
+        n: int = 1,
+        prompt_enhancement_text: str = None,
+        image_extension: str = 'jpg',
+        on_image: Callable[[int, dict], None] = None,
+    ) -> dict:
+        """
+        Perform several image generation requests concurrently (see
+        iter_image_gen_batch()), calling on_image(index, response) in the
+        caller thread as each one finishes
+        """
+        prompts = get_image_gen_batch_prompts(question, n)
+        responses = [None] * len(prompts)
+        for index, response in self.iter_image_gen_batch(
+                prompts, n, prompt_enhancement_text, image_extension):
+            responses[index] = response
+            if on_image:
+                on_image(index, response)
+        return get_image_gen_batch_result(responses)
+
+    async def aimage_gen_batch(
+        self,
+        question: Union[str, List[str]],
+        n: int = 1,
+        prompt_enhancement_text: str = None,
+        image_extension: str = 'jpg',
+        on_image: Callable[[int, dict], None] = None,
+    ) -> dict:
+        """
+        Perform several image generation requests concurrently without
+        blocking the event loop, up to the provider concurrency limit,
+        calling on_image(index, response) as each one finishes
+        """
+        prompts = get_image_gen_batch_prompts(question, n)
+        semaphore = get_image_gen_async_semaphore(
+            self.params.get("provider"))
+
+        async def generate(index: int, prompt: str) -> Tuple[int, dict]:
+            async with semaphore:
+                try:
+                    response = await self.aimage_gen(
+                        question=prompt,
+                        prompt_enhancement_text=prompt_enhancement_text,
+                        image_extension=image_extension)
+                except Exception as e:
+                    response = error_resultset(str(e), "IGP-AIGB-E010")
+            return index, response
+
+        responses = [None] * len(prompts)
+        for task in asyncio.as_completed(
+                [generate(index, prompt)
+                 for index, prompt in enumerate(prompts)]):
+            index, response = await task
+            responses[index] = response
+            if on_image:
+                on_image(index, response)
+        return get_image_gen_batch_result(responses)
+
 
 class TextToVideoProvider(LlmProviderAbstract):
     """
@@ -148,6 +444,15 @@ class TextToVideoProvider(LlmProviderAbstract):
             prompt, question,
             prompt_enhancement_text)
 
+    async def aquery(self, prompt: str, question: str,
+                     prompt_enhancement_text: str = None) -> dict:
+        """
+        Perform a LLM query request without blocking the event loop
+        """
+        return await self.llm.aquery(
+            prompt, question,
+            prompt_enhancement_text)
+
     def video_gen(
         self,
         question: str,
@@ -158,6 +463,16 @@ class TextToVideoProvider(LlmProviderAbstract):
         """
         return self.llm.video_gen(question, prompt_enhancement_text)
 
+    async def avideo_gen(
+        self,
+        question: str,
+        prompt_enhancement_text: str = None
+    ) -> dict:
+        """
+        Perform a video generation request without blocking the event loop
+        """
+        return await self.llm.avideo_gen(question, prompt_enhancement_text)
+
     def image_gen(
         self,
         question: str,
@@ -172,6 +487,20 @@ class TextToVideoProvider(LlmProviderAbstract):
             prompt_enhancement_text=prompt_enhancement_text,
             image_extension=image_extension)
 
+    async def aimage_gen(
+        self,
+        question: str,
+        prompt_enhancement_text: str = None,
+        image_extension: str = 'jpg',
+    ) -> dict:
+        """
+        Perform a image generation request without blocking the event loop
+        """
+        return await self.llm.aimage_gen(
+            question=question,
+            prompt_enhancement_text=prompt_enhancement_text,
+            image_extension=image_extension)
+
     def video_gen_followup(
         self,
         request_response: dict,
@@ -181,3 +510,28 @@ class TextToVideoProvider(LlmProviderAbstract):
         Perform a video generation request check
         """
         return self.llm.video_gen_followup(request_response, wait_time)
+
+    async def avideo_gen_followup(
+        self,
+        request_response: dict,
+        wait_time: int = 60
+    ):
+        """
+        Perform a video generation request check without blocking the
+        event loop
+        """
+        return await self.llm.avideo_gen_followup(request_response,
+                                                  wait_time)
+
+    def video_gen_check(self, request_response: dict) -> dict:
+        """
+        Perform a single video generation request check
+        """
+        return self.llm.video_gen_check(request_response)
+
+    async def avideo_gen_check(self, request_response: dict) -> dict:
+        """
+        Perform a single video generation request check without blocking
+        the event loop
+        """
+        return await self.llm.avideo_gen_check(request_response)
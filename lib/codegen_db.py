@@ -1,14 +1,56 @@
 """
 Generic database
 """
-from lib.codegen_db_abstracts import DatabaseAbstract
+from typing import List, Dict, Iterator
+import os
+import json
+import time
+import asyncio
+import threading
+
+from lib.codegen_db_abstracts import (
+    DatabaseAbstract,
+    AsyncDatabaseAbstract,
+    DEFAULT_DB_BATCH_SIZE,
+)
 from lib.codegen_db_json import JsonFileDatabase
-from lib.codegen_db_mongodb import MongoDBDatabase
-# from lib.codegen_utilities import log_debug
+from lib.codegen_db_jsonl import JsonlFileDatabase
+from lib.codegen_db_sqlite import SqliteDatabase
+from lib.codegen_db_mongodb import MongoDBDatabase, AsyncMongoDBDatabase
+from lib.codegen_utilities import (
+    log_debug,
+    prune_closed_loops_entries,
+)
 
 
 DEBUG = False
 
+# Seconds between the shared database handles health checks
+DEFAULT_DB_HEALTH_CHECK_INTERVAL = 30
+
+# Shared database handles, by db_type and connection parameters, reused by
+# all the callers of the process (e.g. Streamlit reruns and sessions)
+database_registry = {}
+database_registry_lock = threading.Lock()
+
+# Shared async database handles, also keyed by event loop because the
+# native asyncio clients can't be shared between loops. The entries of the
+# closed loops are pruned on each lookup.
+async_database_registry = {}
+
+
+def get_mongodb_parameters(other_data: dict) -> tuple:
+    """
+    Returns the MongoDB uri, database name and collection name
+    """
+    uri = other_data.get('MONGODB_URI')
+    db_name = other_data.get('MONGODB_DB_NAME')
+    collection_name = other_data.get('MONGODB_COLLECTION_NAME')
+    if not uri or not db_name or not collection_name:
+        raise ValueError("Invalid MONGODB_URI, MONGODB_DB_NAME or "
+                         "MONGODB_COLLECTION_NAME in other_data")
+    return uri, db_name, collection_name
+
 
 class CodegenDatabase(DatabaseAbstract):
     """
@@ -28,20 +70,27 @@ class CodegenDatabase(DatabaseAbstract):
             if not db_path:
                 raise ValueError("Invalid JSON_DB_PATH in other_data")
             self.db = JsonFileDatabase(db_path)
+        elif db_type == 'jsonl':
+            db_path = self.other_data.get('JSONL_DB_PATH')
+            if not db_path:
+                raise ValueError("Invalid JSONL_DB_PATH in other_data")
+            self.db = JsonlFileDatabase(db_path, self.other_data)
+        elif db_type == 'sqlite':
+            db_path = self.other_data.get('SQLITE_DB_PATH')
+            if not db_path:
+                raise ValueError("Invalid SQLITE_DB_PATH in other_data")
+            self.db = SqliteDatabase(db_path)
         elif db_type == 'mongodb':
-            uri = self.other_data.get('MONGODB_URI')
-            db_name = self.other_data.get('MONGODB_DB_NAME')
-            collection_name = self.other_data.get('MONGODB_COLLECTION_NAME')
-            if not uri or not db_name or not collection_name:
-                raise ValueError("Invalid MONGODB_URI, MONGODB_DB_NAME or "
-                                 "MONGODB_COLLECTION_NAME in other_data")
+            uri, db_name, collection_name = \
+                get_mongodb_parameters(self.other_data)
             # log_debug(f"CodegenDatabase | "
             #           f"uri: {uri} | db_name: {db_name} | "
             #           f"collection_name: {collection_name}",
             #           debug=DEBUG)
             self.db = MongoDBDatabase(uri, db_name, collection_name)
         else:
-            raise ValueError("Invalid db_type. Must be 'json' or 'mongodb'")
+            raise ValueError("Invalid db_type. Must be 'json', 'jsonl', "
+                             "'sqlite' or 'mongodb'")
 
     def save_item(self, item_data: dict, id: str = None):
         """
@@ -49,11 +98,21 @@ class CodegenDatabase(DatabaseAbstract):
         """
         return self.db.save_item(item_data, id)
 
-    def get_list(self, sort_attr: str = None, sort_order: str = "desc"):
+    def get_list(
+        self,
+        sort_attr: str = None,
+        sort_order: str = "desc",
+        limit: int = None,
+        offset: int = 0,
+        fields: List[str] = None,
+        filter: dict = None,
+    ):
         """
-        Returns the items in the database
+        Returns the items in the database, optionally filtered, projected
+        to some fields, and paginated
         """
-        return self.db.get_list(sort_attr, sort_order)
+        return self.db.get_list(sort_attr, sort_order, limit, offset,
+                                fields, filter)
 
     def get_item(self, id: str):
         """
@@ -67,6 +126,132 @@ class CodegenDatabase(DatabaseAbstract):
         """
         return self.db.delete_item(id)
 
+    def bulk_save_items(self, items: Dict[str, Dict]) -> int:
+        """
+        Save several items in the database with the backend bulk
+        implementation
+        """
+        return self.db.bulk_save_items(items)
+
+    def iter_items(self, batch_size: int = DEFAULT_DB_BATCH_SIZE
+                   ) -> Iterator[dict]:
+        """
+        Yields all the items in the database
+        """
+        return self.db.iter_items(batch_size)
+
+    def is_alive(self) -> bool:
+        """
+        Health check: returns True if the database can be used
+        """
+        return self.db.is_alive()
+
+    def close(self):
+        """
+        Release the database connections, if any
+        """
+        return self.db.close()
+
+
+def get_database_key(db_type: str, other_data: dict = None) -> str:
+    """
+    Returns the shared database handle key
+    """
+    return json.dumps([db_type, other_data or {}], sort_keys=True,
+                      default=str)
+
+
+def get_shared_database(db_type: str, other_data: dict = None
+                        ) -> CodegenDatabase:
+    """
+    Returns the process-wide database handle for the db_type and connection
+    parameters, creating it on first use. The handle is health checked at
+    most every DB_HEALTH_CHECK_INTERVAL seconds, and replaced by a new
+    connection if the check fails.
+    """
+    key = get_database_key(db_type, other_data)
+    check_interval = float(os.environ.get(
+        "DB_HEALTH_CHECK_INTERVAL", DEFAULT_DB_HEALTH_CHECK_INTERVAL))
+    with database_registry_lock:
+        entry = database_registry.get(key)
+        if not entry:
+            entry = {
+                "db": CodegenDatabase(db_type, other_data),
+                "checked_at": time.time(),
+            }
+            database_registry[key] = entry
+            return entry["db"]
+        now = time.time()
+        if now - entry["checked_at"] < check_interval:
+            return entry["db"]
+        # The check is claimed by this thread, the others keep using the
+        # handle meanwhile
+        entry["checked_at"] = now
+    # The health check can be a network round trip (e.g. a MongoDB ping),
+    # so it's done without holding the registry lock
+    if entry["db"].is_alive():
+        return entry["db"]
+    log_debug("get_shared_database | Health check failed, "
+              f"reconnecting the {db_type} database", debug=DEBUG)
+    new_entry = {
+        "db": CodegenDatabase(db_type, other_data),
+        "checked_at": time.time(),
+    }
+    with database_registry_lock:
+        # The old handle isn't closed, because other threads can still be
+        # using it. It's released when it's garbage-collected.
+        if database_registry.get(key) is entry:
+            database_registry[key] = new_entry
+        return database_registry[key]["db"]
+
+
+def get_async_database(db_type: str, other_data: dict = None
+                       ) -> AsyncDatabaseAbstract:
+    """
+    Returns an async database for the db_type: the native asyncio client
+    for MongoDB, and the shared synchronous database offloaded to worker
+    threads for the file based databases
+    """
+    if db_type == 'mongodb':
+        return AsyncMongoDBDatabase(*get_mongodb_parameters(other_data or {}))
+    return AsyncDatabaseAbstract(get_shared_database(db_type, other_data))
+
+
+async def get_shared_async_database(db_type: str, other_data: dict = None
+                                    ) -> AsyncDatabaseAbstract:
+    """
+    Returns the async database handle for the db_type and connection
+    parameters shared by the current event loop, health checked at most
+    every DB_HEALTH_CHECK_INTERVAL seconds and reconnected if it fails.
+    """
+    loop = asyncio.get_running_loop()
+    key = (id(loop), get_database_key(db_type, other_data))
+    check_interval = float(os.environ.get(
+        "DB_HEALTH_CHECK_INTERVAL", DEFAULT_DB_HEALTH_CHECK_INTERVAL))
+    with database_registry_lock:
+        prune_closed_loops_entries(async_database_registry)
+        entry = async_database_registry.get(key)
+    if entry and entry["loop"] is not loop:
+        entry = None
+    now = time.time()
+    if entry and now - entry["checked_at"] >= check_interval:
+        entry["checked_at"] = now
+        if not await entry["db"].is_alive():
+            log_debug("get_shared_async_database | Health check failed, "
+                      f"reconnecting the {db_type} database", debug=DEBUG)
+            # The old handle isn't closed, because other tasks can still be
+            # using it. It's released when it's garbage-collected.
+            entry = None
+    if not entry:
+        entry = {
+            "db": get_async_database(db_type, other_data),
+            "loop": loop,
+            "checked_at": now,
+        }
+        with database_registry_lock:
+            async_database_registry[key] = entry
+    return entry["db"]
+
 
 # Example usage:
 # db = CodegenDatabase("json")
@@ -1,9 +1,12 @@
 """
 Generic database abstracts
 """
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Any, Iterable, Iterator, IO
 import os
+import io
 import json
+import asyncio
+import textwrap
 
 from lib.codegen_utilities import (
     get_new_item_id,
@@ -11,6 +14,210 @@ from lib.codegen_utilities import (
 )
 
 
+# Characters read from the JSON files per chunk by the streaming importer
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
+# Items saved per bulk_save_items() call by the streaming importer, and
+# read per get_list() page by the streaming exporter
+DEFAULT_DB_BATCH_SIZE = 500
+
+
+class JsonStreamReader:
+    """
+    Incremental JSON tokens reader, so a large JSON array or object can be
+    decoded one element at a time
+    """
+    def __init__(self, f: IO, chunk_size: int = JSON_STREAM_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self) -> bool:
+        """
+        Appends the next chunk to the buffer, dropping the consumed text.
+        The chunk grows with the pending text, so a large element is read
+        in linear time. Returns False at the end of the file.
+        """
+        if self.eof:
+            return False
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        chunk = self.f.read(max(self.chunk_size, len(self.buffer)))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def skip_whitespace(self) -> bool:
+        """
+        Moves to the next non whitespace character. Returns False at the
+        end of the file.
+        """
+        while True:
+            while self.pos < len(self.buffer) and \
+                    self.buffer[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return True
+            if not self.read_more():
+                return False
+
+    def peek_char(self) -> str:
+        """
+        Returns the next non whitespace character, or "" at the end
+        """
+        if not self.skip_whitespace():
+            return ""
+        return self.buffer[self.pos]
+
+    def next_char(self) -> str:
+        """
+        Consumes and returns the next non whitespace character
+        """
+        char = self.peek_char()
+        self.pos += len(char)
+        return char
+
+    def decode(self) -> Any:
+        """
+        Decodes the next JSON value
+        """
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.read_more():
+                    continue
+                raise
+            if end == len(self.buffer) and self.read_more():
+                # A number could continue in the next chunk
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_items(f: IO, chunk_size: int = JSON_STREAM_CHUNK_SIZE
+                    ) -> Iterator[dict]:
+    """
+    Yields the items of a JSON array, or of a JSON object (id -> item, the
+    JSON file database format) with the "id" attribute added, reading the
+    file incrementally so only one item is held in memory at a time
+    """
+    reader = JsonStreamReader(f, chunk_size)
+    container = reader.next_char()
+    if container not in ("[", "{"):
+        raise ValueError("JSON array or object expected")
+    closing = "]" if container == "[" else "}"
+    if reader.peek_char() == closing:
+        return
+    while True:
+        if container == "{":
+            id = reader.decode()
+            if reader.next_char() != ":":
+                raise ValueError(f"Invalid JSON object entry: {id}")
+            item = dict(reader.decode())
+            item['id'] = id
+        else:
+            item = reader.decode()
+        yield item
+        separator = reader.next_char()
+        if separator == closing:
+            return
+        if separator != ",":
+            raise ValueError(f"Invalid JSON separator: '{separator}'")
+
+
+def get_items_dict(data: Union[List[Dict], Dict]) -> Dict[str, Dict]:
+    """
+    Returns the import data as an id -> item dict, without the "id"
+    attribute in the items
+    """
+    # If data is a list of dictionaries, convert it to a dictionary
+    if isinstance(data, list):
+        data = {item.get('id', get_new_item_id()): item for item in data}
+    items = {}
+    for id, item_data in data.items():
+        item_data = dict(item_data)
+        item_data.pop('id', None)
+        items[str(id)] = item_data
+    return items
+
+
+def item_matches_filter(item: dict, filter: dict = None) -> bool:
+    """
+    Returns True if the item matches the filter: each filter attribute
+    must be equal to the item attribute, or contain it if it's a list
+    (e.g. {"type": ["image", "video"]})
+    """
+    if not filter:
+        return True
+    for attr, value in filter.items():
+        if isinstance(value, (list, tuple, set)):
+            if item.get(attr) not in value:
+                return False
+        elif item.get(attr) != value:
+            return False
+    return True
+
+
+def get_sort_key(sort_attr: str):
+    """
+    Returns the sort key function for an item attribute. Items without
+    the attribute are sorted first (ascending order).
+    """
+    def sort_key(item: dict) -> tuple:
+        value = item.get(sort_attr)
+        return (value is not None, value)
+    return sort_key
+
+
+def get_list_from_dict(
+    json_db: dict,
+    sort_attr: str = None,
+    sort_order: str = "desc",
+    limit: int = None,
+    offset: int = 0,
+    fields: List[str] = None,
+    filter: dict = None,
+) -> List[Dict]:
+    """
+    Returns the items list for the in-memory databases (id -> item dict),
+    filtered, projected, sorted and paginated like get_list()
+    """
+    items = []
+    for id, item in json_db.items():
+        if not item_matches_filter(item, filter):
+            continue
+        if fields:
+            item_to_append = {field: item[field] for field in fields
+                              if field in item}
+            if sort_attr and sort_attr in item:
+                item_to_append[sort_attr] = item[sort_attr]
+        else:
+            item_to_append = item.copy()
+        item_to_append['id'] = id
+        items.append(item_to_append)
+    if sort_attr:
+        items = sorted(items, key=get_sort_key(sort_attr),
+                       reverse=sort_order == "desc")
+    return paginate_items(items, limit, offset)
+
+
+def paginate_items(items: List[Any], limit: int = None, offset: int = 0
+                   ) -> List[Any]:
+    """
+    Returns the items page
+    """
+    offset = offset or 0
+    if limit is None:
+        return items[offset:]
+    return items[offset:offset + limit]
+
+
 class DatabaseAbstract:
     """
     Database abstract class
@@ -31,9 +238,31 @@ class DatabaseAbstract:
         """
         raise NotImplementedError
 
-    def get_list(self, sort_attr: str = None, sort_order: str = "desc"):
+    def get_list(
+        self,
+        sort_attr: str = None,
+        sort_order: str = "desc",
+        limit: int = None,
+        offset: int = 0,
+        fields: List[str] = None,
+        filter: dict = None,
+    ):
         """
         Returns the items in the database
+
+        Args:
+            sort_attr (str): attribute to sort by. Defaults to None.
+            sort_order (str): "asc" or "desc". Defaults to "desc".
+            limit (int): maximum number of items to return.
+                Defaults to None (all the items).
+            offset (int): number of items to skip. Defaults to 0.
+            fields (List[str]): attributes to return, besides "id".
+                Defaults to None (all the attributes).
+            filter (dict): attribute values the items must have. A list
+                value matches any of its elements. Defaults to None.
+
+        Returns:
+            List[Dict]: the items, each one with its "id" attribute.
         """
         raise NotImplementedError
 
@@ -49,35 +278,140 @@ class DatabaseAbstract:
         """
         raise NotImplementedError
 
+    def is_alive(self) -> bool:
+        """
+        Health check: returns True if the database can be used
+        """
+        return True
+
+    def close(self):
+        """
+        Release the database connections, if any
+        """
+        return None
+
+    def bulk_save_items(self, items: Dict[str, Dict]) -> int:
+        """
+        Save several items (id -> item dict) in the database. The backends
+        override it to save them in a single operation.
+
+        Returns:
+            int: the number of items saved.
+        """
+        for id, item_data in items.items():
+            self.save_item(item_data, id)
+        return len(items)
+
+    def iter_items(self, batch_size: int = DEFAULT_DB_BATCH_SIZE
+                   ) -> Iterator[dict]:
+        """
+        Yields all the items in the database, reading them in pages of
+        batch_size items
+        """
+        offset = 0
+        while True:
+            items = self.get_list(limit=batch_size, offset=offset)
+            yield from items
+            if len(items) < batch_size:
+                return
+            offset += batch_size
+
     def import_data(self, data: Union[List[Dict], Dict]):
         """
         Import data into the database
         """
         response = get_default_resultset()
-        # If data is a list of dictionaries, convert it to a dictionary
-        if isinstance(data, list):
-            data = {item.get('id', get_new_item_id()): item for item in data}
-        for id, item_data in data.items():
-            self.save_item(item_data, id)
-        response['result'] = f"Imported {len(data)} items"
+        items = get_items_dict(data)
+        try:
+            self.bulk_save_items(items)
+        except Exception as e:
+            response['error'] = True
+            response['error_message'] = str(e)
+            return response
+        response['result'] = f"Imported {len(items)} items"
         return response
 
-    def export_data(self) -> str:
+    def import_items(self, items: Iterable[dict],
+                     batch_size: int = DEFAULT_DB_BATCH_SIZE):
         """
-        Export data from the database to JSON
+        Import the items into the database, saving them in batches of
+        batch_size items
         """
         response = get_default_resultset()
-        items = self.get_list()
-        # Convert id to str
+        count = 0
+        batch = []
+        try:
+            for item in items:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    count += self.bulk_save_items(get_items_dict(batch))
+                    batch = []
+            if batch:
+                count += self.bulk_save_items(get_items_dict(batch))
+        except Exception as e:
+            response['error'] = True
+            response['error_message'] = \
+                f"{e} (after importing {count} items)"
+            return response
+        response['result'] = f"Imported {count} items"
+        return response
+
+    def import_data_from_stream(self, f: IO,
+                                batch_size: int = DEFAULT_DB_BATCH_SIZE):
+        """
+        Import data from a JSON array or object file object (text or
+        binary), decoding and saving it incrementally
+        """
+        if not isinstance(f, io.TextIOBase):
+            f = io.TextIOWrapper(f, encoding='utf-8')
+        return self.import_items(iter_json_items(f), batch_size)
+
+    def iter_export_json(self, items: Iterable[dict] = None
+                         ) -> Iterator[str]:
+        """
+        Yields the JSON export of the items (defaults to all the items in
+        the database) in pieces, one item at a time. The result is the
+        same as json.dumps(items, indent=4).
+        """
+        if items is None:
+            items = self.iter_items()
+        yield "["
+        separator = "\n"
         for item in items:
+            # Convert id to str
             item['id'] = str(item['id'])
-        response['json'] = json.dumps(items, indent=4)
-        response['result'] = f"Emported {len(items)} items"
+            yield separator
+            yield textwrap.indent(json.dumps(item, indent=4, default=str),
+                                  " " * 4)
+            separator = ",\n"
+        yield "\n]" if separator != "\n" else "]"
+
+    def iter_counted_items(self, counter: dict) -> Iterator[dict]:
+        """
+        Yields all the items in the database, counting them in
+        counter["items"]
+        """
+        for item in self.iter_items():
+            counter["items"] += 1
+            yield item
+
+    def export_data(self) -> dict:
+        """
+        Export data from the database to a JSON string in response['json'].
+        The items are read in batches, but the resulting string is held in
+        memory: export_data_to_file() writes it one item at a time.
+        """
+        response = get_default_resultset()
+        counter = {"items": 0}
+        response['json'] = "".join(
+            self.iter_export_json(self.iter_counted_items(counter)))
+        response['result'] = f"Emported {counter['items']} items"
         return response
 
     def import_data_from_file(self, file_path: str = None):
         """
-        Import data from a JSON file into the database
+        Import data from a JSON file into the database, streaming it so
+        the whole file is never held in memory
         """
         response = get_default_resultset()
         if not file_path:
@@ -90,20 +424,20 @@ class DatabaseAbstract:
         if response['error']:
             return response
         try:
-            with open(file_path, 'r') as f:
-                data = json.load(f)
+            with open(file_path, 'r', encoding='utf-8') as f:
+                response = self.import_data_from_stream(f)
         except Exception as e:
             response['error'] = True
             response['error_message'] = str(e)
             return response
-        response = self.import_data(data)
         response['file_path'] = file_path
         return response
 
     def export_data_to_file(self, file_path: str = None,
                             overwrite: bool = False):
         """
-        Export data from the database to a JSON file
+        Export data from the database to a JSON file, writing one item at
+        a time
         """
         response = get_default_resultset()
         if not file_path:
@@ -115,10 +449,78 @@ class DatabaseAbstract:
             response['error_message'] = f"File found: {file_path}"
         if response['error']:
             return response
-        response = self.export_data()
-        if response['error']:
+        counter = {"items": 0}
+        try:
+            with open(file_path, 'w', encoding='utf-8') as f:
+                for piece in self.iter_export_json(
+                        self.iter_counted_items(counter)):
+                    f.write(piece)
+        except Exception as e:
+            response['error'] = True
+            response['error_message'] = str(e)
             return response
-        with open(file_path, 'w') as f:
-            f.write(response['json'])
+        response['result'] = f"Emported {counter['items']} items"
         response['file_path'] = file_path
         return response
+
+
+class AsyncDatabaseAbstract:
+    """
+    Async database abstract class. By default, each operation runs the
+    synchronous database method in a worker thread, so the event loop is
+    never blocked. The backends with a native asyncio driver override them.
+    """
+    def __init__(self, sync_db: DatabaseAbstract = None):
+        self.sync_db = sync_db
+
+    async def save_item(self, item_data: dict, id: str = None):
+        """
+        Save the item in the database
+        """
+        return await asyncio.to_thread(self.sync_db.save_item, item_data, id)
+
+    async def bulk_save_items(self, items: Dict[str, Dict]) -> int:
+        """
+        Save several items in the database
+        """
+        return await asyncio.to_thread(self.sync_db.bulk_save_items, items)
+
+    async def get_list(
+        self,
+        sort_attr: str = None,
+        sort_order: str = "desc",
+        limit: int = None,
+        offset: int = 0,
+        fields: List[str] = None,
+        filter: dict = None,
+    ):
+        """
+        Returns the items in the database (see DatabaseAbstract.get_list())
+        """
+        return await asyncio.to_thread(
+            self.sync_db.get_list, sort_attr, sort_order, limit, offset,
+            fields, filter)
+
+    async def get_item(self, id: str):
+        """
+        Returns the item in the database
+        """
+        return await asyncio.to_thread(self.sync_db.get_item, id)
+
+    async def delete_item(self, id: str):
+        """
+        Delete an item from the database
+        """
+        return await asyncio.to_thread(self.sync_db.delete_item, id)
+
+    async def is_alive(self) -> bool:
+        """
+        Health check: returns True if the database can be used
+        """
+        return await asyncio.to_thread(self.sync_db.is_alive)
+
+    async def close(self):
+        """
+        Release the database connections, if any
+        """
+        return await asyncio.to_thread(self.sync_db.close)
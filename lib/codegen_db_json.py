@@ -1,11 +1,33 @@
 """
 JSON file database
 """
+from typing import List, Dict, Iterator
 import os
 import json
 import uuid
+import threading
 
-from lib.codegen_db_abstracts import DatabaseAbstract
+from lib.codegen_db_abstracts import (
+    DatabaseAbstract,
+    DEFAULT_DB_BATCH_SIZE,
+    get_list_from_dict,
+)
+
+
+# Parsed JSON databases, by file path, shared by all the JsonFileDatabase
+# instances of the process. Each entry is reloaded only when the file
+# modification time or size changes (e.g. another process wrote it).
+json_db_cache = {}
+json_db_cache_lock = threading.RLock()
+
+
+def get_file_signature(db_path: str) -> tuple:
+    """
+    Returns the file modification time and size, used to detect changes
+    made outside this process
+    """
+    stat = os.stat(db_path)
+    return (stat.st_mtime_ns, stat.st_size)
 
 
 class JsonFileDatabase(DatabaseAbstract):
@@ -18,16 +40,39 @@ class JsonFileDatabase(DatabaseAbstract):
 
     def init_db(self):
         """
-        Initialize the JSON file database
+        Initialize the JSON file database, and returns its in-memory
+        snapshot. The file is only parsed again if it changed since the
+        last load. The snapshot must not be modified by the callers.
         """
-        if not os.path.exists(self.db_path):
-            with open(self.db_path, 'w') as f:
-                json.dump({}, f)
+        with json_db_cache_lock:
+            if not os.path.exists(self.db_path):
+                self.write_db({})
+            signature = get_file_signature(self.db_path)
+            entry = json_db_cache.get(self.db_path)
+            if entry and entry["signature"] == signature:
+                return entry["data"]
+            with open(self.db_path) as f:
+                json_db = json.load(f)
+            json_db_cache[self.db_path] = {
+                "signature": signature,
+                "data": json_db,
+            }
+            return json_db
 
-        with open(self.db_path) as f:
-            json_db = json.load(f)
-
-        return json_db
+    def write_db(self, json_db: dict):
+        """
+        Write-through persistence: writes the database to a temporary file,
+        replaces the database file with it, and updates the in-memory copy
+        """
+        with json_db_cache_lock:
+            tmp_path = f"{self.db_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(json_db, f)
+            os.replace(tmp_path, self.db_path)
+            json_db_cache[self.db_path] = {
+                "signature": get_file_signature(self.db_path),
+                "data": json_db,
+            }
 
     def save_item(self, item_data: dict, id: str = None):
         """
@@ -35,26 +80,50 @@ class JsonFileDatabase(DatabaseAbstract):
         """
         if not id:
             id = str(uuid.uuid4())
-        json_db = self.init_db()
-        json_db[id] = dict(item_data)
-        with open(self.db_path, 'w') as f:
-            json.dump(json_db, f)
+        with json_db_cache_lock:
+            # Copy-on-write, so the snapshots already returned to other
+            # callers don't change
+            json_db = dict(self.init_db())
+            json_db[id] = dict(item_data)
+            self.write_db(json_db)
         return id
 
-    def get_list(self, sort_attr: str = None, sort_order: str = "desc"):
+    def bulk_save_items(self, items: Dict[str, Dict]) -> int:
+        """
+        Save several items in the database with a single file rewrite
+        """
+        with json_db_cache_lock:
+            json_db = dict(self.init_db())
+            for id, item_data in items.items():
+                json_db[id] = dict(item_data)
+            self.write_db(json_db)
+        return len(items)
+
+    def get_list(
+        self,
+        sort_attr: str = None,
+        sort_order: str = "desc",
+        limit: int = None,
+        offset: int = 0,
+        fields: List[str] = None,
+        filter: dict = None,
+    ):
         """
         Returns the items in the database
         """
         json_db = self.init_db()
-        items = []
-        for id, item in json_db.items():
-            item_to_append = item.copy()
-            item_to_append['id'] = id
-            items.append(item_to_append)
-        if sort_attr:
-            items = sorted(items, key=lambda x: x[sort_attr],
-                           reverse=sort_order == "desc")
-        return items
+        return get_list_from_dict(json_db, sort_attr, sort_order, limit,
+                                  offset, fields, filter)
+
+    def iter_items(self, batch_size: int = DEFAULT_DB_BATCH_SIZE
+                   ) -> Iterator[dict]:
+        """
+        Yields all the items of the in-memory snapshot
+        """
+        for id, item in self.init_db().items():
+            item = item.copy()
+            item['id'] = id
+            yield item
 
     def get_item(self, id: str):
         """
@@ -62,7 +131,7 @@ class JsonFileDatabase(DatabaseAbstract):
         """
         json_db = self.init_db()
         if id in json_db:
-            item = json_db[id]
+            item = json_db[id].copy()
             item['id'] = id
             return item
         return None
@@ -71,8 +140,9 @@ class JsonFileDatabase(DatabaseAbstract):
         """
         Delete a item from the database
         """
-        json_db = self.init_db()
-        if id in json_db:
-            del json_db[id]
-            with open(self.db_path, 'w') as f:
-                json.dump(json_db, f)
+        with json_db_cache_lock:
+            json_db = self.init_db()
+            if id in json_db:
+                json_db = dict(json_db)
+                del json_db[id]
+                self.write_db(json_db)
@@ -0,0 +1,359 @@
+"""
+JSON Lines journal database
+
+Append-only storage engine: each save_item() or delete_item() appends one
+upsert/delete record to the journal file, so the write cost is
+proportional to the record and not to the database size. The in-memory
+items map is rebuilt from the journal on load, and the journal is compacted
+in the background when the ratio of obsolete records exceeds a threshold.
+
+The journal can be shared by several processes: the reads, appends and
+compaction hold an exclusive flock() on a sidecar lock file
+("<journal>.lock"), besides the process lock. flock() is not available on
+Windows, where the journal must be used by a single process.
+"""
+from typing import List, Dict, Iterator
+from contextlib import contextmanager
+import os
+import json
+import uuid
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from lib.codegen_db_abstracts import (
+    DatabaseAbstract,
+    DEFAULT_DB_BATCH_SIZE,
+    get_list_from_dict,
+)
+from lib.codegen_utilities import log_debug
+
+
+DEBUG = False
+
+# Compaction is triggered when the obsolete records ratio exceeds this value
+DEFAULT_JSONL_COMPACTION_RATIO = 0.5
+# ...and the journal has at least this number of records
+DEFAULT_JSONL_COMPACTION_MIN_RECORDS = 100
+
+# Journals state, by file path, shared by all the JsonlFileDatabase
+# instances of the process
+jsonl_db_states = {}
+jsonl_db_lock = threading.RLock()
+# Open lock files, by journal path, with the lock nesting depth, so the
+# methods that call each other holding the lock don't flock() twice
+jsonl_db_file_locks = {}
+
+
+@contextmanager
+def jsonl_db_locked(db_path: str):
+    """
+    Holds the process lock and the inter-process lock of a journal.
+    It can be nested in the same thread.
+    """
+    with jsonl_db_lock:
+        entry = jsonl_db_file_locks.get(db_path)
+        if entry is None:
+            lock_file = open(f"{db_path}.lock", 'a+')
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entry = {"file": lock_file, "depth": 0}
+            jsonl_db_file_locks[db_path] = entry
+        entry["depth"] += 1
+        try:
+            yield
+        finally:
+            entry["depth"] -= 1
+            if not entry["depth"]:
+                del jsonl_db_file_locks[db_path]
+                if fcntl:
+                    fcntl.flock(entry["file"], fcntl.LOCK_UN)
+                entry["file"].close()
+
+
+def get_jsonl_db_generation(db_path: str) -> int:
+    """
+    Returns the journal compactions count, kept in its lock file, so a
+    replaced journal is detected even if the new file gets the inode
+    number of the old one. The caller must hold the journal lock.
+    """
+    lock_file = jsonl_db_file_locks[db_path]["file"]
+    lock_file.seek(0)
+    try:
+        return int(lock_file.read() or 0)
+    except ValueError:
+        return 0
+
+
+def set_jsonl_db_generation(db_path: str, generation: int):
+    """
+    Stores the journal compactions count in its lock file. The caller must
+    hold the journal lock.
+    """
+    lock_file = jsonl_db_file_locks[db_path]["file"]
+    lock_file.truncate(0)
+    lock_file.write(str(generation))
+    lock_file.flush()
+
+
+class JsonlFileDatabase(DatabaseAbstract):
+    """
+    JSON Lines journal database class
+    """
+    def __init__(self, db_path, other_data: dict = None):
+        self.db_path = db_path
+        self.other_data = other_data or {}
+        self.compaction_ratio = float(self.other_data.get(
+            "JSONL_DB_COMPACTION_RATIO",
+            os.environ.get("JSONL_DB_COMPACTION_RATIO",
+                           DEFAULT_JSONL_COMPACTION_RATIO)))
+        self.compaction_min_records = int(self.other_data.get(
+            "JSONL_DB_COMPACTION_MIN_RECORDS",
+            os.environ.get("JSONL_DB_COMPACTION_MIN_RECORDS",
+                           DEFAULT_JSONL_COMPACTION_MIN_RECORDS)))
+        self.init_db()
+
+    def init_db(self) -> dict:
+        """
+        Initialize the journal database, and returns its in-memory items
+        map. Records appended by other processes are read incrementally,
+        and the whole journal is reloaded if it was replaced (compacted).
+        """
+        with jsonl_db_locked(self.db_path):
+            if not os.path.exists(self.db_path):
+                open(self.db_path, 'a').close()
+            stat = os.stat(self.db_path)
+            generation = get_jsonl_db_generation(self.db_path)
+            state = jsonl_db_states.get(self.db_path)
+            if state is None or state["inode"] != stat.st_ino or \
+               state["generation"] != generation or \
+               stat.st_size < state["offset"]:
+                state = {
+                    "inode": stat.st_ino,
+                    "generation": generation,
+                    "offset": 0,
+                    "records": 0,
+                    "data": {},
+                    "compacting": False,
+                }
+                jsonl_db_states[self.db_path] = state
+            if stat.st_size > state["offset"]:
+                self.read_journal(state)
+            return state["data"]
+
+    def read_journal(self, state: dict):
+        """
+        Applies the journal records from the last read offset
+        """
+        with open(self.db_path, 'rb') as f:
+            f.seek(state["offset"])
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Incomplete record still being written
+                    break
+                state["offset"] += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    log_debug("JsonlFileDatabase.read_journal | "
+                              f"Invalid record: {line}", debug=DEBUG)
+                    continue
+                state["records"] += 1
+                self.apply_record(state["data"], record)
+
+    def apply_record(self, data: dict, record: dict):
+        """
+        Applies an upsert or delete record to the items map
+        """
+        if record.get("op") == "delete":
+            data.pop(record.get("id"), None)
+        else:
+            data[record["id"]] = record.get("item", {})
+
+    def append_record(self, record: dict):
+        """
+        Appends a record to the journal and applies it to the items map
+        """
+        self.append_records([record])
+
+    def append_records(self, records: List[dict]):
+        """
+        Appends the records to the journal with a single write, and
+        applies them to the items map
+        """
+        with jsonl_db_locked(self.db_path):
+            self.init_db()
+            state = jsonl_db_states[self.db_path]
+            lines = "".join(json.dumps(record) + "\n"
+                            for record in records).encode("utf-8")
+            with open(self.db_path, 'ab') as f:
+                # The journal was read up to the last complete record, and
+                # no other process can append holding the lock, so anything
+                # after it is a torn record (e.g. a crash in the middle of
+                # a write). It's truncated so the new records don't get
+                # appended to it.
+                if f.seek(0, os.SEEK_END) > state["offset"]:
+                    log_debug("JsonlFileDatabase.append_records | "
+                              f"Torn record truncated in {self.db_path}",
+                              debug=DEBUG)
+                    f.truncate(state["offset"])
+                f.write(lines)
+            state["offset"] += len(lines)
+            state["records"] += len(records)
+            for record in records:
+                self.apply_record(state["data"], record)
+            self.compact_if_needed(state)
+
+    def compact_if_needed(self, state: dict):
+        """
+        Starts the background compaction if the obsolete records ratio
+        exceeds the threshold. The caller must hold the database lock.
+        """
+        if state["compacting"] or \
+           state["records"] < self.compaction_min_records:
+            return
+        garbage_ratio = 1 - len(state["data"]) / state["records"]
+        if garbage_ratio <= self.compaction_ratio:
+            return
+        state["compacting"] = True
+        threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        """
+        Rewrites the journal with one upsert record per live item.
+        The snapshot is written without holding the lock; the records
+        appended meanwhile (also by other processes) are copied holding
+        it, before replacing the journal.
+        """
+        tmp_path = f"{self.db_path}.compact.{os.getpid()}"
+        try:
+            with jsonl_db_locked(self.db_path):
+                self.init_db()
+                state = jsonl_db_states[self.db_path]
+                snapshot = dict(state["data"])
+                snapshot_offset = state["offset"]
+                snapshot_generation = state["generation"]
+            with open(tmp_path, 'wb') as f:
+                for id, item in snapshot.items():
+                    f.write((json.dumps({
+                        "op": "upsert", "id": id, "item": item,
+                    }) + "\n").encode("utf-8"))
+            with jsonl_db_locked(self.db_path):
+                # Reads the records appended meanwhile by other processes
+                self.init_db()
+                state = jsonl_db_states[self.db_path]
+                if state["generation"] != snapshot_generation:
+                    log_debug("JsonlFileDatabase.compact | "
+                              f"{self.db_path} already compacted by another"
+                              " process", debug=DEBUG)
+                    os.remove(tmp_path)
+                    return
+                records = len(snapshot)
+                with open(self.db_path, 'rb') as src, \
+                     open(tmp_path, 'ab') as dst:
+                    src.seek(snapshot_offset)
+                    for line in src:
+                        if not line.endswith(b"\n"):
+                            # Torn record
+                            break
+                        dst.write(line)
+                        records += 1
+                os.replace(tmp_path, self.db_path)
+                set_jsonl_db_generation(self.db_path, snapshot_generation + 1)
+                stat = os.stat(self.db_path)
+                state.update({
+                    "inode": stat.st_ino,
+                    "generation": snapshot_generation + 1,
+                    "offset": stat.st_size,
+                    "records": records,
+                })
+            log_debug("JsonlFileDatabase.compact | "
+                      f"{self.db_path} compacted to {records} records",
+                      debug=DEBUG)
+        except Exception as e:
+            log_debug(f"JsonlFileDatabase.compact | ERROR: {e}",
+                      debug=DEBUG)
+        finally:
+            with jsonl_db_locked(self.db_path):
+                state = jsonl_db_states.get(self.db_path)
+                if state:
+                    state["compacting"] = False
+
+    def save_item(self, item_data: dict, id: str = None):
+        """
+        Save the item in the database
+        """
+        if not id:
+            id = str(uuid.uuid4())
+        self.append_record({
+            "op": "upsert",
+            "id": id,
+            "item": dict(item_data),
+        })
+        return id
+
+    def bulk_save_items(self, items: Dict[str, Dict]) -> int:
+        """
+        Save several items in the database with a single journal append
+        """
+        self.append_records([{
+            "op": "upsert",
+            "id": id,
+            "item": dict(item_data),
+        } for id, item_data in items.items()])
+        return len(items)
+
+    def get_list(
+        self,
+        sort_attr: str = None,
+        sort_order: str = "desc",
+        limit: int = None,
+        offset: int = 0,
+        fields: List[str] = None,
+        filter: dict = None,
+    ):
+        """
+        Returns the items in the database
+        """
+        with jsonl_db_locked(self.db_path):
+            json_db = dict(self.init_db())
+        return get_list_from_dict(json_db, sort_attr, sort_order, limit,
+                                  offset, fields, filter)
+
+    def iter_items(self, batch_size: int = DEFAULT_DB_BATCH_SIZE
+                   ) -> Iterator[dict]:
+        """
+        Yields all the items of the in-memory items map
+        """
+        with jsonl_db_locked(self.db_path):
+            json_db = dict(self.init_db())
+        for id, item in json_db.items():
+            item = item.copy()
+            item['id'] = id
+            yield item
+
+    def get_item(self, id: str):
+        """
+        Returns the item in the database
+        """
+        with jsonl_db_locked(self.db_path):
+            item = self.init_db().get(id)
+        if item is None:
+            return None
+        item = item.copy()
+        item['id'] = id
+        return item
+
+    def delete_item(self, id: str):
+        """
+        Delete a item from the database
+        """
+        with jsonl_db_locked(self.db_path):
+            if id in self.init_db():
+                self.append_record({
+                    "op": "delete",
+                    "id": id,
+                })
@@ -1,12 +1,57 @@
 """
 MongoDB database
 """
+from typing import List, Dict, Iterator
 import uuid
 import os
 
-from pymongo import MongoClient
+from pymongo import MongoClient, AsyncMongoClient, ReplaceOne
+from pymongo.errors import PyMongoError
 
-from lib.codegen_db_abstracts import DatabaseAbstract
+from lib.codegen_db_abstracts import (
+    DatabaseAbstract,
+    AsyncDatabaseAbstract,
+    DEFAULT_DB_BATCH_SIZE,
+)
+
+
+def get_mongodb_query(filter: dict = None) -> dict:
+    """
+    Returns the MongoDB query for a get_list() filter
+    """
+    query = {}
+    for attr, value in (filter or {}).items():
+        if isinstance(value, (list, tuple, set)):
+            query[attr] = {"$in": list(value)}
+        else:
+            query[attr] = value
+    return query
+
+
+def get_mongodb_projection(fields: List[str] = None, sort_attr: str = None
+                           ) -> dict:
+    """
+    Returns the MongoDB projection for the get_list() fields
+    """
+    if not fields:
+        return None
+    projection = {field: 1 for field in fields}
+    if sort_attr:
+        projection[sort_attr] = 1
+    return projection
+
+
+def get_mongodb_bulk_operations(items: Dict[str, Dict]) -> List[ReplaceOne]:
+    """
+    Returns the bulk_write() upsert operations for bulk_save_items()
+    """
+    operations = []
+    for id, item_data in items.items():
+        item_data = dict(item_data)
+        item_data.pop('id', None)
+        item_data['_id'] = id
+        operations.append(ReplaceOne({'_id': id}, item_data, upsert=True))
+    return operations
 
 
 class MongoDBDatabase(DatabaseAbstract):
@@ -28,20 +73,56 @@ class MongoDBDatabase(DatabaseAbstract):
         self.collection.replace_one({'_id': id}, item_data, upsert=True)
         return id
 
-    def get_list(self, sort_attr: str = None, sort_order: str = "desc"):
+    def bulk_save_items(self, items: Dict[str, Dict]) -> int:
         """
-        Returns the items in the MongoDB collection
+        Save several items in the MongoDB collection with a single
+        bulk_write() of upserts
+        """
+        if not items:
+            return 0
+        operations = get_mongodb_bulk_operations(items)
+        self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    def get_list(
+        self,
+        sort_attr: str = None,
+        sort_order: str = "desc",
+        limit: int = None,
+        offset: int = 0,
+        fields: List[str] = None,
+        filter: dict = None,
+    ):
+        """
+        Returns the items in the MongoDB collection. Filtering, projection
+        and pagination are done by MongoDB.
         """
-        sort_order = -1 if sort_order == "desc" else 1
+        cursor = self.collection.find(
+            get_mongodb_query(filter),
+            get_mongodb_projection(fields, sort_attr))
         if sort_attr:
-            items = list(self.collection.find().sort(sort_attr, sort_order))
-        else:
-            items = list(self.collection.find())
+            cursor = cursor.sort(sort_attr,
+                                 -1 if sort_order == "desc" else 1)
+        if offset:
+            cursor = cursor.skip(offset)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        items = list(cursor)
         # Assign id from _id field
         for item in items:
             item['id'] = str(item['_id'])  # Convert ObjectId to str
         return items
 
+    def iter_items(self, batch_size: int = DEFAULT_DB_BATCH_SIZE
+                   ) -> Iterator[dict]:
+        """
+        Yields all the items in the MongoDB collection, fetched by the
+        cursor in batches of batch_size documents
+        """
+        for item in self.collection.find().batch_size(batch_size):
+            item['id'] = str(item['_id'])  # Convert ObjectId to str
+            yield item
+
     def get_item(self, id: str):
         """
         Returns the item from the MongoDB collection
@@ -58,6 +139,22 @@ class MongoDBDatabase(DatabaseAbstract):
         """
         self.collection.delete_one({'_id': id})
 
+    def is_alive(self) -> bool:
+        """
+        Health check: returns True if the MongoDB server answers a ping
+        """
+        try:
+            self.client.admin.command('ping')
+            return True
+        except PyMongoError:
+            return False
+
+    def close(self):
+        """
+        Close the MongoDB client and its connection pool
+        """
+        self.client.close()
+
     def import_data_from_file(self, file_path: str = None):
         """
         Import data from a JSON file into the database
@@ -74,3 +171,97 @@ class MongoDBDatabase(DatabaseAbstract):
         if not file_path:
             file_path = os.environ.get('JSON_DB_PATH')
         return super().export_data_to_file(file_path, overwrite)
+
+
+class AsyncMongoDBDatabase(AsyncDatabaseAbstract):
+    """
+    Async MongoDB database class, using the PyMongo native asyncio client.
+    The client is bound to the event loop where it's first used.
+    """
+    def __init__(self, uri, db_name, collection_name):
+        super().__init__()
+        self.client = AsyncMongoClient(uri)
+        self.db = self.client[db_name]
+        self.collection = self.db[collection_name]
+
+    async def save_item(self, item_data: dict, id: str = None):
+        """
+        Save the item in the MongoDB collection
+        """
+        if not id:
+            id = str(uuid.uuid4())
+        item_data['_id'] = id
+        await self.collection.replace_one({'_id': id}, item_data,
+                                          upsert=True)
+        return id
+
+    async def bulk_save_items(self, items: Dict[str, Dict]) -> int:
+        """
+        Save several items in the MongoDB collection with a single
+        bulk_write() of upserts
+        """
+        if not items:
+            return 0
+        operations = get_mongodb_bulk_operations(items)
+        await self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    async def get_list(
+        self,
+        sort_attr: str = None,
+        sort_order: str = "desc",
+        limit: int = None,
+        offset: int = 0,
+        fields: List[str] = None,
+        filter: dict = None,
+    ):
+        """
+        Returns the items in the MongoDB collection
+        """
+        cursor = self.collection.find(
+            get_mongodb_query(filter),
+            get_mongodb_projection(fields, sort_attr))
+        if sort_attr:
+            cursor = cursor.sort(sort_attr,
+                                 -1 if sort_order == "desc" else 1)
+        if offset:
+            cursor = cursor.skip(offset)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        items = [item async for item in cursor]
+        # Assign id from _id field
+        for item in items:
+            item['id'] = str(item['_id'])  # Convert ObjectId to str
+        return items
+
+    async def get_item(self, id: str):
+        """
+        Returns the item from the MongoDB collection
+        """
+        item = await self.collection.find_one({'_id': id})
+        if item:
+            item['id'] = str(item['_id'])  # Convert ObjectId to str
+            return item
+        return None
+
+    async def delete_item(self, id: str):
+        """
+        Delete an item from the MongoDB collection
+        """
+        await self.collection.delete_one({'_id': id})
+
+    async def is_alive(self) -> bool:
+        """
+        Health check: returns True if the MongoDB server answers a ping
+        """
+        try:
+            await self.client.admin.command('ping')
+            return True
+        except PyMongoError:
+            return False
+
+    async def close(self):
+        """
+        Close the MongoDB client and its connection pool
+        """
+        await self.client.close()
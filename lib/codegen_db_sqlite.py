@@ -0,0 +1,223 @@
+"""
+SQLite database
+"""
+from typing import List, Dict, Iterator
+import json
+import uuid
+import sqlite3
+import threading
+
+from lib.codegen_db_abstracts import (
+    DatabaseAbstract,
+    DEFAULT_DB_BATCH_SIZE,
+    get_sort_key,
+    item_matches_filter,
+    paginate_items,
+)
+
+
+# Item attributes stored in their own indexed columns
+SQLITE_INDEXED_COLUMNS = ["timestamp", "type", "subtype"]
+
+
+class SqliteDatabase(DatabaseAbstract):
+    """
+    SQLite database class. Each item is a row with the indexed timestamp,
+    type and subtype columns, and the complete item as a JSON payload.
+    """
+    def __init__(self, db_path, table_name: str = "conversations"):
+        self.db_path = db_path
+        self.table_name = table_name
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.init_db()
+
+    def init_db(self):
+        """
+        Initialize the SQLite database: WAL mode, table and indexes
+        """
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table_name} ("
+                " id TEXT PRIMARY KEY,"
+                " timestamp REAL,"
+                " type TEXT,"
+                " subtype TEXT,"
+                " data TEXT NOT NULL)")
+            for column in SQLITE_INDEXED_COLUMNS:
+                self.connection.execute(
+                    "CREATE INDEX IF NOT EXISTS"
+                    f" idx_{self.table_name}_{column}"
+                    f" ON {self.table_name} ({column})")
+            self.connection.commit()
+
+    def get_row_values(self, item_data: dict, id: str) -> tuple:
+        """
+        Returns the row values for an item
+        """
+        return (
+            id,
+            item_data.get("timestamp"),
+            item_data.get("type"),
+            item_data.get("subtype"),
+            json.dumps(item_data, default=str),
+        )
+
+    def get_item_from_row(self, id: str, data: str) -> dict:
+        """
+        Returns the item from a row id and JSON payload
+        """
+        item = json.loads(data)
+        item['id'] = id
+        return item
+
+    def save_item(self, item_data: dict, id: str = None):
+        """
+        Save the item in the database
+        """
+        if not id:
+            id = str(uuid.uuid4())
+        item_data = dict(item_data)
+        item_data.pop('id', None)
+        with self.lock:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO {self.table_name}"
+                " (id, timestamp, type, subtype, data)"
+                " VALUES (?, ?, ?, ?, ?)",
+                self.get_row_values(item_data, id))
+            self.connection.commit()
+        return id
+
+    def bulk_save_items(self, items: Dict[str, Dict]) -> int:
+        """
+        Save several items in the database in a single transaction
+        """
+        rows = []
+        for id, item_data in items.items():
+            item_data = dict(item_data)
+            item_data.pop('id', None)
+            rows.append(self.get_row_values(item_data, id))
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(
+                    f"INSERT OR REPLACE INTO {self.table_name}"
+                    " (id, timestamp, type, subtype, data)"
+                    " VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def get_list(
+        self,
+        sort_attr: str = None,
+        sort_order: str = "desc",
+        limit: int = None,
+        offset: int = 0,
+        fields: List[str] = None,
+        filter: dict = None,
+    ):
+        """
+        Returns the items in the database. Filtering by and sorting by
+        indexed columns, and the pagination, are done by SQLite.
+        """
+        sql = f"SELECT id, data FROM {self.table_name}"
+        params = []
+        conditions = []
+        other_filter = {}
+        for attr, value in (filter or {}).items():
+            if attr not in SQLITE_INDEXED_COLUMNS:
+                other_filter[attr] = value
+            elif isinstance(value, (list, tuple, set)):
+                value = list(value)
+                conditions.append(
+                    f"{attr} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                conditions.append(f"{attr} = ?")
+                params.append(value)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql_sort = not sort_attr or sort_attr in SQLITE_INDEXED_COLUMNS
+        if sort_attr and sql_sort:
+            sql += f" ORDER BY {sort_attr}" + \
+                (" DESC" if sort_order == "desc" else " ASC")
+        sql_pagination = sql_sort and not other_filter
+        if sql_pagination and (limit is not None or offset):
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([-1 if limit is None else limit, offset or 0])
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        items = [self.get_item_from_row(id, data) for id, data in rows]
+        if other_filter:
+            items = [item for item in items
+                     if item_matches_filter(item, other_filter)]
+        if not sql_sort:
+            items = sorted(items, key=get_sort_key(sort_attr),
+                           reverse=sort_order == "desc")
+        if not sql_pagination:
+            items = paginate_items(items, limit, offset)
+        if fields:
+            keep = set(fields) | {'id'}
+            if sort_attr:
+                keep.add(sort_attr)
+            items = [{k: v for k, v in item.items() if k in keep}
+                     for item in items]
+        return items
+
+    def iter_items(self, batch_size: int = DEFAULT_DB_BATCH_SIZE
+                   ) -> Iterator[dict]:
+        """
+        Yields all the items in the database, reading them in rowid
+        order pages, so each page query is an index range scan
+        """
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    f"SELECT rowid, id, data FROM {self.table_name}"
+                    " WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, batch_size)).fetchall()
+            for rowid, id, data in rows:
+                yield self.get_item_from_row(id, data)
+            if len(rows) < batch_size:
+                return
+            last_rowid = rows[-1][0]
+
+    def get_item(self, id: str):
+        """
+        Returns the item in the database
+        """
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT id, data FROM {self.table_name} WHERE id = ?",
+                (id,)).fetchone()
+        if row:
+            return self.get_item_from_row(row[0], row[1])
+        return None
+
+    def delete_item(self, id: str):
+        """
+        Delete a item from the database
+        """
+        with self.lock:
+            self.connection.execute(
+                f"DELETE FROM {self.table_name} WHERE id = ?", (id,))
+            self.connection.commit()
+
+    def is_alive(self) -> bool:
+        """
+        Health check: returns True if the connection can run queries
+        """
+        try:
+            with self.lock:
+                self.connection.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def close(self):
+        """
+        Close the SQLite connection
+        """
+        with self.lock:
+            self.connection.close()
@@ -21,6 +21,10 @@ from lib.codegen_ai_utilities import (
     LlmProvider,
     ImageGenProvider,
 )
+from lib.codegen_video_jobs import (
+    video_job_manager,
+    VIDEO_JOB_COMPLETED,
+)
 from lib.codegen_powerpoint import PowerPointGenerator
 
 
@@ -191,7 +195,9 @@ class GeneralLib:
         # Get the model class
         llm_model = llm_text_model['class']
         # Get the suggestions from the AI
-        llm_response = llm_model.query(system_prompt, user_prompt)
+        llm_response = llm_model.query(
+            system_prompt, user_prompt,
+            cache_ttl=self.get_par_value("SUGGESTIONS_LLM_CACHE_TTL", 3600))
         log_debug("get_suggestions_from_ai | " +
                   f"response: {llm_response}", debug=DEBUG)
         if llm_response['error']:
@@ -276,7 +282,9 @@ class GeneralLib:
         prompt = "Give me a title for this question " \
                  f"(max length: {title_length*2}): {question}"
         # Get the title from the AI
-        llm_response = llm_model.query(prompt, "", unified=True)
+        llm_response = llm_model.query(
+            prompt, "", unified=True,
+            cache_ttl=self.get_par_value("TITLE_LLM_CACHE_TTL", 86400))
         log_debug("GENERATE_TITLE_FROM_QUESTION | " +
                   f"response: {llm_response}", debug=DEBUG)
         if llm_response['error']:
@@ -722,6 +730,11 @@ class GeneralLib:
         question: str = None,
         settings: dict = None
     ):
+        """
+        Perform an image generation request. If settings["images_count"] is
+        greater than 1, the images are generated concurrently and the
+        answer is the list of images.
+        """
         result = get_default_resultset()
         if not settings:
             settings = {}
@@ -760,16 +773,25 @@ class GeneralLib:
         model_params.update(self.get_model_configurations())
 
         llm_model = ImageGenProvider(model_params)
-
-        response = llm_model.image_gen(
-            question,
-            (self.get_par_value("REFINE_LLM_PROMPT_TEXT") if
-                self.get_prompt_enhancement_flag() else None)
-        )
+        prompt_enhancement_text = (
+            self.get_par_value("REFINE_LLM_PROMPT_TEXT") if
+            self.get_prompt_enhancement_flag() else None)
+        images_count = int(settings.get("images_count", 1))
+
+        if images_count > 1:
+            # Concurrent requests, with the answer as a list of images
+            response = llm_model.image_gen_batch(
+                question, images_count, prompt_enhancement_text)
+        else:
+            response = llm_model.image_gen(question, prompt_enhancement_text)
         if response['error']:
             result["error"] = True
             result["error_message"] = (
                 f"ERROR GL-IG-100: {response['error_message']}")
+        elif response.get('error_message'):
+            # Some images of the batch failed
+            other_data["error_message"] = (
+                f"ERROR GL-IG-110: {response['error_message']}")
 
         result.update({
             "type": "image",
@@ -787,6 +809,11 @@ class GeneralLib:
         previous_response: dict = None,
         settings: dict = None
     ):
+        """
+        Perform a video generation request and wait for the video. If
+        settings["background"] is True, it returns right after the request
+        with the video generation job state in result["job"].
+        """
         result = get_default_resultset()
         if not settings:
             settings = {}
@@ -864,22 +891,26 @@ class GeneralLib:
             "id": video_id,
         }
 
-        response = ttv_model.video_gen_followup(ttv_response)
-        if response['error']:
-            result["error"] = True
-            result["error_message"] = (
-                f"ERROR GL-VG-E030: {response['error_message']}")
-        elif response.get("video_url"):
-            video_url = response["video_url"]
+        # The video generation is checked by the video jobs scheduler, with
+        # the schedule learned from the previous videos durations
+        job = video_job_manager.submit(
+            video_id, ttv_response, model_params,
+            resumed=bool(previous_response))
+        if settings.get("background"):
+            # Return right away (see video_job_manager.get_job())
+            result["job"] = job
+            result.update(result["resultset"])
+            log_debug(f"video_generation | result: {result}", debug=DEBUG)
+            return result
+
+        job = video_job_manager.wait_for_job(video_id)
+        other_data["ttv_job"] = job
+        if job["status"] == VIDEO_JOB_COMPLETED:
+            video_url = job["video_url"]
         else:
             result["error"] = True
             result["error_message"] = (
-                "ERROR GL-VG-E040: Video generation failed."
-                " No video URL. Try again later by clicking"
-                " the corresponding previous answer.")
-            if response.get("ttv_followup_response"):
-                other_data["ttv_followup_response"] = \
-                    response["ttv_followup_response"]
+                f"ERROR GL-VG-E030: {job['error_message']}")
 
         if previous_response and result.get("error_message"):
             return error_resultset(
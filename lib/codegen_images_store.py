@@ -0,0 +1,321 @@
+"""
+Generated images store
+
+The generated images are streamed in chunks to a temporary file in
+IMAGES_DIRECTORY, hashing them on the fly, and stored with their SHA-256
+hash as the file name, so they're never held complete in memory and
+identical images are stored once.
+
+The images index (IMAGES_INDEX_PATH) maps the conversation IDs to the
+hashes of their images.
+
+The gallery thumbnails of the local images are generated with Pillow and
+cached on disk (THUMBNAILS_DIRECTORY), keyed by the image hash and the
+thumbnail size.
+"""
+from typing import AsyncIterator, Iterable, List, Optional, Union
+import os
+import re
+import json
+import hashlib
+import tempfile
+import threading
+
+from lib.codegen_utilities import (
+    log_debug,
+    create_dirs,
+)
+
+
+DEBUG = False
+
+DEFAULT_IMAGES_DIRECTORY = "./images"
+IMAGES_INDEX_FILENAME = "images_index.json"
+# Bytes read from the image responses at a time
+IMAGE_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Thumbnails maximum width and height, in pixels
+DEFAULT_THUMBNAIL_SIZE = 256
+THUMBNAIL_JPEG_QUALITY = 85
+
+# Content-addressed image file names, e.g. "hf_img_<sha256>.jpg"
+IMAGE_HASH_FILENAME_RE = re.compile(
+    r"^(?:[A-Za-z0-9]+_)*([0-9a-f]{64})\.[A-Za-z0-9]+$")
+
+
+def get_images_directory() -> str:
+    """
+    Returns the generated images directory
+    """
+    return os.environ.get("IMAGES_DIRECTORY", DEFAULT_IMAGES_DIRECTORY)
+
+
+def get_image_hash(image_path: str) -> Optional[str]:
+    """
+    Returns the SHA-256 hash of a content-addressed image from its file
+    name, or None if the file isn't named by its hash (e.g. a URL or an
+    image stored before the hashing)
+    """
+    match = IMAGE_HASH_FILENAME_RE.match(os.path.basename(str(image_path)))
+    return match.group(1) if match else None
+
+
+# Hashes of the images not named by their hash, by path, size and
+# modification time
+image_file_hashes = {}
+image_file_hashes_lock = threading.Lock()
+
+
+def get_image_file_hash(image_path: str) -> str:
+    """
+    Returns the SHA-256 hash of a local image: from its file name if it's
+    content-addressed, or computed reading it in chunks otherwise
+    """
+    image_hash = get_image_hash(image_path)
+    if image_hash:
+        return image_hash
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_size, stat.st_mtime)
+    with image_file_hashes_lock:
+        if key in image_file_hashes:
+            return image_file_hashes[key]
+    sha256 = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(IMAGE_STREAM_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    with image_file_hashes_lock:
+        image_file_hashes[key] = sha256.hexdigest()
+    return image_file_hashes[key]
+
+
+def get_thumbnails_directory() -> str:
+    """
+    Returns the thumbnails cache directory
+    """
+    return os.environ.get("THUMBNAILS_DIRECTORY",
+                          f"{get_images_directory()}/thumbnails")
+
+
+def get_thumbnail(image_path: str, size: int = None) -> Optional[str]:
+    """
+    Returns the path of the local image thumbnail (JPEG, at most size x
+    size pixels), generating it on first use. Returns None if the image
+    can't be thumbnailed (e.g. a URL, a missing file, or Pillow not
+    installed), so the caller can show the original image.
+    """
+    if not image_path or not os.path.isfile(str(image_path)):
+        return None
+    size = int(size or os.environ.get("THUMBNAIL_SIZE",
+                                      DEFAULT_THUMBNAIL_SIZE))
+    try:
+        thumbnail_path = f"{get_thumbnails_directory()}/" \
+            f"{get_image_file_hash(image_path)}_{size}.jpg"
+    except OSError as e:
+        log_debug(f"get_thumbnail | ERROR: {e}", debug=DEBUG)
+        return None
+    if os.path.exists(thumbnail_path):
+        return thumbnail_path
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        log_debug("get_thumbnail | Pillow not installed, using the"
+                  " original image", debug=DEBUG)
+        return None
+    create_dirs(get_thumbnails_directory())
+    fd, tmp_path = tempfile.mkstemp(dir=get_thumbnails_directory(),
+                                    prefix=".tmp_", suffix=".jpg")
+    try:
+        with os.fdopen(fd, "wb") as f, Image.open(image_path) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            image.convert("RGB").save(f, "JPEG",
+                                      quality=THUMBNAIL_JPEG_QUALITY)
+        os.replace(tmp_path, thumbnail_path)
+    except Exception as e:
+        log_debug(f"get_thumbnail | {image_path} ERROR: {e}", debug=DEBUG)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    return thumbnail_path
+
+
+class ImageFileWriter:
+    """
+    Writes an image to a temporary file chunk by chunk, computing its
+    SHA-256 hash, and stores it with the hash as the file name
+    """
+    def __init__(self, image_extension: str, prefix: str = "img_"):
+        self.image_extension = image_extension
+        self.prefix = prefix
+        self.directory = get_images_directory()
+        create_dirs(self.directory)
+        # Same directory as the final file, so it's renamed atomically
+        fd, self.tmp_path = tempfile.mkstemp(
+            dir=self.directory, prefix=".tmp_", suffix=f".{image_extension}")
+        self.file = os.fdopen(fd, "wb")
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self.file.write(chunk)
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> str:
+        """
+        Stores the image with its hash as the file name and returns its
+        path. If the same image is already stored, the temporary file is
+        discarded and the existing image path is returned.
+        """
+        self.file.close()
+        image_path = f"{self.directory}/{self.prefix}" \
+            f"{self.sha256.hexdigest()}.{self.image_extension}"
+        if os.path.exists(image_path):
+            os.remove(self.tmp_path)
+            log_debug(f"ImageFileWriter.commit | Duplicated: {image_path}",
+                      debug=DEBUG)
+        else:
+            os.replace(self.tmp_path, image_path)
+            log_debug(f"ImageFileWriter.commit | Stored: {image_path}"
+                      f" ({self.size} bytes)", debug=DEBUG)
+        return image_path
+
+    def discard(self):
+        """
+        Removes the temporary file
+        """
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def save_image_stream(
+    chunks: Iterable[bytes],
+    image_extension: str,
+    prefix: str = "img_",
+) -> str:
+    """
+    Stores the image chunks (e.g. a requests response iter_content()) as a
+    content-addressed image and returns its path
+    """
+    writer = ImageFileWriter(image_extension, prefix)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+    except BaseException:
+        writer.discard()
+        raise
+    return writer.commit()
+
+
+async def asave_image_stream(
+    chunks: AsyncIterator[bytes],
+    image_extension: str,
+    prefix: str = "img_",
+) -> str:
+    """
+    Stores the image async chunks (e.g. a httpx response aiter_bytes()) as
+    a content-addressed image and returns its path. Each chunk write is a
+    small local disk write, done in the event loop.
+    """
+    writer = ImageFileWriter(image_extension, prefix)
+    try:
+        async for chunk in chunks:
+            writer.write(chunk)
+    except BaseException:
+        writer.discard()
+        raise
+    return writer.commit()
+
+
+class ImagesIndex:
+    """
+    Index of the content-addressed images hashes of each conversation,
+    stored as a JSON file
+    """
+    def __init__(self, index_path: str = None):
+        self.index_path = index_path
+        self.data = None
+        self.lock = threading.Lock()
+
+    def get_index_path(self) -> str:
+        """
+        Returns the index file path. It's resolved on first use, after the
+        environment variables are loaded.
+        """
+        if not self.index_path:
+            self.index_path = os.environ.get(
+                "IMAGES_INDEX_PATH",
+                f"{get_images_directory()}/{IMAGES_INDEX_FILENAME}")
+        return self.index_path
+
+    def load(self) -> dict:
+        """
+        Returns the index data, reading it on first use. The caller must
+        hold the lock.
+        """
+        if self.data is None:
+            self.data = {}
+            if os.path.exists(self.get_index_path()):
+                try:
+                    with open(self.get_index_path()) as f:
+                        self.data = json.load(f)
+                except (OSError, ValueError) as e:
+                    log_debug(f"ImagesIndex.load | ERROR: {e}", debug=DEBUG)
+        return self.data
+
+    def write(self):
+        """
+        Writes the index to a temporary file and replaces the index file
+        with it. The caller must hold the lock.
+        """
+        create_dirs(os.path.dirname(self.get_index_path()) or ".")
+        tmp_path = f"{self.get_index_path()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.get_index_path())
+
+    def add_conversation(self, conversation_id: str,
+                         images: Union[str, List[str]]) -> List[str]:
+        """
+        Records the content-addressed images of a conversation and returns
+        their hashes
+        """
+        if not isinstance(images, list):
+            images = [images]
+        hashes = [image_hash for image_hash in map(get_image_hash, images)
+                  if image_hash]
+        if not hashes:
+            return hashes
+        with self.lock:
+            self.load()[conversation_id] = hashes
+            self.write()
+        return hashes
+
+    def get_hashes(self, conversation_id: str) -> List[str]:
+        """
+        Returns the images hashes of a conversation
+        """
+        with self.lock:
+            return list(self.load().get(conversation_id, []))
+
+    def get_conversations(self, image_hash: str) -> List[str]:
+        """
+        Returns the IDs of the conversations with the image
+        """
+        with self.lock:
+            return [conversation_id for conversation_id, hashes
+                    in self.load().items() if image_hash in hashes]
+
+    def remove_conversation(self, conversation_id: str):
+        """
+        Removes a conversation from the index. The image files are kept,
+        because they can be shared with other conversations or referenced
+        by the agent answers.
+        """
+        with self.lock:
+            if self.load().pop(conversation_id, None) is not None:
+                self.write()
+
+
+images_index = ImagesIndex()
@@ -65,11 +65,14 @@ class LlamaIndexCustomLLM(CustomLLM):
     def stream_complete(
         self, prompt: str, **kwargs: Any
     ) -> CompletionResponseGen:
-        self.final_response = self.query_custom_llm(prompt)
+        llm_response = self.query_custom_llm_stream(prompt)
         response = ""
-        for token in self.final_response:
+        for token in llm_response['stream']:
             response += token
             yield CompletionResponse(text=response, delta=token)
+        if llm_response['error']:
+            raise ValueError(f'ERROR: {llm_response["error_message"]}')
+        self.final_response = response
 
     def init_custom_llm(self, model_object: LlmProvider):
         self.model_object = model_object
@@ -87,3 +90,16 @@ class LlamaIndexCustomLLM(CustomLLM):
         if llm_response['error']:
             raise ValueError(f'ERROR: {llm_response["error_message"]}')
         return llm_response['response']
+
+    def query_custom_llm_stream(self, prompt: str, **kwargs: Any) -> dict:
+        if not self.model_object:
+            raise ValueError("Model object not initialized")
+        llm_response = self.model_object.query_stream(
+            prompt="",
+            question=prompt,
+            prompt_enhancement_text="",
+            unified=True,
+        )
+        if llm_response['error']:
+            raise ValueError(f'ERROR: {llm_response["error_message"]}')
+        return llm_response
@@ -479,30 +479,24 @@ class PydanticAiLib:
 
     # Agent entry point
 
-    def run_agent(
+    def get_run_params(
         self,
         user_input: str,
         messages: list,
         deps: dict = None
-    ) -> str:
+    ) -> dict:
         """
-        Run the agent with non-streaming text for the user_input prompt,
-        system_prompt and deps, message history and dependencies
-        for the PydanticAI agent.
+        Returns the PydanticAI agent run() parameters.
 
         Args:
             user_input (str): the user input prompt
             messages (list): the message history (list of dictionaries)
-            deps (dict): the dependencies. If not provided, it will
-                throw a ValueError exception.
+            deps (dict): the dependencies. If not provided, the ones set
+                with set_pydantic_ai_deps() are used.
 
         Returns:
-            str: the agent response
+            dict: the user_prompt, deps, message_history and model_settings
         """
-
-        if self.get_error_message():
-            return self.get_error_message()
-
         if not self.pydantic_ai_agent:
             self.pydantic_ai_agent = self.get_pydantic_ai_agent()
 
@@ -514,20 +508,73 @@ class PydanticAiLib:
         messages = self.convert_messages(messages)
 
         log_debug(
-            ">>> PydanticAiLib.run_agent [1]:"
+            ">>> PydanticAiLib.get_run_params:"
             f"\n | user_input: {user_input}"
             f"\n | model_settings: {self.model_settings}"
             f"\n | deps: {deps}"
             f"\n | messages: {messages}",
             debug=DEBUG)
 
-        # Run the agent in a stream
-        result = self.pydantic_ai_agent.run_sync(
-            user_input,
-            deps=deps,
-            message_history=messages,
-            model_settings=self.model_settings
-        )
-        log_debug(f">>> PydanticAiLib.run_agent [2]: {result.data}",
+        return {
+            "user_prompt": user_input,
+            "deps": deps,
+            "message_history": messages,
+            "model_settings": self.model_settings,
+        }
+
+    def run_agent(
+        self,
+        user_input: str,
+        messages: list,
+        deps: dict = None
+    ) -> str:
+        """
+        Run the agent with non-streaming text for the user_input prompt,
+        system_prompt and deps, message history and dependencies
+        for the PydanticAI agent.
+
+        Args:
+            user_input (str): the user input prompt
+            messages (list): the message history (list of dictionaries)
+            deps (dict): the dependencies. If not provided, it will
+                throw a ValueError exception.
+
+        Returns:
+            str: the agent response
+        """
+        if self.get_error_message():
+            return self.get_error_message()
+
+        run_params = self.get_run_params(user_input, messages, deps)
+        result = self.pydantic_ai_agent.run_sync(**run_params)
+        log_debug(f">>> PydanticAiLib.run_agent: {result.data}",
+                  debug=DEBUG)
+        return result.data
+
+    async def arun_agent(
+        self,
+        user_input: str,
+        messages: list,
+        deps: dict = None
+    ) -> str:
+        """
+        Async version of run_agent(): the agent runs in the caller event
+        loop, so other requests are served while it waits for the model
+        and the tools.
+
+        Args:
+            user_input (str): the user input prompt
+            messages (list): the message history (list of dictionaries)
+            deps (dict): the dependencies.
+
+        Returns:
+            str: the agent response
+        """
+        if self.get_error_message():
+            return self.get_error_message()
+
+        run_params = self.get_run_params(user_input, messages, deps)
+        result = await self.pydantic_ai_agent.run(**run_params)
+        log_debug(f">>> PydanticAiLib.arun_agent: {result.data}",
                   debug=DEBUG)
         return result.data
@@ -6,19 +6,27 @@ codegen_schema_generator.py
 import os
 # import sys
 import time
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import json
 import pprint
 
 import argparse
 
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader
+from llama_index.core import (
+    VectorStoreIndex,
+    SimpleDirectoryReader,
+    StorageContext,
+    load_index_from_storage,
+)
 
 from lib.codegen_ai_utilities import LlmProvider
 from lib.codegen_utilities import (
     get_default_resultset,
     read_file,
+    write_file_atomically,
 )
 from lib.codegen_utilities import get_app_config
 from lib.codegen_llamaindex_abstraction import LlamaIndexCustomLLM
@@ -51,9 +59,23 @@ DEFAULT_STREAM = ""
 
 DEFAULT_AGENTS_COUNT = 0
 
+# Maximum number of agent steps executed at the same time.
+# 0 means all the agent steps at once, 1 means sequential execution
+DEFAULT_MAX_PARALLEL_AGENTS = 0
+
 OLLAMA_BASE_URL = ""
 # OLLAMA_BASE_URL = "localhost:11434"
 
+DEFAULT_EMBEDDINGS_INDEX_DIR = "./embeddings_index"
+
+# Vector indexes loaded in this process, by persist directory, so they're
+# loaded from disk once and shared by the concurrent agent steps. Each
+# entry has the index and the sources manifest it was refreshed with.
+vector_indexes = {}
+vector_indexes_lock = threading.Lock()
+# Sources manifest persisted with the index
+SOURCES_MANIFEST_FILENAME = "sources_manifest.json"
+
 
 # Default prompt to generate the .json files for the frontend and backend
 SYSTEM_PROMPT = """
@@ -120,6 +142,10 @@ class ArgsClass:
         self.stream = params.get("stream", DEFAULT_STREAM)
         self.ollama_base_url = params.get("ollama_base_url", OLLAMA_BASE_URL)
         self.agents_count = params.get("agents_count", DEFAULT_AGENTS_COUNT)
+        self.max_parallel_agents = int(params.get(
+            "max_parallel_agents",
+            os.environ.get("MAX_PARALLEL_AGENTS",
+                           DEFAULT_MAX_PARALLEL_AGENTS)))
 
 
 class JsonGenerator:
@@ -134,6 +160,10 @@ class JsonGenerator:
         self.args = self.read_arguments(params)
         self.embeddings_sources_dir = self.params.get(
             "embeddings_sources_dir", "./embeddings_sources")
+        self.embeddings_index_dir = self.params.get(
+            "embeddings_index_dir",
+            os.environ.get("EMBEDDINGS_INDEX_DIR",
+                           DEFAULT_EMBEDDINGS_INDEX_DIR))
         self.reference_files = self.get_reference_files()
         self.system_prompt = SYSTEM_PROMPT
         self.user_input = self.get_user_input()
@@ -141,6 +171,7 @@ class JsonGenerator:
         self.final_summary = None
         self.provider_model_used = None
         self.model_config = {}
+        self.step_timings = []
 
     def read_arguments(self, params):
         """
@@ -208,6 +239,15 @@ class JsonGenerator:
             default=DEFAULT_AGENTS_COUNT,
             help=f'Number of agents to use. Default: {DEFAULT_AGENTS_COUNT}'
         )
+        parser.add_argument(
+            '--max_parallel_agents',
+            type=int,
+            default=int(os.environ.get("MAX_PARALLEL_AGENTS",
+                                       DEFAULT_MAX_PARALLEL_AGENTS)),
+            help='Maximum number of agent steps executed at the same time' +
+                 ' (0 = all at once, 1 = sequential). Default: ' +
+                 f'{DEFAULT_MAX_PARALLEL_AGENTS}'
+        )
         parser.add_argument(
             '--ollama_base_url',
             type=str,
@@ -367,14 +407,119 @@ class JsonGenerator:
         """
         llamaindex_llm = LlamaIndexCustomLLM()
         llamaindex_llm.init_custom_llm(self.get_llm_model_object(model))
-        documents = SimpleDirectoryReader(
-            self.embeddings_sources_dir).load_data()
-        index = VectorStoreIndex.from_documents(documents)
+        index = self.get_vector_index()
         query_engine = index.as_query_engine(llm=llamaindex_llm)
         response = query_engine.query(user_input)
         self.log_debug(f"get_index_response | response:\n{response}")
         return f"{response}"
 
+    def get_sources_manifest(self) -> list:
+        """
+        Returns the embeddings sources manifest: the directory, and the
+        name, size and modification time of each file. It only takes a
+        stat per file, so the sources are read and hashed only when it
+        changes.
+        """
+        return [os.path.abspath(self.embeddings_sources_dir)] + sorted(
+            [entry.name, entry.stat().st_size, entry.stat().st_mtime_ns]
+            for entry in os.scandir(self.embeddings_sources_dir)
+            # Same files as SimpleDirectoryReader (no hidden files)
+            if entry.is_file() and not entry.name.startswith("."))
+
+    def get_sources_manifest_path(self) -> str:
+        """
+        Returns the path of the sources manifest persisted with the index
+        """
+        return os.path.join(self.embeddings_index_dir,
+                            SOURCES_MANIFEST_FILENAME)
+
+    def read_sources_manifest(self) -> list:
+        """
+        Returns the sources manifest persisted with the index, or None
+        """
+        try:
+            with open(self.get_sources_manifest_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_vector_index(self) -> VectorStoreIndex:
+        """
+        Returns the embeddings sources vector index. It's persisted in
+        embeddings_index_dir, loaded once per process, and refreshed only
+        when the sources manifest changes, re-embedding the files whose
+        content hash changed. The loaded and up to date index is returned
+        without taking the lock.
+
+        The shared index is never modified, because other threads can be
+        querying it: the refresh is done on a copy loaded from disk, which
+        replaces it when it's ready.
+        """
+        manifest = self.get_sources_manifest()
+        entry = vector_indexes.get(self.embeddings_index_dir)
+        if entry and entry["manifest"] == manifest:
+            return entry["index"]
+        with vector_indexes_lock:
+            # Another thread could have refreshed it meanwhile
+            entry = vector_indexes.get(self.embeddings_index_dir)
+            if entry and entry["manifest"] == manifest:
+                return entry["index"]
+            index = None
+            if os.path.exists(
+               os.path.join(self.embeddings_index_dir, "docstore.json")):
+                start_time = self.log_procesing_time("Loading vector index")
+                index = load_index_from_storage(
+                    StorageContext.from_defaults(
+                        persist_dir=self.embeddings_index_dir))
+                self.log_procesing_time(start_time=start_time)
+                if self.read_sources_manifest() == manifest:
+                    # The sources didn't change since it was persisted
+                    vector_indexes[self.embeddings_index_dir] = {
+                        "index": index,
+                        "manifest": manifest,
+                    }
+                    return index
+            # The file path is the document ID, so the docstore hashes
+            # can be compared with the current files content
+            documents = SimpleDirectoryReader(
+                self.embeddings_sources_dir, filename_as_id=True).load_data()
+            if index is None:
+                start_time = self.log_procesing_time("Building vector index")
+                index = VectorStoreIndex.from_documents(documents)
+                changed = True
+                self.log_procesing_time(start_time=start_time)
+            else:
+                changed = self.refresh_vector_index(index, documents)
+            if changed:
+                index.storage_context.persist(
+                    persist_dir=self.embeddings_index_dir)
+            # The manifest was taken before reading the sources, so a file
+            # modified meanwhile triggers another refresh
+            write_file_atomically(self.get_sources_manifest_path(),
+                                  json.dumps(manifest))
+            vector_indexes[self.embeddings_index_dir] = {
+                "index": index,
+                "manifest": manifest,
+            }
+            return index
+
+    def refresh_vector_index(self, index: VectorStoreIndex,
+                             documents: list) -> bool:
+        """
+        Re-embeds the new and modified documents, and removes the deleted
+        ones from the index. Returns True if the index changed.
+        """
+        refreshed = index.refresh_ref_docs(documents)
+        changed = any(refreshed)
+        current_ids = set(document.doc_id for document in documents)
+        for ref_doc_id in list(index.ref_doc_info.keys()):
+            if ref_doc_id not in current_ids:
+                index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+                changed = True
+        self.log_debug("refresh_vector_index | "
+                       f"refreshed: {sum(refreshed)} | changed: {changed}")
+        return changed
+
     def get_model_response(self, model: str, prompt: str, user_input: str):
         """
         Returns the response from the index or the chat
@@ -470,12 +615,20 @@ class JsonGenerator:
 
         # Create a list of dictionaries with the name, path and content of each
         # reference file
+        # The files are read concurrently (they're mostly URLs), keeping
+        # the configuration order
+        with ThreadPoolExecutor(max_workers=max(1, len(ref_files))
+                                ) as executor:
+            contents = list(executor.map(
+                lambda ref_file: read_file(ref_file['path'],
+                                           read_file_params),
+                ref_files))
         ref_files_list = [
             {
                 'name': ref_file['name'],
                 'path': ref_file['path'],
-                'content': read_file(ref_file['path'], read_file_params),
-            } for ref_file in ref_files
+                'content': content,
+            } for ref_file, content in zip(ref_files, contents)
         ]
         return ref_files_list
 
@@ -528,9 +681,11 @@ class JsonGenerator:
 
         # Step # 2: Create agents, execute all agent steps, and get detailed
         # implementation for each step
+        # The agent steps only depend on the initial plan, so they're
+        # executed concurrently
         agents = [self.create_agent(i)
                   for i in range(1, self.args.agents_count + 1)]
-        implementations = [agent(initial_plan) for agent in agents]
+        implementations = self.run_agents(agents, initial_plan)
 
         # Step # 3: Combine everything to get the final summary from CEO
         self.final_input = \
@@ -549,6 +704,40 @@ class JsonGenerator:
         self.log_procesing_time(message="Main process", start_time=start_time)
         return response
 
+    def run_agents(self, agents: list, task: str) -> list:
+        """
+        Execute the agent steps in a thread pool of max_parallel_agents
+        workers, returning the responses in the same order as the agents,
+        and store each step elapsed time in self.step_timings
+        """
+        max_workers = self.args.max_parallel_agents or len(agents)
+        max_workers = max(1, min(max_workers, len(agents)))
+
+        def run_agent_step(step_number_and_agent):
+            step_number, agent = step_number_and_agent
+            start_time = time.time()
+            response = agent(task)
+            return {
+                "step": step_number,
+                "elapsed_time": round(time.time() - start_time, 2),
+                "response": response,
+            }
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # executor.map() preserves the agents order
+            results = list(executor.map(
+                run_agent_step, enumerate(agents, start=1)))
+
+        self.step_timings = [
+            {
+                "step": result["step"],
+                "elapsed_time": result["elapsed_time"],
+            } for result in results
+        ]
+        self.log_debug(f"Agent steps timings (max_workers: {max_workers}):")
+        self.log_debug_structured(self.step_timings)
+        return [result["response"] for result in results]
+
     def simple_processing(self):
         """
         Simple processing without agents
@@ -601,6 +790,8 @@ class JsonGenerator:
         }
         if self.final_input:
             response["other_data"]["final_input"] = self.final_input
+        if self.step_timings:
+            response["other_data"]["step_timings"] = self.step_timings
 
         return response
 
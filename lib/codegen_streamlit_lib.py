@@ -7,6 +7,8 @@ import time
 import json
 import uuid
 import html
+import functools
+import tempfile
 
 import streamlit as st
 
@@ -19,17 +21,31 @@ from lib.codegen_utilities import (
     is_an_url,
     path_exists,
 )
-from lib.codegen_db import CodegenDatabase
+from lib.codegen_db import get_shared_database
 from lib.codegen_ai_utilities import (
     TextToVideoProvider,
     LlmProvider,
     ImageGenProvider,
 )
+from lib.codegen_images_store import (
+    images_index,
+    get_thumbnail,
+)
+from lib.codegen_video_jobs import (
+    video_job_manager,
+    save_video_job_state,
+    VIDEO_JOB_PENDING,
+    VIDEO_JOB_COMPLETED,
+    VIDEO_JOB_FAILED,
+)
 from lib.codegen_powerpoint import PowerPointGenerator
 
 
 DEBUG = False
 
+# Attributes loaded for the side bar conversations list (besides "id")
+CONVERSATIONS_LIST_FIELDS = ["title", "type", "timestamp"]
+
 
 @st.dialog("Form validation")
 def show_popup(title: str, message: str, msg_type: str = "success"):
@@ -133,19 +149,35 @@ class StreamlitLib:
 
     def init_db(self):
         """
-        Initialize the JSON file database
+        Returns the conversations database shared by the process, so the
+        connections (e.g. the MongoDB client pool) are reused across the
+        Streamlit reruns and sessions
         """
         db_type = os.getenv('DB_TYPE')
         db = None
         if db_type == 'json':
-            db = CodegenDatabase("json", {
+            db = get_shared_database("json", {
                 "JSON_DB_PATH": os.getenv(
                     'JSON_DB_PATH',
                     self.get_par_value("CONVERSATION_DB_PATH")
                 ),
             })
+        if db_type == 'jsonl':
+            db = get_shared_database("jsonl", {
+                "JSONL_DB_PATH": os.getenv(
+                    'JSONL_DB_PATH',
+                    self.get_par_value("CONVERSATION_JSONL_DB_PATH")
+                ),
+            })
+        if db_type == 'sqlite':
+            db = get_shared_database("sqlite", {
+                "SQLITE_DB_PATH": os.getenv(
+                    'SQLITE_DB_PATH',
+                    self.get_par_value("CONVERSATION_SQLITE_DB_PATH")
+                ),
+            })
         if db_type == 'mongodb':
-            db = CodegenDatabase("mongodb", {
+            db = get_shared_database("mongodb", {
                 "MONGODB_URI": os.getenv('MONGODB_URI'),
                 "MONGODB_DB_NAME": os.getenv('MONGODB_DB_NAME'),
                 "MONGODB_COLLECTION_NAME": os.getenv('MONGODB_COLLECTION_NAME')
@@ -158,7 +190,32 @@ class StreamlitLib:
         """
         Update the side bar conversations from the database
         """
-        st.session_state.conversations = self.get_conversations()
+        page = st.session_state.get("conversations_page", 0)
+        page_size = self.get_conversations_page_size()
+        conversations = self.get_conversations(
+            limit=page_size + 1,
+            offset=page * page_size,
+            fields=CONVERSATIONS_LIST_FIELDS)
+        if not conversations and page > 0:
+            # The last page is now empty (e.g. its items were deleted)
+            st.session_state.conversations_page = page - 1
+            return self.update_conversations()
+        st.session_state.conversations_has_next = \
+            len(conversations) > page_size
+        st.session_state.conversations = conversations[:page_size]
+
+    def get_conversations_page_size(self) -> int:
+        """
+        Returns the number of conversations shown in the side bar
+        """
+        return int(self.get_par_value("CONVERSATIONS_PAGE_SIZE", 20))
+
+    def set_conversations_page(self, page: int):
+        """
+        Set the side bar conversations page, and load it from the database
+        """
+        st.session_state.conversations_page = max(page, 0)
+        self.update_conversations()
 
     def update_conversation(
         self,
@@ -201,17 +258,36 @@ class StreamlitLib:
             other_data = {}
         item.update(other_data)
         db.save_item(item, id)
+        if type == "image" and answer:
+            images_index.add_conversation(id, answer)
         self.update_conversations()
         self.recycle_suggestions()
         self.set_new_id(id)
         return id
 
-    def get_conversations(self):
+    def get_conversations(
+        self,
+        limit: int = None,
+        offset: int = 0,
+        fields: list = None,
+        filter: dict = None,
+    ):
         """
-        Returns the conversations in the database
+        Returns the conversations in the database, newest first
+
+        Args:
+            limit (int): maximum number of conversations to return.
+                Defaults to None (all of them).
+            offset (int): number of conversations to skip. Defaults to 0.
+            fields (list): attributes to return, besides "id" and
+                "timestamp". Defaults to None (all the attributes).
+            filter (dict): attribute values the conversations must have.
+                Defaults to None.
         """
         db = self.init_db()
-        conversations = db.get_list("timestamp", "desc")
+        conversations = db.get_list("timestamp", "desc", limit=limit,
+                                    offset=offset, fields=fields,
+                                    filter=filter)
         # Add the date_time field to each conversation
         for conversation in conversations:
             conversation['date_time'] = get_date_time(
@@ -237,6 +313,7 @@ class StreamlitLib:
         """
         db = self.init_db()
         db.delete_item(id)
+        images_index.remove_conversation(id)
         self.update_conversations()
 
     # Prompt suggestions
@@ -271,7 +348,9 @@ class StreamlitLib:
         # Get the model class
         llm_model = llm_text_model['class']
         # Get the suggestions from the AI
-        llm_response = llm_model.query(system_prompt, user_prompt)
+        llm_response = llm_model.query(
+            system_prompt, user_prompt,
+            cache_ttl=self.get_par_value("SUGGESTIONS_LLM_CACHE_TTL", 3600))
         log_debug("get_suggestions_from_ai | " +
                   f"response: {llm_response}", debug=DEBUG)
         if llm_response['error']:
@@ -431,10 +510,12 @@ class StreamlitLib:
         return title
 
     def get_conversation_title(self, conversation: dict):
-        return conversation.get(
-            "title",
-            self.get_title_from_question(conversation['question'])
-        )
+        if "title" in conversation:
+            return conversation["title"]
+        if "question" not in conversation:
+            # Projected conversation without title (e.g. old entries)
+            conversation = self.get_conversation(conversation["id"]) or {}
+        return self.get_title_from_question(conversation.get("question", ""))
 
     def generate_title_from_question(self, question: str) -> str:
         """
@@ -454,7 +535,9 @@ class StreamlitLib:
         prompt = "Give me a title for this question " \
                  f"(max length: {title_length*2}): {question}"
         # Get the title from the AI
-        llm_response = llm_model.query(prompt, "", unified=True)
+        llm_response = llm_model.query(
+            prompt, "", unified=True,
+            cache_ttl=self.get_par_value("TITLE_LLM_CACHE_TTL", 86400))
         log_debug("GENERATE_TITLE_FROM_QUESTION | " +
                   f"response: {llm_response}", debug=DEBUG)
         if llm_response['error']:
@@ -489,6 +572,24 @@ class StreamlitLib:
                     key=f"del_{conversation['id']}",
                     on_click=self.delete_conversation,
                     args=(conversation['id'],))
+        page = st.session_state.get("conversations_page", 0)
+        if page > 0 or st.session_state.get("conversations_has_next"):
+            col1, col2 = st.columns(2, gap="small")
+            with col1:
+                st.button(
+                    "< Newer",
+                    key="conversations_prev_page",
+                    disabled=page == 0,
+                    on_click=self.set_conversations_page,
+                    args=(page - 1,))
+            with col2:
+                st.button(
+                    "Older >",
+                    key="conversations_next_page",
+                    disabled=not st.session_state.get(
+                        "conversations_has_next"),
+                    on_click=self.set_conversations_page,
+                    args=(page + 1,))
 
     def set_last_retrieved_conversation(self, id: str, conversation: dict):
         """
@@ -574,6 +675,18 @@ class StreamlitLib:
                 st.write(conversation['refined_prompt'])
 
         if conversation['type'] == "video":
+            job = video_job_manager.get_job(id)
+            if not conversation.get('answer') and job and \
+               job["status"] != VIDEO_JOB_PENDING:
+                # Finished in the background since the conversation was
+                # retrieved
+                conversation = self.get_conversation(id) or conversation
+                conversation['ttv_job'] = job
+                if job["status"] == VIDEO_JOB_COMPLETED:
+                    conversation['answer'] = job["video_url"]
+                else:
+                    conversation['error_message'] = job["error_message"]
+                self.set_last_retrieved_conversation(id, conversation)
             if conversation.get('answer'):
                 # Check for list type entries, and show them individually
                 if isinstance(conversation['answer'], list):
@@ -589,10 +702,7 @@ class StreamlitLib:
                         self.verify_and_show_resource(
                             conversation['answer'], "video")
             else:
-                self.video_generation(
-                    result_container=container,
-                    question=conversation['question'],
-                    previous_response=conversation['ttv_response'])
+                self.show_video_job(container, conversation)
 
         elif conversation['type'] == "image":
             if conversation.get('answer'):
@@ -695,9 +805,8 @@ class StreamlitLib:
             with st.spinner(f"Processing {len(uploaded_files)} files..."):
                 for uploaded_file in uploaded_files:
                     uploaded_file_path = uploaded_file.name
-                    json_dict = json.loads(uploaded_file.getvalue())
                     db = self.init_db()
-                    response = db.import_data(json_dict)
+                    response = db.import_data_from_stream(uploaded_file)
                     if response['error']:
                         item_result = f"File: {uploaded_file_path}" \
                                     f" | ERROR: {response['error_message']}"
@@ -718,20 +827,30 @@ class StreamlitLib:
 
     def export_data(self, container: st.container):
         """
-        Export data from the database and send it to the user as a JSON file
+        Export data from the database and send it to the user as a JSON file.
+        The items are written one at a time to a temporary file, so the
+        export is never built as a single string. Streamlit still reads the
+        whole file into its in-memory media store to serve the download.
         """
         with st.spinner("Exporting data..."):
             db = self.init_db()
-            response = db.export_data()
-            if response['error']:
-                container.write(f"ERROR {response['error_message']}")
-                return
-            container.download_button(
-                label=f"{response['result']}. Click to download.",
-                data=response['json'],
-                file_name="data.json",
-                mime="application/json",
-            )
+            fd, file_path = tempfile.mkstemp(prefix="export_",
+                                             suffix=".json")
+            os.close(fd)
+            try:
+                response = db.export_data_to_file(file_path, overwrite=True)
+                if response['error']:
+                    container.write(f"ERROR {response['error_message']}")
+                    return
+                with open(file_path, 'rb') as f:
+                    container.download_button(
+                        label=f"{response['result']}. Click to download.",
+                        data=f,
+                        file_name="data.json",
+                        mime="application/json",
+                    )
+            finally:
+                os.remove(file_path)
 
     def data_management_components(self):
         """
@@ -1369,11 +1488,15 @@ class StreamlitLib:
                 prompt = other_data["system_prompt"]
             else:
                 prompt = "{question}"
-            response = llm_text_model.query(
+            response = llm_text_model.query_stream(
                 prompt, question,
                 (self.get_par_value("REFINE_LLM_PROMPT_TEXT") if
                  st.session_state.prompt_enhancement_flag else None)
             )
+            if not response['error']:
+                # Show the tokens as they arrive. Once the stream is
+                # consumed, response['response'] has the complete answer
+                result_container.write_stream(response['stream'])
             if response['error']:
                 other_data["error_message"] = (
                     f"ERROR E-100: {response['error_message']}")
@@ -1425,17 +1548,29 @@ class StreamlitLib:
             model_params.update(self.get_model_configurations())
 
             llm_model = ImageGenProvider(model_params)
-
-            response = llm_model.image_gen(
-                question,
-                (self.get_par_value("REFINE_LLM_PROMPT_TEXT") if
-                 st.session_state.prompt_enhancement_flag else None)
-            )
+            prompt_enhancement_text = (
+                self.get_par_value("REFINE_LLM_PROMPT_TEXT") if
+                st.session_state.prompt_enhancement_flag else None)
+            images_count = int(settings.get(
+                "images_count",
+                st.session_state.get("images_per_generation", 1)))
+
+            if images_count > 1:
+                response = self.image_generation_batch(
+                    result_container, llm_model, question, images_count,
+                    prompt_enhancement_text)
+            else:
+                response = llm_model.image_gen(
+                    question, prompt_enhancement_text)
             if response['error']:
                 # result_container.write(
                 #     f"ERROR E-IG-100: {response['error_message']}")
                 other_data["error_message"] = (
                     f"ERROR E-IG-100: {response['error_message']}")
+            elif response.get('error_message'):
+                # Some images of the batch failed
+                other_data["error_message"] = (
+                    f"ERROR E-IG-110: {response['error_message']}")
             self.save_conversation(
                 type="image",
                 question=question,
@@ -1446,6 +1581,36 @@ class StreamlitLib:
             # result_container.write(response['response'])
             st.rerun()
 
+    def image_generation_batch(
+        self,
+        result_container: st.container,
+        llm_model: ImageGenProvider,
+        question: str,
+        images_count: int,
+        prompt_enhancement_text: str = None,
+    ) -> dict:
+        """
+        Generate several images of the question concurrently, showing each
+        one as soon as it's generated
+        """
+        columns = result_container.columns(
+            int(self.get_par_value("IMAGE_GALLERY_COLUMNS", 3)))
+
+        def show_image(index: int, response: dict):
+            with columns[index % len(columns)]:
+                if response['error']:
+                    st.warning(
+                        f"ERROR E-IG-120: {response['error_message']}")
+                    return
+                images = response.get('response')
+                for url in images if isinstance(images, list) \
+                        else [images]:
+                    self.verify_and_show_resource(url, "image")
+
+        return llm_model.image_gen_batch(
+            question, images_count, prompt_enhancement_text,
+            on_image=show_image)
+
     def video_generation(
         self,
         result_container: st.container,
@@ -1501,15 +1666,11 @@ class StreamlitLib:
                         f"ERROR E-200: {response['error_message']}")
                     return
 
-        with st.spinner("Procesing video generation. It can take"
-                        " 2+ minutes..."):
-            #  Checking the video generation status
-            video_url = None
-            ttv_response = response.copy()
-            ttv_response['id'] = video_id
-
-            # Save a preliminar conversation with the video generation request
-            # follow-up data in the ttv_response attribute
+        ttv_response = response.copy()
+        ttv_response['id'] = video_id
+        if not previous_response:
+            # Save a preliminar conversation with the video generation
+            # request follow-up data in the ttv_response attribute
             other_data = {
                 "ttv_response": ttv_response,
                 "ai_provider": llm_provider,
@@ -1522,44 +1683,64 @@ class StreamlitLib:
                 type="video",
                 question=question,
                 refined_prompt=ttv_response.get('refined_prompt'),
-                answer=video_url,
+                answer=None,
                 other_data=other_data,
                 id=video_id,
             )
 
-            response = ttv_model.video_gen_followup(ttv_response)
-            if response['error']:
-                other_data["error_message"] = (
-                    f"ERROR E-300: {response['error_message']}")
-            elif response.get("video_url"):
-                video_url = response["video_url"]
-            else:
-                other_data["error_message"] = (
-                    "ERROR E-400: Video generation failed."
-                    " No video URL. Try again later by clicking"
-                    " the corresponding previous answer.")
-                if response.get("ttv_followup_response"):
-                    other_data["ttv_followup_response"] = \
-                        response["ttv_followup_response"]
-
-            if previous_response and other_data.get("error_message"):
-                result_container.warning(other_data["error_message"])
-                return
-
-            # Save the conversation with the video generation result
-            self.save_conversation(
-                type="video",
-                question=question,
-                refined_prompt=ttv_response.get('refined_prompt'),
-                answer=video_url,
-                other_data=other_data,
-                id=video_id,
-            )
+        # The video generation is checked in the background, and the job
+        # state and result are saved in the conversation
+        video_job_manager.submit(
+            video_id,
+            ttv_response,
+            model_params,
+            on_update=functools.partial(
+                save_video_job_state, self.init_db(), video_id),
+            resumed=bool(previous_response),
+        )
+        if not previous_response:
+            st.rerun()
 
-            if previous_response:
-                result_container.video(video_url)
-            else:
+    def show_video_job(self, container: st.container, conversation: dict):
+        """
+        Show the status of a video conversation without answer, refreshed
+        until its video generation job is finished
+        """
+        video_id = conversation['id']
+        job = video_job_manager.get_job(video_id)
+        job_state = job or conversation.get("ttv_job") or {}
+        if job_state.get("status") == VIDEO_JOB_FAILED:
+            with container.container():
+                self.show_conversation_debug(conversation)
+                st.warning("ERROR E-300: " + str(
+                    job_state.get("error_message") or
+                    conversation.get("error_message")))
+                if not st.button("Check again", key="video_job_retry"):
+                    return
+        if job is None or job["status"] == VIDEO_JOB_FAILED:
+            # The job is not running in this process (e.g. after a restart)
+            # or it failed: it's submitted again
+            self.video_generation(
+                result_container=container,
+                question=conversation['question'],
+                previous_response=conversation['ttv_response'])
+
+        @st.fragment(run_every=int(self.get_par_value(
+            "VIDEO_JOB_STATUS_REFRESH_INTERVAL", 10)))
+        def show_job_status():
+            job = video_job_manager.get_job(video_id)
+            if job and job["status"] != VIDEO_JOB_PENDING:
+                # Rerun the whole page to show the result
                 st.rerun()
+            self.show_conversation_debug(conversation)
+            message = "Processing video generation. It can take" \
+                " 2+ minutes..."
+            if job and job["checks"]:
+                message += f" (checked {job['checks']} times)"
+            st.info(message)
+
+        with container.container():
+            show_job_status()
 
     # Gallery management
 
@@ -1571,23 +1752,66 @@ class StreamlitLib:
                 E.g. "video" or "image".
         Returns:
             dict: A standard response dictionary with a "urls" key, which is
-                a list of URLs. Also includes a "error" and "error_message"
-                keys to report any errors that occurred.
+                a list of URLs, and an "items" key with the conversation
+                "id" and "url" of each one. Also includes a "error" and
+                "error_message" keys to report any errors that occurred.
         """
         response = get_default_resultset()
         response['urls'] = []
-        for conversation in st.session_state.conversations:
-            if conversation['type'] == item_type:
-                if conversation.get('answer'):
-                    # Check for list type entries, and add them individually
-                    # to the list so all entries must be strings urls
-                    if isinstance(conversation['answer'], list):
-                        for url in conversation['answer']:
-                            response['urls'].append(url)
-                    else:
-                        response['urls'].append(conversation['answer'])
+        response['items'] = []
+        conversations = self.get_conversations(
+            fields=["answer"],
+            filter={"type": item_type})
+        for conversation in conversations:
+            if conversation.get('answer'):
+                # Check for list type entries, and add them individually
+                # to the list so all entries must be strings urls
+                if isinstance(conversation['answer'], list):
+                    urls = conversation['answer']
+                else:
+                    urls = [conversation['answer']]
+                for url in urls:
+                    response['urls'].append(url)
+                    response['items'].append({
+                        "id": conversation['id'],
+                        "url": url,
+                    })
         return response
 
+    def set_gallery_page(self, item_type: str, page: int):
+        """
+        Set the gallery page
+        """
+        st.session_state[f"{item_type}_gallery_page"] = max(page, 0)
+
+    def set_gallery_selected(self, item_type: str, url: str = None):
+        """
+        Set the gallery item shown at full resolution
+        """
+        st.session_state[f"{item_type}_gallery_selected"] = url
+
+    def show_gallery_item(self, item_type: str, item: dict, key: str):
+        """
+        Show a gallery item preview: the thumbnail of the local images, and
+        a link to the videos (their poster frames would need the video
+        download). The item is loaded at full resolution when it's
+        selected.
+        """
+        url = item["url"]
+        if item_type == "image":
+            thumbnail = None if is_an_url(url) else get_thumbnail(url)
+            st.image(thumbnail or url)
+        elif is_an_url(url):
+            name = os.path.basename(url.split("?")[0]) or "Video"
+            st.markdown(f"[{name}]({url})")
+        else:
+            st.caption(os.path.basename(url))
+        st.button(
+            "View" if item_type == "image" else "Play",
+            key=f"{item_type}_gallery_item_{key}",
+            on_click=self.set_gallery_selected,
+            args=(item_type, url))
+
     def show_gallery(self, galley_type: str):
         """
         Show the gallery of videos or images
@@ -1628,20 +1852,52 @@ class StreamlitLib:
             )
 
         # Define video URLs
-        item_urls = self.get_item_urls(item_type)
-        if not item_urls['urls']:
+        items = self.get_item_urls(item_type)['items']
+        if not items:
             st.write(f"** No {name} found. Try again later. **")
             return
 
-        # Display videos in a 3-column layout
+        # The selected item is the only one loaded at full resolution
+        selected_url = st.session_state.get(f"{item_type}_gallery_selected")
+        if selected_url:
+            with st.container(border=True):
+                self.verify_and_show_resource(selected_url, item_type)
+                st.button(
+                    "Close",
+                    key=f"{item_type}_gallery_close",
+                    on_click=self.set_gallery_selected,
+                    args=(item_type, None))
+
+        # Display one page of previews in a 3-column layout
+        page_size = int(self.get_par_value("GALLERY_PAGE_SIZE", 12))
+        pages = (len(items) + page_size - 1) // page_size
+        page = min(st.session_state.get(f"{item_type}_gallery_page", 0),
+                   pages - 1)
         columns = self.get_par_value(f"{item_type.upper()}_GALLERY_COLUMNS", 3)
         cols = st.columns(columns)
-        for i, item_url in enumerate(item_urls['urls']):
+        for i, item in enumerate(
+                items[page * page_size:(page + 1) * page_size]):
             with cols[i % columns]:
-                if item_type == "video":
-                    st.video(item_url)
-                elif item_type == "image":
-                    st.image(item_url)
+                self.show_gallery_item(item_type, item, f"{page}_{i}")
+
+        if pages > 1:
+            col = st.columns(3, gap="small", vertical_alignment="center")
+            with col[0]:
+                st.button(
+                    "< Previous",
+                    key=f"{item_type}_gallery_prev_page",
+                    disabled=page == 0,
+                    on_click=self.set_gallery_page,
+                    args=(item_type, page - 1))
+            with col[1]:
+                st.write(f"Page {page + 1} of {pages}")
+            with col[2]:
+                st.button(
+                    "Next >",
+                    key=f"{item_type}_gallery_next_page",
+                    disabled=page >= pages - 1,
+                    on_click=self.set_gallery_page,
+                    args=(item_type, page + 1))
 
     # General functions
 
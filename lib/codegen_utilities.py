@@ -4,14 +4,32 @@ General utilities
 from typing import Any
 import time
 import os
+import re
 import json
+import hashlib
+import tempfile
+import threading
 
 import uuid
 import requests
+from requests.adapters import HTTPAdapter
 
 
 DEBUG = False
 
+# Downloaded files cache
+DEFAULT_HTTP_CACHE_DIR = "./db/http_cache"
+# Seconds a cached download is used without revalidating it with the server
+DEFAULT_HTTP_CACHE_MAX_AGE = 3600
+# Seconds to wait for the server on the downloads
+DEFAULT_HTTP_TIMEOUT = 30
+# URLs with a full commit SHA (e.g. GitHub ".../blob/<sha>/...") are
+# immutable, so they're never revalidated once cached
+PINNED_COMMIT_REGEX = re.compile(r"/[0-9a-f]{40}/")
+
+http_session = None
+http_session_lock = threading.Lock()
+
 
 def log_debug(message: Any, debug: bool = DEBUG) -> None:
     """
@@ -83,11 +101,7 @@ def read_file(file_path, params: dict = None):
                 "https://github.com",
                 "https://raw.githubusercontent.com")
             file_path = file_path.replace("blob/", "")
-        response = requests.get(file_path)
-        if response.status_code == 200:
-            content = response.text
-        else:
-            raise ValueError(f"Error reading file: {file_path}")
+        content = get_url_content(file_path, params)
     else:
         with open(file_path, 'r') as f:
             content = f.read()
@@ -107,6 +121,119 @@ def read_file(file_path, params: dict = None):
     return content
 
 
+def get_http_session() -> requests.Session:
+    """
+    Returns the process-wide requests session, so the downloads reuse
+    their keep-alive connections
+    """
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            http_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+            http_session.mount("https://", adapter)
+            http_session.mount("http://", adapter)
+        return http_session
+
+
+def write_file_atomically(file_path: str, content: str):
+    """
+    Writes the file content to a temporary file in the same directory and
+    replaces the file with it, so the concurrent readers never see it
+    partially written
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".",
+                                    prefix=".tmp_")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_http_cache_entry(content_path: str, meta_path: str) -> tuple:
+    """
+    Returns the cached (content, meta) of a URL, or (None, None) if it's
+    not cached or can't be read
+    """
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        with open(content_path, 'r') as f:
+            return f.read(), meta
+    except (OSError, ValueError) as e:
+        log_debug(f"GET_URL_CONTENT | Cache miss: {content_path} | {e}",
+                  debug=DEBUG)
+        return None, None
+
+
+def get_url_content(url: str, params: dict = None) -> str:
+    """
+    Downloads a URL content, using the on-disk HTTP cache:
+    * Pinned-commit URLs are never revalidated once cached.
+    * Other URLs are used without revalidation for HTTP_CACHE_MAX_AGE
+      seconds, then revalidated with ETag / Last-Modified.
+    * If the server can't be reached, the cached content is returned.
+    params.get("use_http_cache") False disables the cache.
+    """
+    if not params:
+        params = {}
+    timeout = float(os.environ.get("HTTP_TIMEOUT", DEFAULT_HTTP_TIMEOUT))
+    if not params.get("use_http_cache", True):
+        response = get_http_session().get(url, timeout=timeout)
+        if response.status_code != 200:
+            raise ValueError(f"Error reading file: {url}")
+        return response.text
+
+    cache_dir = os.environ.get("HTTP_CACHE_DIR", DEFAULT_HTTP_CACHE_DIR)
+    cache_key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    content_path = os.path.join(cache_dir, f"{cache_key}.content")
+    meta_path = os.path.join(cache_dir, f"{cache_key}.json")
+    cached_content, meta = read_http_cache_entry(content_path, meta_path)
+    if meta:
+        max_age = int(os.environ.get("HTTP_CACHE_MAX_AGE",
+                                     DEFAULT_HTTP_CACHE_MAX_AGE))
+        if PINNED_COMMIT_REGEX.search(url) or \
+           time.time() - meta.get("fetched_at", 0) < max_age:
+            log_debug(f"GET_URL_CONTENT | Cache hit: {url}", debug=DEBUG)
+            return cached_content
+
+    headers = {}
+    if meta and meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta and meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        response = get_http_session().get(url, headers=headers,
+                                          timeout=timeout)
+    except requests.exceptions.RequestException:
+        if meta:
+            return cached_content
+        raise
+
+    if response.status_code == 304 and meta:
+        log_debug(f"GET_URL_CONTENT | Not modified: {url}", debug=DEBUG)
+        content = cached_content
+    elif response.status_code == 200:
+        content = response.text
+        create_dirs(cache_dir)
+        write_file_atomically(content_path, content)
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+    else:
+        raise ValueError(f"Error reading file: {url}")
+    meta["fetched_at"] = time.time()
+    create_dirs(cache_dir)
+    write_file_atomically(meta_path, json.dumps(meta))
+    return content
+
+
 def is_an_url(element_url_or_path: str):
     """ Returns True if the string is an URL"""
     return element_url_or_path.startswith(
@@ -174,3 +301,15 @@ def fix_ollama_url(url, suffix="/v1"):
     if suffix and not url.endswith(suffix):
         url += suffix
     return url
+
+
+def prune_closed_loops_entries(registry: dict):
+    """
+    Removes the entries of the closed event loops from a registry keyed by
+    event loop. Each entry keeps its loop in the "loop" key, so a new loop
+    that gets the id of a garbage-collected one can be told apart.
+    The caller must hold the registry lock, if any.
+    """
+    for key in [key for key, entry in registry.items()
+                if entry["loop"].is_closed()]:
+        del registry[key]
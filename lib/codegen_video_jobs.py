@@ -0,0 +1,543 @@
+"""
+Video generation jobs
+
+The text-to-video generations take several minutes. Instead of blocking the
+caller while the generation is checked, the request is submitted as a job
+to a process-wide scheduler, that checks all the pending jobs from a shared
+asyncio event loop (running in a background thread), waiting between the
+checks of each job with exponential backoff and jitter.
+
+The check schedule is learned from the observed durations of the previous
+videos of the same provider and model (VideoJobDurationStats): the first
+check is done near the median duration (p50), followed by tighter checks
+until the 95th percentile (p95), and then by exponential backoff, so the
+videos are picked up soon after they're ready with fewer checks.
+
+The callers get the job state right away, and can poll it (get_job()),
+wait for it (wait_for_job(), await_job()) or subscribe to its completion
+(subscribe()). Each job state change is passed to the job on_update
+callback, e.g. to persist it in the conversations database
+(save_video_job_state()).
+"""
+from typing import Callable, Dict, Optional, Tuple
+from collections import deque
+import os
+import math
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+
+from lib.codegen_utilities import (
+    log_debug,
+    create_dirs,
+)
+from lib.codegen_ai_utilities import TextToVideoProvider
+
+
+DEBUG = False
+
+# Seconds between the video generation request and the first check
+DEFAULT_VIDEO_JOB_FIRST_CHECK_DELAY = 30
+# Each interval between checks is the previous one multiplied by this factor
+DEFAULT_VIDEO_JOB_BACKOFF_FACTOR = 1.5
+DEFAULT_VIDEO_JOB_MAX_INTERVAL = 120
+# Random variation of each interval (fraction), so the jobs submitted at the
+# same time don't check at the same time
+DEFAULT_VIDEO_JOB_JITTER = 0.2
+# Seconds since the job creation before it's considered failed
+DEFAULT_VIDEO_JOB_TIMEOUT = 900
+# Consecutive failed check requests (e.g. network errors) before the job
+# is considered failed
+DEFAULT_VIDEO_JOB_MAX_CHECK_ERRORS = 3
+# Seconds the finished jobs are kept in memory
+DEFAULT_VIDEO_JOB_RETENTION = 3600
+# Minimum seconds between checks
+DEFAULT_VIDEO_JOB_MIN_INTERVAL = 5
+# Checks between the p50 and the p95 durations
+DEFAULT_VIDEO_JOB_P95_CHECKS = 4
+
+# Observed durations kept by provider and model, and needed to use them
+DEFAULT_VIDEO_JOB_STATS_MAX_SAMPLES = 100
+DEFAULT_VIDEO_JOB_STATS_MIN_SAMPLES = 5
+DEFAULT_VIDEO_JOB_STATS_DB_PATH = "./db/video_job_stats.sqlite"
+
+VIDEO_JOB_PENDING = "pending"
+VIDEO_JOB_COMPLETED = "completed"
+VIDEO_JOB_FAILED = "failed"
+
+# Job attributes returned to the callers and persisted
+VIDEO_JOB_STATE_FIELDS = [
+    "id", "status", "request_id", "checks", "created_at", "updated_at",
+    "next_check_at", "video_url", "error_message",
+]
+
+
+def get_video_job_state(job: dict) -> dict:
+    """
+    Returns a copy of the job attributes that can be returned and persisted
+    """
+    return {field: job.get(field) for field in VIDEO_JOB_STATE_FIELDS}
+
+
+def get_video_job_stats_key(model_params: dict) -> str:
+    """
+    Returns the durations stats key of the job TextToVideoProvider
+    parameters: the provider and model name
+    """
+    return f"{model_params.get('provider')}/{model_params.get('model_name')}"
+
+
+def save_video_job_state(db, conversation_id: str, job_state: dict):
+    """
+    Persists the job state in the video conversation "ttv_job" attribute.
+    The video URL is assigned to the conversation answer when the job is
+    completed, and the error message is assigned when it fails.
+
+    Args:
+        db: conversations database (e.g. a CodegenDatabase).
+        conversation_id (str): the video conversation ID.
+        job_state (dict): the job state (see get_video_job_state()).
+    """
+    item = db.get_item(conversation_id)
+    if not item:
+        log_debug(f"save_video_job_state | Conversation {conversation_id}"
+                  " not found", debug=DEBUG)
+        return
+    item.pop("id", None)
+    item["ttv_job"] = job_state
+    if job_state["status"] == VIDEO_JOB_COMPLETED:
+        item["answer"] = job_state["video_url"]
+        item.pop("error_message", None)
+    elif job_state["status"] == VIDEO_JOB_FAILED:
+        item["error_message"] = job_state["error_message"]
+    db.save_item(item, conversation_id)
+
+
+def get_percentile(values: list, percentile: float) -> float:
+    """
+    Returns the nearest-rank percentile (0 to 100) of the sorted values
+    """
+    index = math.ceil(percentile / 100 * len(values)) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+class VideoJobDurationStats:
+    """
+    Observed video generation durations by stats key (provider and model),
+    with the last max_samples of each key in memory and optionally in a
+    SQLite database, so they survive restarts
+    """
+    def __init__(self, db_path: str = None,
+                 max_samples: int = DEFAULT_VIDEO_JOB_STATS_MAX_SAMPLES):
+        self.db_path = db_path
+        self.max_samples = max_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.db = None
+
+    def get_db(self) -> sqlite3.Connection:
+        """
+        Returns the SQLite connection, or None if it's not configured
+        """
+        if not self.db_path:
+            return None
+        if self.db is None:
+            create_dirs(os.path.dirname(self.db_path) or ".")
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS video_job_durations ("
+                " stats_key TEXT NOT NULL,"
+                " duration REAL NOT NULL,"
+                " finished_at REAL NOT NULL)")
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS video_job_durations_key"
+                " ON video_job_durations (stats_key, finished_at)")
+            self.db.commit()
+        return self.db
+
+    def get_samples(self, stats_key: str) -> deque:
+        """
+        Returns the stats key durations, loading them from the database on
+        first use. The caller must hold the lock.
+        """
+        if stats_key not in self.samples:
+            durations = []
+            db = self.get_db()
+            if db is not None:
+                durations = [row[0] for row in db.execute(
+                    "SELECT duration FROM video_job_durations"
+                    " WHERE stats_key = ? ORDER BY finished_at DESC"
+                    " LIMIT ?", (stats_key, self.max_samples))]
+            self.samples[stats_key] = deque(reversed(durations),
+                                            maxlen=self.max_samples)
+        return self.samples[stats_key]
+
+    def add_duration(self, stats_key: str, duration: float):
+        """
+        Records the duration of a finished video generation
+        """
+        with self.lock:
+            self.get_samples(stats_key).append(duration)
+            db = self.get_db()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT INTO video_job_durations"
+                    " (stats_key, duration, finished_at) VALUES (?, ?, ?)",
+                    (stats_key, duration, time.time()))
+                # Only the last max_samples are kept
+                db.execute(
+                    "DELETE FROM video_job_durations WHERE stats_key = ?"
+                    " AND rowid NOT IN (SELECT rowid"
+                    " FROM video_job_durations WHERE stats_key = ?"
+                    " ORDER BY finished_at DESC LIMIT ?)",
+                    (stats_key, stats_key, self.max_samples))
+                db.commit()
+            except sqlite3.Error as e:
+                log_debug(f"VideoJobDurationStats.add_duration | ERROR: {e}",
+                          debug=DEBUG)
+
+    def get_percentiles(self, stats_key: str, min_samples: int
+                        ) -> Optional[Tuple[float, float]]:
+        """
+        Returns the p50 and p95 durations of the stats key, or None if it
+        has less than min_samples durations
+        """
+        with self.lock:
+            durations = sorted(self.get_samples(stats_key))
+        if not durations or len(durations) < min_samples:
+            return None
+        return get_percentile(durations, 50), get_percentile(durations, 95)
+
+
+class VideoJobManager:
+    """
+    Process-wide video generation jobs scheduler
+    """
+    def __init__(self, params: dict = None):
+        self.params = params or {}
+        self.first_check_delay = float(self.get_param(
+            "first_check_delay", "VIDEO_JOB_FIRST_CHECK_DELAY",
+            DEFAULT_VIDEO_JOB_FIRST_CHECK_DELAY))
+        self.backoff_factor = float(self.get_param(
+            "backoff_factor", "VIDEO_JOB_BACKOFF_FACTOR",
+            DEFAULT_VIDEO_JOB_BACKOFF_FACTOR))
+        self.max_interval = float(self.get_param(
+            "max_interval", "VIDEO_JOB_MAX_INTERVAL",
+            DEFAULT_VIDEO_JOB_MAX_INTERVAL))
+        self.jitter = float(self.get_param(
+            "jitter", "VIDEO_JOB_JITTER", DEFAULT_VIDEO_JOB_JITTER))
+        self.timeout = float(self.get_param(
+            "timeout", "VIDEO_JOB_TIMEOUT", DEFAULT_VIDEO_JOB_TIMEOUT))
+        self.max_check_errors = int(self.get_param(
+            "max_check_errors", "VIDEO_JOB_MAX_CHECK_ERRORS",
+            DEFAULT_VIDEO_JOB_MAX_CHECK_ERRORS))
+        self.retention = float(self.get_param(
+            "retention", "VIDEO_JOB_RETENTION",
+            DEFAULT_VIDEO_JOB_RETENTION))
+        self.min_interval = float(self.get_param(
+            "min_interval", "VIDEO_JOB_MIN_INTERVAL",
+            DEFAULT_VIDEO_JOB_MIN_INTERVAL))
+        self.p95_checks = int(self.get_param(
+            "p95_checks", "VIDEO_JOB_P95_CHECKS",
+            DEFAULT_VIDEO_JOB_P95_CHECKS))
+        self.stats_min_samples = int(self.get_param(
+            "stats_min_samples", "VIDEO_JOB_STATS_MIN_SAMPLES",
+            DEFAULT_VIDEO_JOB_STATS_MIN_SAMPLES))
+        self.duration_stats = VideoJobDurationStats(
+            self.get_param("stats_db_path", "VIDEO_JOB_STATS_DB_PATH",
+                           DEFAULT_VIDEO_JOB_STATS_DB_PATH),
+            int(self.get_param("stats_max_samples",
+                               "VIDEO_JOB_STATS_MAX_SAMPLES",
+                               DEFAULT_VIDEO_JOB_STATS_MAX_SAMPLES)))
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+
+    def get_param(self, param_name: str, env_name: str, default_value):
+        """
+        Returns the parameter value, or the environment variable value
+        """
+        return self.params.get(param_name,
+                               os.environ.get(env_name, default_value))
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Returns the scheduler event loop, starting its thread on first use
+        """
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(
+                    target=self.loop.run_forever,
+                    name="video-jobs-scheduler",
+                    daemon=True)
+                self.thread.start()
+            return self.loop
+
+    def submit(
+        self,
+        job_id: str,
+        request_response: dict,
+        model_params: dict,
+        on_update: Callable[[dict], None] = None,
+        resumed: bool = False,
+    ) -> dict:
+        """
+        Schedules the checks of a video generation request and returns the
+        job state right away. A job with the same ID already pending is
+        not submitted again (e.g. a Streamlit rerun resuming it).
+
+        Args:
+            job_id (str): job ID, e.g. the video conversation ID.
+            request_response (dict): the video_gen() response.
+            model_params (dict): TextToVideoProvider parameters.
+            on_update (Callable): function called with the job state each
+                time it changes. It's called from a worker thread.
+            resumed (bool): True if the video was requested before (e.g.
+                a job resumed after a restart). Its duration is unknown, so
+                it isn't scheduled nor recorded with the durations stats.
+        """
+        now = time.time()
+        with self.lock:
+            self.remove_finished_jobs(now)
+            job = self.jobs.get(job_id)
+            if job and job["status"] == VIDEO_JOB_PENDING:
+                return get_video_job_state(job)
+            job = {
+                "id": job_id,
+                "status": VIDEO_JOB_PENDING,
+                "request_id": (request_response.get("response") or {}
+                               ).get("data"),
+                "checks": 0,
+                "check_errors": 0,
+                "stats_key": get_video_job_stats_key(model_params),
+                "resumed": resumed,
+                "last_pending_check_at": None,
+                "backoff_checks": 0,
+                "created_at": now,
+                "updated_at": now,
+                "next_check_at": None,
+                "video_url": None,
+                "error_message": None,
+                "request_response": request_response,
+                "model_params": model_params,
+                "on_update": on_update,
+                "listeners": [],
+                "done_event": threading.Event(),
+            }
+            self.jobs[job_id] = job
+            job_state = get_video_job_state(job)
+        asyncio.run_coroutine_threadsafe(self.run_job(job), self.get_loop())
+        log_debug(f"VideoJobManager.submit | job: {job_state}", debug=DEBUG)
+        return job_state
+
+    def remove_finished_jobs(self, now: float):
+        """
+        Removes the jobs finished more than retention seconds ago. The
+        caller must hold the lock.
+        """
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job["status"] != VIDEO_JOB_PENDING and
+                       now - job["updated_at"] > self.retention]:
+            del self.jobs[job_id]
+
+    def get_backoff_delay(self, initial_delay: float, checks: int
+                          ) -> float:
+        """
+        Returns the initial delay multiplied by the backoff factor for each
+        check, up to max_interval, with jitter
+        """
+        delay = min(initial_delay * self.backoff_factor ** checks,
+                    self.max_interval)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def get_next_check_delay(self, job: dict) -> float:
+        """
+        Returns the seconds to wait before the next check of the job.
+
+        With enough observed durations for the job provider and model, the
+        first check is done at the p50 duration, then every
+        (p95 - p50) / p95_checks seconds until the p95 duration, and then
+        with exponential backoff. Otherwise, the first check is done after
+        first_check_delay seconds, followed by exponential backoff.
+        """
+        percentiles = None
+        if not job["resumed"]:
+            percentiles = self.duration_stats.get_percentiles(
+                job["stats_key"], self.stats_min_samples)
+        if not percentiles:
+            return self.get_backoff_delay(self.first_check_delay,
+                                          job["checks"])
+        p50, p95 = percentiles
+        elapsed = time.time() - job["created_at"]
+        interval = max(self.min_interval, (p95 - p50) / self.p95_checks)
+        jitter = interval * random.uniform(-self.jitter, self.jitter)
+        if not job["checks"] and elapsed + self.min_interval < p50:
+            return max(self.min_interval, p50 - elapsed + jitter)
+        if elapsed + self.min_interval < p95:
+            return max(self.min_interval,
+                       min(interval, p95 - elapsed) + jitter)
+        job["backoff_checks"] += 1
+        return max(self.min_interval,
+                   self.get_backoff_delay(interval, job["backoff_checks"]))
+
+    def record_duration(self, job: dict, finished_at: float):
+        """
+        Records the duration of a completed job with the durations stats.
+        The video was finished between the last pending check and the
+        completed check (finished_at), so the duration is estimated at the
+        middle.
+        """
+        if job["resumed"]:
+            return
+        if job["last_pending_check_at"]:
+            finished_at = (job["last_pending_check_at"] + finished_at) / 2
+        duration = finished_at - job["created_at"]
+        log_debug(f"VideoJobManager.record_duration | job: {job['id']}"
+                  f" | {job['stats_key']} duration: {duration}", debug=DEBUG)
+        self.duration_stats.add_duration(job["stats_key"], duration)
+
+    async def run_job(self, job: dict):
+        """
+        Checks the job until the video generation is finished, it fails, or
+        it times out
+        """
+        try:
+            ttv_model = TextToVideoProvider(job["model_params"])
+        except Exception as e:
+            await self.update_job(
+                job, status=VIDEO_JOB_FAILED,
+                error_message=f"[E-VJ-010] {e}")
+            return
+        while True:
+            delay = self.get_next_check_delay(job)
+            if job["checks"] and \
+               time.time() + delay - job["created_at"] > self.timeout:
+                await self.update_job(
+                    job, status=VIDEO_JOB_FAILED,
+                    error_message="[E-VJ-020] Video generation timed out"
+                                  f" after {job['checks']} checks"
+                                  f" (request_id: {job['request_id']})")
+                return
+            await self.update_job(job, next_check_at=time.time() + delay)
+            await asyncio.sleep(delay)
+            try:
+                response = await ttv_model.avideo_gen_check(
+                    job["request_response"])
+            except Exception as e:
+                response = {"error": True, "error_message": str(e)}
+            log_debug(f"VideoJobManager.run_job | job: {job['id']}"
+                      f" | check response: {response}", debug=DEBUG)
+            if response["error"] and not response.get("response"):
+                # The check request failed: tried again on the next check
+                check_errors = job["check_errors"] + 1
+                if check_errors >= self.max_check_errors:
+                    await self.update_job(
+                        job, checks=job["checks"] + 1,
+                        status=VIDEO_JOB_FAILED,
+                        error_message="[E-VJ-030]"
+                                      f" {response['error_message']}")
+                    return
+                await self.update_job(job, checks=job["checks"] + 1,
+                                      check_errors=check_errors)
+                continue
+            if not response.get("finished"):
+                await self.update_job(job, checks=job["checks"] + 1,
+                                      check_errors=0,
+                                      last_pending_check_at=time.time())
+                continue
+            if response["error"]:
+                await self.update_job(
+                    job, checks=job["checks"] + 1,
+                    status=VIDEO_JOB_FAILED,
+                    error_message=response["error_message"])
+            else:
+                await asyncio.to_thread(self.record_duration, job,
+                                        time.time())
+                await self.update_job(
+                    job, checks=job["checks"] + 1,
+                    status=VIDEO_JOB_COMPLETED,
+                    video_url=response["video_url"],
+                    next_check_at=None)
+            return
+
+    async def update_job(self, job: dict, **changes):
+        """
+        Updates the job attributes, and reports the new state to the job
+        on_update callback and, if the job is finished, to its subscribers
+        """
+        with self.lock:
+            job.update(changes)
+            job["updated_at"] = time.time()
+            if job["status"] != VIDEO_JOB_PENDING:
+                job["next_check_at"] = None
+            job_state = get_video_job_state(job)
+            listeners = []
+            if job["status"] != VIDEO_JOB_PENDING:
+                listeners, job["listeners"] = job["listeners"], []
+        callbacks = listeners
+        if job["on_update"]:
+            callbacks = [job["on_update"]] + listeners
+        for callback in callbacks:
+            try:
+                # The callbacks can do blocking I/O (e.g. the database)
+                await asyncio.to_thread(callback, job_state)
+            except Exception as e:
+                log_debug(f"VideoJobManager.update_job | job: {job['id']}"
+                          f" | callback ERROR: {e}", debug=DEBUG)
+        if job["status"] != VIDEO_JOB_PENDING:
+            job["done_event"].set()
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """
+        Returns the job state, or None if the job is not in this process
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return get_video_job_state(job) if job else None
+
+    def subscribe(self, job_id: str, callback: Callable[[dict], None]
+                  ) -> bool:
+        """
+        Calls the callback with the job state when the job is finished, or
+        right away if it's already finished. Returns False if the job is
+        not in this process.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job:
+                return False
+            if job["status"] == VIDEO_JOB_PENDING:
+                job["listeners"].append(callback)
+                return True
+            job_state = get_video_job_state(job)
+        callback(job_state)
+        return True
+
+    def wait_for_job(self, job_id: str, timeout: float = None
+                     ) -> Optional[Dict]:
+        """
+        Waits for the job to finish, up to timeout seconds, and returns its
+        state
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if not job:
+            return None
+        job["done_event"].wait(timeout)
+        return self.get_job(job_id)
+
+    async def await_job(self, job_id: str, timeout: float = None
+                        ) -> Optional[Dict]:
+        """
+        Async version of wait_for_job()
+        """
+        return await asyncio.to_thread(self.wait_for_job, job_id, timeout)
+
+
+video_job_manager = VideoJobManager()
@@ -400,6 +400,21 @@ def add_models_selection():
                 help="Select the model to use for the text-to-video call")
 
     with st.expander("Model configuration (advanced)"):
+        # Images per generation slider | default: 1
+        col = st.columns(4, gap="small", vertical_alignment="bottom")
+        with col[0]:
+            st.slider(
+                "Images per generation",
+                min_value=1,
+                max_value=int(cgsl.get_par_value(
+                    "IMAGE_GENERATION_MAX_BATCH_SIZE", 8)),
+                value=1,
+                step=1,
+                key="images_per_generation",
+                help="Number of images generated concurrently for each"
+                     " text-to-image request.",
+            )
+
         # Temperature slider | default: 1.00
         col = st.columns(4, gap="small", vertical_alignment="bottom")
         with col[0]:
@@ -0,0 +1,95 @@
+"""
+JSON Lines journal database tests
+"""
+import os
+import tempfile
+import unittest
+import multiprocessing
+
+from lib.codegen_db_jsonl import (
+    JsonlFileDatabase,
+    jsonl_db_states,
+)
+
+
+def save_items(db_path: str, prefix: str, count: int):
+    """
+    Saves count items in the journal, reading the journal before each save
+    like a long running process
+    """
+    db = JsonlFileDatabase(db_path, {
+        # Compacts while the other writer appends
+        "JSONL_DB_COMPACTION_MIN_RECORDS": 50,
+        "JSONL_DB_COMPACTION_RATIO": 0.2,
+    })
+    for i in range(count):
+        db.get_list()
+        db.save_item({"name": f"{prefix}{i}"}, f"{prefix}{i}")
+        # Obsolete records, so the compaction is triggered
+        db.save_item({"name": f"{prefix}{i}", "updated": True},
+                     f"{prefix}{i}")
+
+
+class TestJsonlFileDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "db.jsonl")
+
+    def tearDown(self):
+        jsonl_db_states.pop(self.db_path, None)
+        self.tmp_dir.cleanup()
+
+    def reload(self) -> JsonlFileDatabase:
+        """
+        Returns a database instance that reads the journal from scratch,
+        as a new process would
+        """
+        jsonl_db_states.pop(self.db_path, None)
+        return JsonlFileDatabase(self.db_path)
+
+    def get_ids(self, db: JsonlFileDatabase) -> list:
+        return sorted(item["id"] for item in db.get_list())
+
+    def test_save_and_delete_reload(self):
+        db = self.reload()
+        db.save_item({"name": "w"}, "w")
+        db.save_item({"name": "x"}, "x")
+        db.delete_item("w")
+        db = self.reload()
+        self.assertEqual(self.get_ids(db), ["x"])
+        self.assertEqual(db.get_item("x")["name"], "x")
+
+    def test_save_after_torn_write(self):
+        db = self.reload()
+        db.save_item({"name": "w"}, "w")
+        # Crash in the middle of a record write
+        with open(self.db_path, "ab") as f:
+            f.write(b'{"op": "upsert", "id": "torn", "it')
+        db = self.reload()
+        self.assertEqual(self.get_ids(db), ["w"])
+        db.save_item({"name": "x"}, "x")
+        db = self.reload()
+        self.assertEqual(self.get_ids(db), ["w", "x"])
+        with open(self.db_path, "rb") as f:
+            self.assertNotIn(b"torn", f.read())
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires fork()")
+    def test_interleaved_writers(self):
+        context = multiprocessing.get_context("fork")
+        writers = [
+            context.Process(target=save_items,
+                            args=(self.db_path, prefix, 200))
+            for prefix in ["a", "b"]
+        ]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+            self.assertEqual(writer.exitcode, 0)
+        db = self.reload()
+        self.assertEqual(
+            self.get_ids(db),
+            sorted(f"{prefix}{i}" for prefix in ["a", "b"]
+                   for i in range(200)))
+        self.assertTrue(all(item.get("updated") for item in db.get_list()))